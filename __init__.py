@@ -5,7 +5,13 @@ Flask端口复用扩展
 通过一个主控服务器来分发请求到不同的应用实例。
 """
 
-from .port_sharing import enable_port_sharing, start_master_server, get_master_server_status
+from .port_sharing import (
+    enable_port_sharing, start_master_server, get_master_server_status, is_request_cancelled,
+    reload_app
+)
+from .scheduling import request_priority
+from .prefork import run_prefork_master
 
 __version__ = "1.0.0"
-__all__ = ["enable_port_sharing", "start_master_server", "get_master_server_status"]
\ No newline at end of file
+__all__ = ["enable_port_sharing", "start_master_server", "get_master_server_status",
+           "is_request_cancelled", "reload_app", "request_priority", "run_prefork_master"]
\ No newline at end of file
@@ -0,0 +1,277 @@
+"""
+asyncio主控服务器引擎
+在事件循环上接受连接、解析HTTP并等待应用的响应。等待中的请求只占用一个协程，
+不像werkzeug的多线程服务器那样每个连接占用一个线程，大量慢客户端不会耗尽线程。
+
+限制：请求体不流式传给应用。引擎先读完整个请求体（超过 body_spool_threshold 的部分写入临时文件），
+再把请求交给分发器，即使应用使用WSGI直通模式也是如此。
+"""
+
+import asyncio
+import concurrent.futures
+import io
+import logging
+import socket
+import tempfile
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from .http_protocol import (
+    CONTINUE_RESPONSE, HEADER_TERMINATOR, LAST_CHUNK, MAX_CHUNK_LINE_BYTES, MAX_HEADER_BYTES,
+    ProtocolError, RequestHead, build_environ, encode_chunk, error_response,
+    frame_response, parse_chunk_size, parse_request_head, start_wsgi
+)
+from .port_sharing import (
+    BODY_CHUNK_SIZE, MASTER_ROUTE_PREFIX, create_listen_socket, create_reuse_port_socket
+)
+
+logger = logging.getLogger(__name__)
+
+# 接收完整请求头的超时（秒），防止只发送一半请求头的慢客户端一直占用连接
+DEFAULT_HEADER_TIMEOUT = 10.0
+# 持久连接上两个请求之间、以及读取请求体时允许的空闲时间（秒）
+DEFAULT_IDLE_TIMEOUT = 5.0
+DEFAULT_BACKLOG = 1024
+# 流式响应体和管理路由可能阻塞，在这个大小的线程池中执行
+DEFAULT_BLOCKING_WORKERS = 16
+
+class AsyncMasterEngine:
+    """asyncio实现的主控服务器，接口与werkzeug的服务器一致（serve_forever / shutdown）
+
+    普通请求在事件循环中完成路由、入队和等待：应用工作线程完成future后，
+    事件循环通过 asyncio.wrap_future 收到响应，期间不占用任何线程。
+    """
+
+    def __init__(self, master_server, host: str, port: int, reuse_port: bool = False,
+                 header_timeout: float = DEFAULT_HEADER_TIMEOUT,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 backlog: int = DEFAULT_BACKLOG,
+                 blocking_workers: int = DEFAULT_BLOCKING_WORKERS):
+        self.master_server = master_server
+        self.header_timeout = header_timeout
+        self.idle_timeout = idle_timeout
+        if reuse_port:
+            self.socket = create_reuse_port_socket(host, port, backlog)
+        else:
+            self.socket = create_listen_socket(host, port, backlog)
+        self.server_address = self.socket.getsockname()[:2]
+        self.server_port = self.server_address[1]
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=blocking_workers,
+                                                              thread_name_prefix="async-master")
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.shutdown_event: Optional[asyncio.Event] = None
+        self.connections: Set[asyncio.Task] = set()
+        self.started = threading.Event()
+        self.stopped = threading.Event()
+
+    def serve_forever(self):
+        """在当前线程中运行事件循环，直到 shutdown() 被调用"""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.loop = loop
+        try:
+            loop.run_until_complete(self.serve())
+            # 取消仍在处理中的连接
+            tasks = list(self.connections)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            loop.close()
+            self.executor.shutdown(wait=False)
+            self.stopped.set()
+            self.started.set()
+
+    async def serve(self):
+        self.shutdown_event = asyncio.Event()
+        server = await asyncio.start_server(self.handle_connection, sock=self.socket, limit=MAX_HEADER_BYTES)
+        self.started.set()
+        try:
+            await self.shutdown_event.wait()
+        finally:
+            server.close()
+
+    def shutdown(self):
+        """停止事件循环并等待其退出，可在任意线程中调用"""
+        self.started.wait()
+        if not self.stopped.is_set():
+            try:
+                self.loop.call_soon_threadsafe(self.shutdown_event.set)
+            except RuntimeError:
+                pass  # 事件循环已经退出
+        self.stopped.wait()
+
+    @property
+    def connection_count(self) -> int:
+        """当前打开的客户端连接数"""
+        return len(self.connections)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """处理一个客户端连接上的所有请求（持久连接上按顺序逐个处理）"""
+        task = asyncio.current_task()
+        self.connections.add(task)
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        peer = writer.get_extra_info('peername')
+        client_address = tuple(peer[:2]) if peer else ('', 0)
+
+        try:
+            # 第一个请求之前的等待也算作接收请求头的时间
+            wait_timeout = self.header_timeout
+            while True:
+                head = await self.read_head(reader, wait_timeout)
+                if head is None:
+                    break
+                if not await self.handle_request(reader, writer, head, client_address):
+                    break
+                wait_timeout = self.idle_timeout
+        except ProtocolError as e:
+            logger.debug(f"来自 {client_address[0]} 的请求无效: {e}")
+            writer.write(error_response(e.status, str(e)))
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # 引擎停止时取消的连接，正常结束任务
+            pass
+        except Exception as e:
+            logger.error(f"处理连接 {client_address[0]}:{client_address[1]} 时出错: {e}")
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+    async def read_head(self, reader: asyncio.StreamReader, wait_timeout: float) -> Optional[RequestHead]:
+        """读取下一个请求头，客户端在请求之间关闭连接时返回None"""
+        first = await asyncio.wait_for(reader.read(1), wait_timeout)
+        if not first:
+            return None
+        try:
+            block = await asyncio.wait_for(reader.readuntil(HEADER_TERMINATOR), self.header_timeout)
+        except asyncio.LimitOverrunError:
+            raise ProtocolError('431 Request Header Fields Too Large', "请求头过大") from None
+        return parse_request_head(first + block)
+
+    async def read_body(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                        head: RequestHead) -> Tuple[Any, int]:
+        """读取完整的请求体，返回 (可读的流, 长度)；超过阈值的请求体写入临时文件"""
+        threshold = self.master_server.dispatcher.body_spool_threshold
+        if head.expects_continue:
+            writer.write(CONTINUE_RESPONSE)
+
+        if head.chunked:
+            body = tempfile.SpooledTemporaryFile(max_size=threshold)
+            size = 0
+            while True:
+                chunk_size = parse_chunk_size(await self.read_chunk_line(reader))
+                if not chunk_size:
+                    # 丢弃尾部头部，直到空行
+                    while await self.read_chunk_line(reader) != b'\r\n':
+                        pass
+                    break
+                await self.copy_body(reader, body, chunk_size)
+                if await asyncio.wait_for(reader.readexactly(2), self.idle_timeout) != b'\r\n':
+                    raise ProtocolError('400 Bad Request', "分块数据后缺少CRLF")
+                size += chunk_size
+            body.seek(0)
+            return body, size
+
+        length = head.content_length
+        body = io.BytesIO() if length <= threshold else tempfile.SpooledTemporaryFile(max_size=threshold)
+        await self.copy_body(reader, body, length)
+        body.seek(0)
+        return body, length
+
+    async def read_chunk_line(self, reader: asyncio.StreamReader) -> bytes:
+        """读取一行分块长度或尾部头部，过长的行按协议错误处理"""
+        try:
+            line = await asyncio.wait_for(reader.readuntil(b'\r\n'), self.idle_timeout)
+        except asyncio.LimitOverrunError:
+            raise ProtocolError('400 Bad Request', "分块长度行过长") from None
+        if len(line) > MAX_CHUNK_LINE_BYTES:
+            raise ProtocolError('400 Bad Request', "分块长度行过长")
+        return line
+
+    async def copy_body(self, reader: asyncio.StreamReader, body: Any, length: int):
+        """按 BODY_CHUNK_SIZE 分段把 length 字节写入请求体，不会一次缓冲整个分块"""
+        remaining = length
+        while remaining:
+            data = await asyncio.wait_for(reader.read(min(remaining, BODY_CHUNK_SIZE)), self.idle_timeout)
+            if not data:
+                raise asyncio.IncompleteReadError(b'', remaining)
+            body.write(data)
+            remaining -= len(data)
+
+    async def handle_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                             head: RequestHead, client_address: Tuple[str, int]) -> bool:
+        """处理一个请求并写出响应，返回连接是否可以继续复用"""
+        body, length = await self.read_body(reader, writer, head)
+        environ = build_environ(head, body, length, self.server_address, client_address)
+        loop = asyncio.get_event_loop()
+        try:
+            if environ['PATH_INFO'].startswith(MASTER_ROUTE_PREFIX):
+                # 管理路由经过Flask并读取加锁的统计，放到线程池中执行
+                status, headers, chunks = await loop.run_in_executor(
+                    self.executor, call_buffered, self.master_server.master_app, environ)
+                streaming = False
+            else:
+                # 客户端正常关闭时只能读到EOF，传输层要等连接被重置才进入关闭状态；
+                # disconnect_on_eof 为False时容忍半关闭，只看传输层
+                dispatcher = self.master_server.dispatcher
+                response = await dispatcher.dispatch_request_async(
+                    environ, lambda: writer.is_closing() or (dispatcher.disconnect_on_eof and reader.at_eof()))
+                status, headers, chunks = start_wsgi(response, environ)
+                # 流式响应体来自应用的生成器或上游连接，迭代时可能阻塞
+                streaming = not response.is_sequence
+        except Exception as e:
+            logger.error(f"处理请求 {head.method} {head.target} 时出错: {e}")
+            writer.write(error_response('500 Internal Server Error', "内部错误"))
+            body.close()
+            return False
+
+        try:
+            return await self.write_response(writer, head, status, headers, chunks, streaming)
+        finally:
+            body.close()
+
+    async def write_response(self, writer: asyncio.StreamWriter, head: RequestHead, status: str,
+                             headers: List[Tuple[str, str]], chunks: Iterable[bytes],
+                             streaming: bool) -> bool:
+        """写出响应头和响应体，写缓冲区满时等待客户端读取"""
+        framing = frame_response(head, status, headers)
+        loop = asyncio.get_event_loop()
+        writer.write(framing.head)
+        try:
+            if framing.send_body:
+                iterator = iter(chunks)
+                while True:
+                    if streaming:
+                        chunk = await loop.run_in_executor(self.executor, next, iterator, None)
+                    else:
+                        chunk = next(iterator, None)
+                    if chunk is None:
+                        break
+                    if chunk:
+                        writer.write(encode_chunk(chunk) if framing.chunked else chunk)
+                        await writer.drain()
+                if framing.chunked:
+                    writer.write(LAST_CHUNK)
+            await writer.drain()
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                if streaming:
+                    await loop.run_in_executor(self.executor, close)
+                else:
+                    close()
+        return framing.keep_alive
+
+def call_buffered(app, environ: Dict[str, Any]) -> Tuple[str, List[Tuple[str, str]], List[bytes]]:
+    """调用WSGI应用并读出全部响应体"""
+    status, headers, app_iter = start_wsgi(app, environ)
+    try:
+        return status, headers, list(app_iter)
+    finally:
+        close = getattr(app_iter, 'close', None)
+        if close is not None:
+            close()
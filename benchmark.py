@@ -0,0 +1,591 @@
+"""
+微基准测试 - 测量分发链路上各个环节的开销
+
+用法:
+    python -m flask_port_extension.benchmark dispatch
+    python -m flask_port_extension.benchmark routing
+    python -m flask_port_extension.benchmark allocations
+    python -m flask_port_extension.benchmark transport
+    python -m flask_port_extension.benchmark codec
+    python -m flask_port_extension.benchmark proxy
+    python -m flask_port_extension.benchmark slow_clients
+    python -m flask_port_extension.benchmark engines
+    python -m flask_port_extension.benchmark prefork
+    python -m flask_port_extension.benchmark reload
+"""
+
+import io
+import os
+import http.client
+import json
+import pickle
+import time
+import queue
+import socket
+import threading
+import multiprocessing
+import concurrent.futures
+import requests
+import random
+import hashlib
+import statistics
+import tracemalloc
+from flask import Flask, jsonify, request, Response
+from werkzeug.test import EnvironBuilder
+from werkzeug.wsgi import get_input_stream
+from .routing import PrefixTrie
+from .codec import encode_header, decode_header
+from .shm_transport import ShmRing, ShmChannel, shm_supported
+from .transport import send_frame, recv_frame
+from .prefork import PreforkMaster, default_process_count
+from .proxy import UpstreamProxy, start_upstream_server
+from .port_sharing import (
+    AppRequest, AppWrapper, MasterServer, read_request_body,
+    DISPATCH_MODE_WSGI, DISPATCH_MODE_TEST_CLIENT
+)
+
+def create_benchmark_app() -> Flask:
+    """创建用于基准测试的应用"""
+    app = Flask("benchmark_app")
+
+    @app.route('/ping', methods=['GET', 'POST'])
+    def ping():
+        return jsonify({"pong": True})
+
+    return app
+
+def print_timings(title: str, timings: list):
+    """输出耗时统计（单位：微秒）"""
+    timings_us = [t * 1e6 for t in timings]
+    print(f"   {title}:")
+    print(f"      平均: {statistics.mean(timings_us):.1f}µs")
+    print(f"      中位数: {statistics.median(timings_us):.1f}µs")
+    print(f"      95th百分位: {statistics.quantiles(timings_us, n=20)[18]:.1f}µs")
+
+def benchmark_dispatch_modes(iterations: int = 2000, body_size: int = 1024):
+    """比较test_client模式与WSGI直通模式的单请求分发开销"""
+    print(f"\n🏁 分发模式基准测试 (请求数: {iterations}, 请求体: {body_size}字节)")
+
+    app = create_benchmark_app()
+    wrapper = AppWrapper(app, "benchmark", "/bench", MasterServer())
+    body = b"x" * body_size
+
+    for mode in (DISPATCH_MODE_TEST_CLIENT, DISPATCH_MODE_WSGI):
+        timings = []
+        for i in range(iterations):
+            if mode == DISPATCH_MODE_WSGI:
+                # 主控服务器本来就持有environ，构造它的耗时不计入分发开销
+                environ = EnvironBuilder(path="/bench/ping", method="POST", data=body).get_environ()
+                app_request = AppRequest(i, "/bench/ping", "POST", "/bench/ping",
+                                         {}, b"", "", environ=environ)
+            else:
+                app_request = AppRequest(i, "/bench/ping", "POST", "/bench/ping",
+                                         {"Content-Type": "application/octet-stream"}, body, "")
+
+            started = time.perf_counter()
+            response = wrapper.process_request(app_request)
+            timings.append(time.perf_counter() - started)
+            assert response.status_code == 200
+
+        print_timings(mode, timings)
+
+def linear_longest_match(prefixes: dict, path: str):
+    """旧版的线性扫描查找，作为对照"""
+    best_match = ""
+    best_app_id = None
+    for prefix, app_id in prefixes.items():
+        if path.startswith(prefix) and len(prefix) > len(best_match):
+            best_match = prefix
+            best_app_id = app_id
+    return best_app_id
+
+def benchmark_prefix_lookup(lookups: int = 20000):
+    """比较前缀基数树与线性扫描在不同应用数量下的查找延迟"""
+    print(f"\n🏁 前缀查找基准测试 (每组查找次数: {lookups})")
+
+    rng = random.Random(42)
+    for count in (10, 1000, 10000):
+        prefixes = {f"/tenant{i}/api/v{i % 3}": f"app{i}" for i in range(count)}
+        trie = PrefixTrie()
+        for prefix, app_id in prefixes.items():
+            trie.insert(prefix, app_id)
+
+        keys = list(prefixes)
+        paths = [f"{rng.choice(keys)}/users/{i}" for i in range(lookups)]
+        # 线性扫描太慢，只抽样一部分
+        linear_paths = paths[:max(1, lookups * 10 // count)]
+
+        started = time.perf_counter()
+        for path in paths:
+            trie.longest_match(path)
+        trie_us = (time.perf_counter() - started) / len(paths) * 1e6
+
+        started = time.perf_counter()
+        for path in linear_paths:
+            linear_longest_match(prefixes, path)
+        linear_us = (time.perf_counter() - started) / len(linear_paths) * 1e6
+
+        print(f"   {count:>6} 个前缀: 基数树 {trie_us:.2f}µs/次, 线性扫描 {linear_us:.2f}µs/次")
+
+def create_body_app(payload: bytes) -> Flask:
+    """创建分块消费请求体、返回固定响应体的应用"""
+    app = Flask("body_benchmark_app")
+
+    @app.route('/upload', methods=['POST'])
+    def upload():
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: request.stream.read(65536), b''):
+            digest.update(chunk)
+        return Response(payload, mimetype='application/octet-stream')
+
+    return app
+
+def measure_peak_allocation(func) -> int:
+    """测量函数执行期间 tracemalloc 记录的峰值内存分配（字节），不区分复制与新建对象"""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak - baseline
+
+def benchmark_body_allocations(body_size: int = 512 * 1024, iterations: int = 5):
+    """比较旧版缓冲链路与按引用传递的链路处理单个请求时的峰值内存分配"""
+    print(f"\n🏁 每请求峰值内存分配基准测试 (请求体与响应体各 {body_size // 1024}KB)")
+
+    body = b"b" * body_size
+    payload = b"p" * body_size
+    app = create_body_app(payload)
+    wrapper = AppWrapper(app, "benchmark", "/bench", MasterServer())
+
+    def make_environ():
+        return EnvironBuilder(path="/bench/upload", method="POST", data=body,
+                              content_type="application/octet-stream").get_environ()
+
+    def legacy_pipeline(environ):
+        # 旧版：get_data() -> AppRequest -> test_client(data=) -> get_data() -> Response(bytes)
+        data = get_input_stream(environ).read()
+        app_request = AppRequest(0, "/bench/upload", "POST", "/bench/upload",
+                                 {"Content-Type": "application/octet-stream"}, data, "")
+        with app.test_client() as client:
+            response = client.open(method="POST", path="/upload", headers=app_request.headers,
+                                   data=app_request.data)
+            response_data = response.get_data()
+        for chunk in Response(response_data).iter_encoded():
+            pass
+
+    def test_client_pipeline(environ):
+        app_request = AppRequest(0, "/bench/upload", "POST", "/bench/upload",
+                                 {"Content-Type": "application/octet-stream"},
+                                 read_request_body(environ), "")
+        for chunk in wrapper.process_request(app_request).body:
+            pass
+
+    def wsgi_pipeline(environ):
+        app_request = AppRequest(0, "/bench/upload", "POST", "/bench/upload",
+                                 {}, b"", "", environ=dict(environ))
+        for chunk in wrapper.process_request(app_request).body:
+            pass
+
+    pipelines = [
+        ("旧版缓冲链路", legacy_pipeline),
+        ("test_client + memoryview", test_client_pipeline),
+        ("wsgi 直通", wsgi_pipeline),
+    ]
+    for title, pipeline in pipelines:
+        samples = []
+        for _ in range(iterations):
+            environ = make_environ()
+            samples.append(measure_peak_allocation(lambda: pipeline(environ)))
+        allocated = statistics.median(samples)
+        print(f"   {title:<26}: 峰值分配 {allocated / 1024:8.0f}KB/请求, 约 {allocated / body_size:.1f} 份请求体大小")
+
+def echo_frames(channel):
+    """子进程：把收到的帧原样发回，通道关闭时退出"""
+    while True:
+        try:
+            header, body = recv_frame(channel)
+        except ConnectionError:
+            return
+        send_frame(channel, header, body)
+
+def echo_queue(inbox, outbox):
+    """把队列中的消息原样放回另一个队列，收到None时退出"""
+    while True:
+        item = inbox.get()
+        if item is None:
+            return
+        outbox.put(item)
+
+def measure_round_trips(round_trip, iterations: int) -> list:
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        round_trip()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+def benchmark_transport(iterations: int = 2000):
+    """比较线程队列、进程队列、Unix域套接字与共享内存环形缓冲区的请求往返延迟"""
+    print(f"\n🏁 主控与应用之间的传输基准测试 (每组往返次数: {iterations})")
+    
+    # 传输fork出的子进程中回显；线程队列是进程内的原有方式，作为下限参照
+    context = multiprocessing.get_context('fork')
+    header = {'type': 'request', 'id': 1, 'method': 'POST', 'path': '/bench/ping',
+              'headers': [['Content-Type', 'application/json'], ['Host', 'localhost']],
+              'query_string': ''}
+    
+    for size in (256, 1024 * 1024):
+        payload = os.urandom(size)
+        rounds = iterations if size < 65536 else max(1, iterations // 10)
+        print(f"   消息体 {size}字节:")
+        results = []
+        
+        inbox, outbox = queue.Queue(), queue.Queue()
+        worker = threading.Thread(target=echo_queue, args=(inbox, outbox), daemon=True)
+        worker.start()
+        def thread_queue_round_trip():
+            inbox.put((header, payload))
+            outbox.get()
+        results.append(("queue.Queue (线程)", measure_round_trips(thread_queue_round_trip, rounds)))
+        inbox.put(None)
+        
+        inbox, outbox = context.Queue(), context.Queue()
+        child = context.Process(target=echo_queue, args=(inbox, outbox), daemon=True)
+        child.start()
+        def process_queue_round_trip():
+            inbox.put((header, payload))
+            outbox.get()
+        results.append(("multiprocessing.Queue", measure_round_trips(process_queue_round_trip, rounds)))
+        inbox.put(None)
+        child.join()
+        
+        parent_sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        child = context.Process(target=echo_frames, args=(child_sock,), daemon=True)
+        child.start()
+        def socket_round_trip():
+            send_frame(parent_sock, header, payload)
+            recv_frame(parent_sock)
+        results.append(("Unix域套接字", measure_round_trips(socket_round_trip, rounds)))
+        parent_sock.shutdown(socket.SHUT_WR)
+        child.join()
+        parent_sock.close()
+        child_sock.close()
+        
+        if shm_supported():
+            requests, responses = ShmRing.create(), ShmRing.create()
+            child = context.Process(target=echo_frames, args=(ShmChannel(tx=responses, rx=requests),),
+                                    daemon=True)
+            child.start()
+            channel = ShmChannel(tx=requests, rx=responses)
+            def shm_round_trip():
+                send_frame(channel, header, payload)
+                recv_frame(channel)
+            results.append(("共享内存环形缓冲区", measure_round_trips(shm_round_trip, rounds)))
+            channel.close()
+            child.join()
+            channel.release()
+        
+        for title, timings in results:
+            timings_us = [t * 1e6 for t in timings]
+            print(f"      {title:<24}: 中位数 {statistics.median(timings_us):8.1f}µs, "
+                  f"95th百分位 {statistics.quantiles(timings_us, n=20)[18]:8.1f}µs")
+
+def realistic_headers() -> dict:
+    """浏览器请求、带令牌的API请求和应用响应三类典型帧头部"""
+    browser = {
+        'type': 'request', 'id': 18446, 'method': 'GET', 'path': '/shop/products/1842',
+        'query_string': 'ref=home&utm_source=newsletter', 'timeout': 29.5,
+        'headers': [
+            ('Host', 'www.example.com'),
+            ('User-Agent', 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                           'Chrome/126.0.0.0 Safari/537.36'),
+            ('Accept', 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8'),
+            ('Accept-Language', 'zh-CN,zh;q=0.9,en;q=0.8'),
+            ('Accept-Encoding', 'gzip, deflate, br'),
+            ('Referer', 'https://www.example.com/shop/'),
+            ('Cookie', 'session=eyJ1c2VyIjo0MiwiY2FydCI6WzEsMiwzXX0.ZmFrZS1zaWduYXR1cmU; theme=dark; '
+                       '_ga=GA1.1.123456789.1700000000'),
+            ('Upgrade-Insecure-Requests', '1'),
+            ('Sec-Fetch-Dest', 'document'),
+            ('Sec-Fetch-Mode', 'navigate'),
+            ('Sec-Fetch-Site', 'same-origin'),
+            ('Connection', 'keep-alive'),
+        ]
+    }
+    api = {
+        'type': 'request', 'id': 18447, 'method': 'POST', 'path': '/api/v2/orders',
+        'query_string': '', 'timeout': None,
+        'headers': [
+            ('Host', 'api.example.com'),
+            ('Content-Type', 'application/json'),
+            ('Content-Length', '512'),
+            ('Authorization', 'Bearer ' + 'a' * 180),
+            ('X-Request-Id', '0b6f1c9e-4a53-4c1b-9d0e-3f0b2a7c8d11'),
+            ('X-Request-Priority', 'high'),
+            ('User-Agent', 'python-requests/2.32.3'),
+        ]
+    }
+    response = {
+        'type': 'response', 'id': 18446, 'status': 200, 'service_time': 0.0042,
+        'headers': [
+            ('Content-Type', 'text/html; charset=utf-8'),
+            ('Content-Length', '48213'),
+            ('Cache-Control', 'private, max-age=0'),
+            ('Set-Cookie', 'session=eyJ1c2VyIjo0Mn0.ZmFrZQ; HttpOnly; Path=/; SameSite=Lax'),
+            ('Vary', 'Cookie'),
+        ]
+    }
+    return {"浏览器请求": browser, "API请求": api, "应用响应": response}
+
+def benchmark_codec(iterations: int = 20000):
+    """比较二进制帧头部与pickle、JSON、msgpack的编解码开销和体积"""
+    print(f"\n🏁 帧头部编解码基准测试 (每组 {iterations} 次编码+解码)")
+    
+    codecs = [
+        ("二进制帧", lambda header: encode_header(header), lambda encoded: decode_header(*encoded),
+         lambda encoded: len(encoded[1])),
+        ("JSON", lambda header: json.dumps(header, separators=(',', ':')).encode('utf-8'),
+         lambda encoded: json.loads(encoded), len),
+        ("pickle", lambda header: pickle.dumps(header, protocol=pickle.HIGHEST_PROTOCOL), pickle.loads, len),
+    ]
+    try:
+        import msgpack
+        codecs.append(("msgpack", msgpack.packb, msgpack.unpackb, len))
+    except ImportError:
+        print("   msgpack未安装，跳过msgpack对比")
+    
+    for title, header in realistic_headers().items():
+        print(f"   {title} ({len(header['headers'])} 个头部):")
+        for name, encode, decode, size in codecs:
+            encoded = encode(header)
+            started = time.perf_counter()
+            for _ in range(iterations):
+                decode(encode(header))
+            elapsed = (time.perf_counter() - started) / iterations
+            print(f"      {name:<10}: {elapsed * 1e6:6.2f}µs/次, {size(encoded):5d}字节")
+
+def benchmark_proxy_pool(iterations: int = 2000):
+    """比较反向代理每个请求新建TCP连接与经持久连接池转发的延迟"""
+    print(f"\n🏁 反向代理上游连接基准测试 (请求数: {iterations})")
+    
+    app = Flask("proxy_benchmark_app")
+    app.add_url_rule('/ping', 'ping', lambda: "pong")
+    server, _ = start_upstream_server(app, "")
+    port = server.server_port
+    
+    def new_connection_round_trip():
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        connection.request('GET', '/ping')
+        connection.getresponse().read()
+        connection.close()
+    
+    proxy = UpstreamProxy("benchmark", "", '127.0.0.1', port, max_connections=1)
+    app_request = AppRequest(request_id=1, app_prefix='/ping', method='GET', path='/ping',
+                             headers={'Host': 'localhost'}, data=b'', query_string='')
+    def pooled_round_trip():
+        b''.join(proxy.forward(app_request).body)
+    
+    results = [
+        ("每个请求新建连接", measure_round_trips(new_connection_round_trip, iterations)),
+        ("持久连接池", measure_round_trips(pooled_round_trip, iterations)),
+    ]
+    for title, timings in results:
+        timings_us = [t * 1e6 for t in timings]
+        print(f"   {title:<16}: 中位数 {statistics.median(timings_us):8.1f}µs, "
+              f"95th百分位 {statistics.quantiles(timings_us, n=20)[18]:8.1f}µs")
+    print(f"   连接池统计: {proxy.get_stats()}")
+    proxy.stop()
+    server.shutdown()
+    server.server_close()
+
+def benchmark_slow_clients(connections: int = 1000, iterations: int = 200):
+    """比较werkzeug引擎和asyncio引擎在大量慢客户端连接下的线程数和请求延迟"""
+    print(f"\n🏁 慢客户端基准测试 (慢连接数: {connections}, 请求数: {iterations})")
+    
+    for engine in ('werkzeug', 'asyncio'):
+        master = MasterServer(port=0, engine=engine)
+        master.start()
+        port = master.server.server_port
+        app = Flask(f"slow_clients_{engine}")
+        app.add_url_rule('/ping', 'ping', lambda: "pong")
+        AppWrapper(app, "slow_clients", "/slow", master, workers=2)
+        threading.Thread(target=app.run, daemon=True).start()
+        time.sleep(0.5)
+        
+        baseline = threading.active_count()
+        slow = []
+        try:
+            # 只发送一半请求头，然后一直保持连接
+            for _ in range(connections):
+                sock = socket.create_connection(('127.0.0.1', port))
+                sock.sendall(b"GET /slow/ping HTTP/1.1\r\nHost: ")
+                slow.append(sock)
+            time.sleep(1)
+            threads = threading.active_count() - baseline
+            
+            session = requests.Session()
+            url = f"http://127.0.0.1:{port}/slow/ping"
+            timings = measure_round_trips(lambda: session.get(url), iterations)
+            timings_ms = [t * 1000 for t in timings]
+            print(f"   {engine:<10}: 新增线程 {threads:5d}, 请求延迟中位数 {statistics.median(timings_ms):7.2f}ms, "
+                  f"95th百分位 {statistics.quantiles(timings_ms, n=20)[18]:7.2f}ms")
+        finally:
+            for sock in slow:
+                sock.close()
+            master.stop()
+
+def benchmark_engines(duration: float = 3.0, concurrency: int = 8):
+    """比较werkzeug、asyncio和selectors引擎的吞吐量和延迟（客户端尽量复用连接）"""
+    print(f"\n🏁 服务器引擎基准测试 (并发: {concurrency}, 每组 {duration}秒)")
+    
+    for engine in ('werkzeug', 'asyncio', 'selectors'):
+        master = MasterServer(port=0, engine=engine)
+        master.start()
+        port = master.server.server_port
+        app = Flask(f"engine_{engine}")
+        app.add_url_rule('/ping', 'ping', lambda: "pong")
+        AppWrapper(app, "engines", "/engine", master, workers=4)
+        threading.Thread(target=app.run, daemon=True).start()
+        time.sleep(0.5)
+        
+        deadline = time.monotonic() + duration
+        def client():
+            connection = http.client.HTTPConnection('127.0.0.1', port)
+            timings, connects = [], 1
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                connection.request('GET', '/engine/ping')
+                response = connection.getresponse()
+                response.read()
+                timings.append(time.perf_counter() - started)
+                if response.will_close:
+                    # 服务器不支持持久连接时每个请求重新建立连接
+                    connection.close()
+                    connection = http.client.HTTPConnection('127.0.0.1', port)
+                    connects += 1
+            connection.close()
+            return timings, connects
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(lambda _: client(), range(concurrency)))
+        master.stop()
+        
+        timings_ms = [t * 1000 for timings, _ in results for t in timings]
+        connects = sum(connects for _, connects in results)
+        print(f"   {engine:<10}: {len(timings_ms) / duration:8.1f} 请求/秒, 中位数 {statistics.median(timings_ms):6.2f}ms, "
+              f"95th百分位 {statistics.quantiles(timings_ms, n=20)[18]:6.2f}ms, 建立连接 {connects} 次")
+
+def create_cpu_bound_apps():
+    """预派生子进程中创建的CPU密集型应用"""
+    from . import enable_port_sharing
+    
+    app = Flask("cpu_bound_app")
+    
+    @app.route('/work')
+    def work():
+        digest = b"seed"
+        for _ in range(2000):
+            digest = hashlib.sha256(digest).digest()
+        return digest.hex()
+    
+    enable_port_sharing(app, prefix="/cpu")
+    return [app]
+
+def benchmark_prefork_scaling(duration: float = 5.0, concurrency: int = 16, port: int = 5095):
+    """比较单进程与多进程预派生主控服务器处理CPU密集型请求的吞吐量"""
+    cpus = default_process_count()
+    print(f"\n🏁 预派生多进程基准测试 (可用CPU: {cpus}, 并发: {concurrency}, 每组 {duration}秒)")
+    
+    url = f"http://127.0.0.1:{port}/cpu/work"
+    for processes in sorted({1, cpus}):
+        master = PreforkMaster(create_cpu_bound_apps, port=port, processes=processes)
+        master.start()
+        time.sleep(1.5)
+        
+        deadline = time.monotonic() + duration
+        def client():
+            session = requests.Session()
+            completed = 0
+            while time.monotonic() < deadline:
+                if session.get(url).status_code == 200:
+                    completed += 1
+            return completed
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            completed = sum(executor.map(lambda _: client(), range(concurrency)))
+        master.stop()
+        print(f"   {processes:>3} 个进程: {completed / duration:8.1f} 请求/秒")
+
+def benchmark_hot_reload(duration: float = 4.0, concurrency: int = 4, reloads: int = 4):
+    """比较停止后重新注册与热替换两种方式更新应用时客户端看到的错误和延迟"""
+    print(f"\n🏁 应用重新加载基准测试 (并发: {concurrency}, {duration}秒内重新加载 {reloads} 次)")
+    
+    def create_app(version: int) -> Flask:
+        app = Flask(f"reload_{version}")
+        app.add_url_rule('/ping', 'ping', lambda: "pong")
+        return app
+    
+    for method in ('restart', 'hot_swap'):
+        master = MasterServer(port=0)
+        master.start()
+        url = f"http://127.0.0.1:{master.server.server_port}/reload/ping"
+        app = create_app(0)
+        wrapper = AppWrapper(app, "reload", "/reload", master, workers=2)
+        threading.Thread(target=app.run, daemon=True).start()
+        time.sleep(0.5)
+        
+        deadline = time.monotonic() + duration
+        def client():
+            session = requests.Session()
+            timings, errors = [], 0
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                if session.get(url).status_code != 200:
+                    errors += 1
+                timings.append(time.perf_counter() - started)
+            return timings, errors
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(client) for _ in range(concurrency)]
+            for version in range(1, reloads + 1):
+                time.sleep(duration / (reloads + 1))
+                app = create_app(version)
+                if method == 'hot_swap':
+                    wrapper = wrapper.hot_swap(app, warmup_paths=['/ping'])
+                else:
+                    wrapper.stop()
+                    wrapper = AppWrapper(app, "reload", "/reload", master, workers=2)
+                    threading.Thread(target=app.run, daemon=True).start()
+            results = [future.result() for future in futures]
+        wrapper.stop()
+        master.stop()
+        
+        timings_ms = [t * 1000 for timings, _ in results for t in timings]
+        errors = sum(errors for _, errors in results)
+        print(f"   {method:<10}: {len(timings_ms):6d} 个请求, 失败 {errors:5d}, 中位数 {statistics.median(timings_ms):6.2f}ms, "
+              f"99th百分位 {statistics.quantiles(timings_ms, n=100)[98]:6.2f}ms, 最大 {max(timings_ms):7.2f}ms")
+
+if __name__ == "__main__":
+    import sys
+
+    benchmarks = {
+        "dispatch": benchmark_dispatch_modes,
+        "routing": benchmark_prefix_lookup,
+        "allocations": benchmark_body_allocations,
+        "transport": benchmark_transport,
+        "codec": benchmark_codec,
+        "proxy": benchmark_proxy_pool,
+        "slow_clients": benchmark_slow_clients,
+        "engines": benchmark_engines,
+        "prefork": benchmark_prefork_scaling,
+        "reload": benchmark_hot_reload,
+    }
+
+    if len(sys.argv) > 1 and sys.argv[1] in benchmarks:
+        benchmarks[sys.argv[1]]()
+    else:
+        print("可用的基准测试:")
+        for name, func in benchmarks.items():
+            print(f"  {name:<10} - {func.__doc__}")
@@ -0,0 +1,307 @@
+"""
+主控服务器集群
+多个主控服务器（不同端口或不同主机）通过轻量的对等协议共享路由表：每个节点定期把本地
+注册的应用前缀 POST 到已知节点的 /_master/cluster，对方在响应中返回自己的状态，双方
+同时交换已知节点的地址，只需配置一个种子节点就能组成全互联的集群。
+
+其他节点的应用登记为本地路由表中的远程路由，请求经过本地的路由、准入控制和队列后，由转发
+线程通过持久连接转发给拥有该应用的节点（保留完整路径）。节点超过 peer_timeout 没有心跳时
+被认为已离线，它的路由被移除；同一前缀在多个节点上注册时自动切换到仍在线的节点。
+
+同步消息和响应都用集群共享密钥做HMAC-SHA256签名（签名中带时间戳），签名无效或时间戳
+偏差过大的消息被拒绝，公开监听端口上的其他客户端无法注入路由。
+"""
+
+import hashlib
+import hmac
+import json
+import threading
+import time
+import uuid
+import logging
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import requests
+
+from .port_sharing import DISPATCH_MODE_TEST_CLIENT, FORWARDED_NODE_HEADER, MasterServer
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_ROUTE = '/_master/cluster'
+CLUSTER_SIGNATURE_HEADER = 'X-Port-Sharing-Cluster-Signature'
+# 签名时间戳与本地时间相差超过该值（秒）的消息被拒绝，限制旧消息被重放
+MAX_SIGNATURE_SKEW = 30.0
+DEFAULT_HEARTBEAT_INTERVAL = 1.0
+# 超过这么久没有收到心跳的节点被认为已离线
+DEFAULT_PEER_TIMEOUT = 3.0
+DEFAULT_FORWARD_WORKERS = 4
+
+class ClusterAuthError(Exception):
+    """集群消息的签名缺失或无效"""
+    pass
+
+def sign_message(secret: str, body: bytes, timestamp: Optional[float] = None) -> str:
+    """计算集群消息的签名，格式为 时间戳:十六进制HMAC"""
+    timestamp = int(time.time() if timestamp is None else timestamp)
+    digest = hmac.new(secret.encode('utf-8'), f"{timestamp}.".encode('ascii') + body,
+                      hashlib.sha256).hexdigest()
+    return f"{timestamp}:{digest}"
+
+def verify_message(secret: str, body: bytes, signature: str):
+    """校验集群消息的签名，无效时抛出 ClusterAuthError"""
+    timestamp, _, digest = (signature or '').partition(':')
+    try:
+        timestamp = int(timestamp)
+    except ValueError:
+        raise ClusterAuthError("缺少集群消息签名") from None
+    if abs(time.time() - timestamp) > MAX_SIGNATURE_SKEW:
+        raise ClusterAuthError("集群消息签名已过期")
+    expected = sign_message(secret, body, timestamp).partition(':')[2]
+    if not hmac.compare_digest(expected, digest):
+        raise ClusterAuthError("集群消息签名无效")
+
+class PeerState:
+    """一个对等节点的最新状态"""
+
+    def __init__(self, address: str):
+        self.address = address
+        self.node_id: Optional[str] = None
+        self.routes: List[Dict[str, str]] = []  # [{'prefix': ..., 'app_id': ...}]
+        self.last_seen = 0.0
+        self.alive = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'address': self.address,
+            'node_id': self.node_id,
+            'alive': self.alive,
+            'prefixes': [route['prefix'] for route in self.routes],
+            'last_seen_ago': round(time.monotonic() - self.last_seen, 3) if self.last_seen else None
+        }
+
+class Forwarder(NamedTuple):
+    """转发到某个节点的远程路由"""
+    node_id: str
+    remote_app_id: str   # 应用在所属节点上的ID
+    app_id: str          # 远程路由在本地注册器中的ID
+    upstream: Any        # RemoteUpstream
+
+class ClusterNode:
+    """集群中的一个主控节点，负责心跳、成员管理和远程路由的同步
+
+    只有心跳线程修改本地注册器中的远程路由；收到的同步消息只更新节点表，
+    在下一轮心跳时统一生效。
+    """
+
+    def __init__(self, master_server: MasterServer, address: str, peers: List[str],
+                 secret: str, node_id: Optional[str] = None,
+                 heartbeat_interval: float = DEFAULT_HEARTBEAT_INTERVAL,
+                 peer_timeout: float = DEFAULT_PEER_TIMEOUT,
+                 forward_workers: int = DEFAULT_FORWARD_WORKERS):
+        if not secret:
+            raise ValueError("集群模式需要设置共享密钥 secret")
+        self.master_server = master_server
+        self.address = address
+        self.secret = secret
+        self.node_id = node_id or uuid.uuid4().hex[:12]
+        self.heartbeat_interval = heartbeat_interval
+        self.peer_timeout = peer_timeout
+        self.forward_workers = forward_workers
+        self.peers: Dict[str, PeerState] = {
+            peer: PeerState(peer) for peer in peers if peer != address
+        }
+        self.forwarders: Dict[str, Forwarder] = {}  # 前缀 -> 转发到其他节点的远程路由
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.trust_env = False  # 节点之间直接连接，不经过环境变量中的代理
+        self.running = False
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.heartbeat_loop, daemon=True,
+                                       name=f"port-sharing-cluster-{self.node_id}")
+        self.thread.start()
+        logger.info(f"集群节点 {self.node_id} 已启动: {self.address}，种子节点: {list(self.peers)}")
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=5)
+        for prefix in list(self.forwarders):
+            self.remove_forwarder(prefix)
+        self.session.close()
+
+    def local_routes(self) -> List[Dict[str, str]]:
+        """本节点自己的活跃应用，不包括从其他节点学到的远程路由"""
+        registry = self.master_server.registry
+        with registry.lock:
+            return [
+                {'prefix': prefix, 'app_id': info['app_id']}
+                for prefix, info in registry.apps.items()
+                if info['active'] and not info.get('remote')
+            ]
+
+    def state(self) -> Dict[str, Any]:
+        """发给其他节点的同步消息"""
+        with self.lock:
+            peers = [peer.address for peer in self.peers.values() if peer.alive]
+        return {
+            'node_id': self.node_id,
+            'address': self.address,
+            'routes': self.local_routes(),
+            'peers': peers
+        }
+
+    def handle_sync(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """处理其他节点的同步消息，返回本节点的状态"""
+        self.merge_state(message)
+        return self.state()
+
+    def handle_signed_sync(self, body: bytes, signature: str) -> Tuple[bytes, str]:
+        """校验签名后处理同步消息，返回签名后的响应体和签名
+
+        签名无效时抛出 ClusterAuthError，消息格式错误时抛出 KeyError/TypeError/ValueError。
+        """
+        verify_message(self.secret, body, signature)
+        return self.encode_message(self.handle_sync(json.loads(body)))
+
+    def encode_message(self, message: Dict[str, Any]) -> Tuple[bytes, str]:
+        body = json.dumps(message).encode('utf-8')
+        return body, sign_message(self.secret, body)
+
+    def merge_state(self, message: Dict[str, Any]):
+        """用收到的节点状态更新节点表，并记下其中新出现的节点地址"""
+        address = message['address']
+        node_id = message['node_id']
+        routes = [{'prefix': route['prefix'], 'app_id': route['app_id']} for route in message['routes']]
+        if node_id == self.node_id:
+            return
+        with self.lock:
+            peer = self.peers.get(address)
+            if peer is None:
+                peer = self.peers[address] = PeerState(address)
+                logger.info(f"集群节点 {node_id} 加入: {address}")
+            elif not peer.alive:
+                logger.info(f"集群节点 {node_id} 已上线: {address}")
+            peer.node_id = node_id
+            peer.routes = routes
+            peer.last_seen = time.monotonic()
+            peer.alive = True
+            for other in message.get('peers', []):
+                if other != self.address and other not in self.peers:
+                    self.peers[other] = PeerState(other)
+
+    def heartbeat_loop(self):
+        while self.running:
+            started = time.monotonic()
+            try:
+                self.heartbeat()
+                self.expire_peers()
+                self.reconcile()
+            except Exception as e:
+                logger.error(f"集群心跳出错: {e}")
+            time.sleep(max(0.0, self.heartbeat_interval - (time.monotonic() - started)))
+
+    def heartbeat(self):
+        """把本节点状态发给所有已知节点（包括离线节点，以便它们恢复后重新加入）"""
+        body, signature = self.encode_message(self.state())
+        headers = {'Content-Type': 'application/json', CLUSTER_SIGNATURE_HEADER: signature}
+        with self.lock:
+            addresses = list(self.peers)
+        for address in addresses:
+            if not self.running:
+                return
+            try:
+                response = self.session.post(f"http://{address}{CLUSTER_ROUTE}", data=body,
+                                             headers=headers, timeout=self.heartbeat_interval)
+                response.raise_for_status()
+                verify_message(self.secret, response.content,
+                               response.headers.get(CLUSTER_SIGNATURE_HEADER, ''))
+                self.merge_state(json.loads(response.content))
+            except ClusterAuthError as e:
+                logger.warning(f"集群节点 {address} 的响应未通过校验: {e}")
+            except (requests.RequestException, KeyError, TypeError, ValueError) as e:
+                logger.debug(f"无法与集群节点 {address} 同步: {e}")
+
+    def expire_peers(self):
+        """把超时没有心跳的节点标记为离线并丢弃它的路由"""
+        now = time.monotonic()
+        with self.lock:
+            for peer in self.peers.values():
+                if peer.alive and now - peer.last_seen > self.peer_timeout:
+                    peer.alive = False
+                    peer.routes = []
+                    logger.warning(f"集群节点 {peer.node_id} 已离线: {peer.address}")
+
+    def reconcile(self):
+        """让本地的远程路由与在线节点公布的路由一致
+
+        本地应用优先；同一前缀有多个节点提供时，保留当前转发的节点，
+        否则选择节点ID最小的在线节点，保证各节点的选择一致。
+        """
+        registry = self.master_server.registry
+        with registry.lock:
+            local_prefixes = {prefix for prefix, info in registry.apps.items() if not info.get('remote')}
+        with self.lock:
+            candidates: Dict[str, List[Tuple[PeerState, str]]] = {}
+            for peer in sorted((peer for peer in self.peers.values() if peer.alive),
+                               key=lambda peer: peer.node_id):
+                for route in peer.routes:
+                    if route['prefix'] not in local_prefixes:
+                        candidates.setdefault(route['prefix'], []).append((peer, route['app_id']))
+
+        desired: Dict[str, Tuple[PeerState, str]] = {}
+        for prefix, options in candidates.items():
+            current = self.forwarders.get(prefix)
+            desired[prefix] = next(
+                (option for option in options
+                 if current is not None and option[0].node_id == current.node_id
+                 and option[1] == current.remote_app_id),
+                options[0]
+            )
+
+        for prefix, forwarder in list(self.forwarders.items()):
+            target = desired.get(prefix)
+            if target is None or (target[0].node_id, target[1]) != (forwarder.node_id, forwarder.remote_app_id):
+                self.remove_forwarder(prefix)
+        for prefix, (peer, remote_app_id) in desired.items():
+            if prefix not in self.forwarders:
+                self.add_forwarder(prefix, peer, remote_app_id)
+
+    def add_forwarder(self, prefix: str, peer: PeerState, remote_app_id: str):
+        """把其他节点的应用登记为本地的远程路由"""
+        from .proxy import RemoteUpstream
+
+        registry = self.master_server.registry
+        app_id = f"{remote_app_id}@{peer.node_id}"
+        if not registry.register_app(app_id, prefix, None, DISPATCH_MODE_TEST_CLIENT, remote=True):
+            return
+        host, _, port = peer.address.rpartition(':')
+        upstream = RemoteUpstream(self.master_server, app_id, '', int(port),
+                                  workers=self.forward_workers, host=host,
+                                  extra_headers={FORWARDED_NODE_HEADER: self.node_id})
+        upstream.start()
+        registry.set_app_active(app_id, True)
+        self.forwarders[prefix] = Forwarder(peer.node_id, remote_app_id, app_id, upstream)
+        logger.info(f"集群路由已添加: {prefix} -> 节点 {peer.node_id} ({peer.address})")
+
+    def remove_forwarder(self, prefix: str):
+        forwarder = self.forwarders.pop(prefix)
+        # 本地应用取代远程路由时注册器中已经没有这个ID
+        self.master_server.registry.unregister_app(forwarder.app_id)
+        forwarder.upstream.stop()
+        logger.info(f"集群路由已移除: {prefix} -> 节点 {forwarder.node_id}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            peers = [peer.to_dict() for peer in self.peers.values()]
+        return {
+            'node_id': self.node_id,
+            'address': self.address,
+            'local_routes': self.local_routes(),
+            'peers': peers,
+            'forwarded_routes': {
+                prefix: forwarder.node_id for prefix, forwarder in list(self.forwarders.items())
+            }
+        }
@@ -0,0 +1,199 @@
+"""
+二进制帧编解码模块
+跨进程传输 AppRequest/AppResponse 时使用的紧凑二进制格式，不依赖JSON、base64或pickle
+
+帧布局（网络字节序）:
+    帧头   u8 消息类型 | u32 头部长度 | u64 消息体长度
+    头部   按消息类型固定布局的字段 + 头部表
+    消息体 原始字节，不做任何编码
+
+请求头部: 固定字段（请求ID、超时、方法/路径/查询串长度、头部条目数）+ 方法、路径、查询串 + 头部表
+响应头部: 固定字段（请求ID、状态码、服务耗时、头部条目数）+ 头部表
+头部表为以NUL分隔的名称和值(latin-1)，占据头部的剩余部分，条目数由固定字段给出。
+注册等控制消息使用带类型标记的键值表，只在建立连接时出现，不在请求的热路径上。
+"""
+
+import math
+import struct
+from typing import Any, Dict, List, Tuple
+
+FRAME = struct.Struct('!BIQ')
+
+# 消息类型编号
+TYPE_REGISTER = 1
+TYPE_REGISTERED = 2
+TYPE_REQUEST = 3
+TYPE_RESPONSE = 4
+
+# 请求ID、剩余超时秒数（NaN表示不限）、方法/路径/查询串的字节数、头部条目数
+_REQUEST_FIXED = struct.Struct('!QdBIIH')
+# 请求ID、状态码、服务耗时、头部条目数
+_RESPONSE_FIXED = struct.Struct('!QHdH')
+_U16 = struct.Struct('!H')
+_U32 = struct.Struct('!I')
+_I64 = struct.Struct('!q')
+
+class CodecError(ValueError):
+    """帧内容无法编码或解码"""
+
+def _pack_string(parts: List[bytes], value: str, encoding: str = 'latin-1'):
+    data = value.encode(encoding)
+    parts.append(_U32.pack(len(data)))
+    parts.append(data)
+
+def _unpack_string(block: bytes, offset: int, encoding: str = 'latin-1') -> Tuple[str, int]:
+    (length,) = _U32.unpack_from(block, offset)
+    offset += 4
+    return str(block[offset:offset + length], encoding), offset + length
+
+def _pack_header_table(headers) -> bytes:
+    """头部表：名称和值依次用NUL连接，整张表只编码一次
+
+    HTTP头部的名称和值不允许包含NUL，分隔符不会与内容混淆；解码时按头部条目数校验。
+    """
+    if not headers:
+        return b''
+    text = '\0'.join([item for pair in headers for item in pair])
+    if text.count('\0') != 2 * len(headers) - 1:
+        raise CodecError("HTTP头部中不能包含NUL字符")
+    return text.encode('latin-1')
+
+def _unpack_header_table(block: bytes, offset: int, count: int) -> List[Tuple[str, str]]:
+    if not count:
+        return []
+    items = str(block[offset:], 'latin-1').split('\0')
+    if len(items) != 2 * count:
+        raise CodecError(f"头部表应有 {2 * count} 个名称和值，实际为 {len(items)}")
+    return list(zip(items[::2], items[1::2]))
+
+def encode_request(header: Dict[str, Any]) -> bytes:
+    timeout = header.get('timeout')
+    method = header['method'].encode('latin-1')
+    path = header['path'].encode('utf-8')
+    query_string = header['query_string'].encode('utf-8')
+    headers = header['headers']
+    return b''.join((
+        _REQUEST_FIXED.pack(header['id'], math.nan if timeout is None else timeout,
+                            len(method), len(path), len(query_string), len(headers)),
+        method, path, query_string, _pack_header_table(headers)
+    ))
+
+def decode_request(block: bytes) -> Dict[str, Any]:
+    request_id, timeout, method_length, path_length, query_length, count = \
+        _REQUEST_FIXED.unpack_from(block, 0)
+    offset = _REQUEST_FIXED.size
+    method = str(block[offset:offset + method_length], 'latin-1')
+    offset += method_length
+    path = str(block[offset:offset + path_length], 'utf-8')
+    offset += path_length
+    query_string = str(block[offset:offset + query_length], 'utf-8')
+    offset += query_length
+    return {
+        'type': 'request',
+        'id': request_id,
+        'method': method,
+        'path': path,
+        'query_string': query_string,
+        'headers': _unpack_header_table(block, offset, count),
+        'timeout': None if math.isnan(timeout) else timeout
+    }
+
+def encode_response(header: Dict[str, Any]) -> bytes:
+    headers = header['headers']
+    return _RESPONSE_FIXED.pack(header['id'], header['status'], header.get('service_time', 0.0),
+                                len(headers)) + _pack_header_table(headers)
+
+def decode_response(block: bytes) -> Dict[str, Any]:
+    request_id, status, service_time, count = _RESPONSE_FIXED.unpack_from(block, 0)
+    return {
+        'type': 'response',
+        'id': request_id,
+        'status': status,
+        'service_time': service_time,
+        'headers': _unpack_header_table(block, _RESPONSE_FIXED.size, count)
+    }
+
+# 控制消息的值类型标记
+_TAG_NONE = b'n'
+_TAG_BOOL = b'b'
+_TAG_INT = b'i'
+_TAG_STR = b's'
+_TAG_TABLE = b't'
+
+def _pack_table(parts: List[bytes], table: Dict[str, Any]):
+    parts.append(_U16.pack(len(table)))
+    for key, value in table.items():
+        _pack_string(parts, key, 'utf-8')
+        if value is None:
+            parts.append(_TAG_NONE)
+        elif isinstance(value, bool):
+            parts.append(_TAG_BOOL + (b'\x01' if value else b'\x00'))
+        elif isinstance(value, int):
+            parts.append(_TAG_INT + _I64.pack(value))
+        elif isinstance(value, str):
+            parts.append(_TAG_STR)
+            _pack_string(parts, value, 'utf-8')
+        elif isinstance(value, dict):
+            parts.append(_TAG_TABLE)
+            _pack_table(parts, value)
+        else:
+            raise CodecError(f"控制消息不支持的值类型: {key}={value!r}")
+
+def _unpack_table(block: bytes, offset: int) -> Tuple[Dict[str, Any], int]:
+    (count,) = _U16.unpack_from(block, offset)
+    offset += 2
+    table: Dict[str, Any] = {}
+    for _ in range(count):
+        key, offset = _unpack_string(block, offset, 'utf-8')
+        tag = bytes(block[offset:offset + 1])
+        offset += 1
+        if tag == _TAG_NONE:
+            value = None
+        elif tag == _TAG_BOOL:
+            value = block[offset] != 0
+            offset += 1
+        elif tag == _TAG_INT:
+            (value,) = _I64.unpack_from(block, offset)
+            offset += 8
+        elif tag == _TAG_STR:
+            value, offset = _unpack_string(block, offset, 'utf-8')
+        elif tag == _TAG_TABLE:
+            value, offset = _unpack_table(block, offset)
+        else:
+            raise CodecError(f"未知的值类型标记: {tag!r}")
+        table[key] = value
+    return table, offset
+
+_CONTROL_TYPES = {'register': TYPE_REGISTER, 'registered': TYPE_REGISTERED}
+_CONTROL_NAMES = {code: name for name, code in _CONTROL_TYPES.items()}
+
+def encode_header(header: Dict[str, Any]) -> Tuple[int, bytes]:
+    """把帧头部编码为 (消息类型编号, 头部字节)"""
+    message_type = header.get('type')
+    try:
+        if message_type == 'request':
+            return TYPE_REQUEST, encode_request(header)
+        if message_type == 'response':
+            return TYPE_RESPONSE, encode_response(header)
+        if message_type in _CONTROL_TYPES:
+            parts: List[bytes] = []
+            _pack_table(parts, {key: value for key, value in header.items() if key != 'type'})
+            return _CONTROL_TYPES[message_type], b''.join(parts)
+    except (struct.error, UnicodeEncodeError) as e:
+        raise CodecError(f"帧头部无法编码: {e}") from e
+    raise CodecError(f"未知的消息类型: {message_type}")
+
+def decode_header(type_code: int, block: bytes) -> Dict[str, Any]:
+    """按消息类型编号解码头部"""
+    try:
+        if type_code == TYPE_REQUEST:
+            return decode_request(block)
+        if type_code == TYPE_RESPONSE:
+            return decode_response(block)
+        if type_code in _CONTROL_NAMES:
+            table, _ = _unpack_table(block, 0)
+            table['type'] = _CONTROL_NAMES[type_code]
+            return table
+    except (struct.error, UnicodeDecodeError, IndexError) as e:
+        raise CodecError(f"帧头部损坏: {e}") from e
+    raise CodecError(f"未知的消息类型编号: {type_code}")
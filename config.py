@@ -17,17 +17,23 @@ class Config:
     MAX_REQUESTS_PER_APP = int(os.getenv('MAX_REQUESTS_PER_APP', '50'))
     MAX_CONNECTIONS = int(os.getenv('MAX_CONNECTIONS', '100'))
     MAX_WORKERS = int(os.getenv('MAX_WORKERS', '50'))
+    APP_WORKERS = int(os.getenv('APP_WORKERS', '1'))  # 每个应用默认的工作线程数（enable_port_sharing 的 workers）
     
     # 队列配置
     REQUEST_QUEUE_SIZE = int(os.getenv('REQUEST_QUEUE_SIZE', '1000'))
     RESPONSE_QUEUE_SIZE = int(os.getenv('RESPONSE_QUEUE_SIZE', '1000'))
     
+    # 请求体配置（超过阈值的请求体写入临时文件，单位字节），MasterServer 的 body_spool_threshold 默认值
+    BODY_SPOOL_THRESHOLD = int(os.getenv('BODY_SPOOL_THRESHOLD', str(1024 * 1024)))
+    
     # 超时配置
-    REQUEST_TIMEOUT = int(os.getenv('REQUEST_TIMEOUT', '30'))
+    REQUEST_TIMEOUT = float(os.getenv('REQUEST_TIMEOUT', '30'))  # MasterServer 的 request_timeout 默认值（秒）
     RESPONSE_TIMEOUT = int(os.getenv('RESPONSE_TIMEOUT', '5'))
+    MAX_QUEUE_WAIT = float(os.getenv('MAX_QUEUE_WAIT', '5'))  # 预计排队时间超过该值的请求直接返回503
     
     # 日志配置
     LOG_LEVEL = os.getenv('FLASK_PORT_SHARING_LOG_LEVEL', 'INFO')
+    ENABLE_REQUEST_TRACING = os.getenv('ENABLE_REQUEST_TRACING', 'false').lower() == 'true'  # MasterServer 的 enable_tracing 默认值，响应中附带X-Request-ID
     
     # 监控配置
     ENABLE_MONITORING = os.getenv('ENABLE_MONITORING', 'true').lower() == 'true'
@@ -0,0 +1,323 @@
+"""
+HTTP/1.1 协议处理
+内置服务器引擎共用的请求头解析、WSGI environ构造、分块编解码和响应头格式化
+"""
+
+import sys
+import time
+from email.utils import formatdate
+from typing import Any, BinaryIO, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import unquote_to_bytes, urlsplit
+from werkzeug.wsgi import ClosingIterator
+
+SERVER_SOFTWARE = 'flask-port-extension'
+
+# 请求头的大小和条目数上限
+MAX_HEADER_BYTES = 64 * 1024
+MAX_HEADER_COUNT = 100
+MAX_CHUNK_LINE_BYTES = 4096
+# 分块长度最多16个十六进制数字，更长的长度行被拒绝
+MAX_CHUNK_SIZE_DIGITS = 16
+HEX_DIGITS = frozenset(b'0123456789abcdefABCDEF')
+HEADER_TERMINATOR = b'\r\n\r\n'
+
+# 不带消息体的响应状态码
+BODILESS_STATUSES = (204, 304)
+
+# 由服务器负责的逐跳头部，应用设置的值会被替换
+HOP_BY_HOP_RESPONSE_HEADERS = frozenset(('connection', 'keep-alive', 'transfer-encoding'))
+
+CONTINUE_RESPONSE = b'HTTP/1.1 100 Continue\r\n\r\n'
+LAST_CHUNK = b'0\r\n\r\n'
+
+class ProtocolError(Exception):
+    """请求不符合HTTP协议，status 是返回给客户端的状态码"""
+
+    def __init__(self, status: str, message: str):
+        super().__init__(message)
+        self.status = status
+
+class RequestHead(NamedTuple):
+    """解析后的请求行和请求头"""
+    method: str
+    target: str
+    version: str
+    headers: List[Tuple[str, str]]
+
+    def get(self, name: str) -> Optional[str]:
+        """按名称（不区分大小写）取头部，重复的头部用逗号连接"""
+        name = name.lower()
+        values = [value for key, value in self.headers if key.lower() == name]
+        return ', '.join(values) if values else None
+
+    @property
+    def keep_alive(self) -> bool:
+        """客户端是否希望复用连接：HTTP/1.1默认复用，HTTP/1.0需要显式请求"""
+        connection = (self.get('Connection') or '').lower()
+        if self.version == 'HTTP/1.1':
+            return 'close' not in connection
+        return 'keep-alive' in connection
+
+    @property
+    def chunked(self) -> bool:
+        return 'chunked' in (self.get('Transfer-Encoding') or '').lower()
+
+    @property
+    def content_length(self) -> int:
+        value = self.get('Content-Length')
+        if value is None:
+            return 0
+        # str.isdigit 也接受 '²' 这类非ASCII数字，int() 无法解析它们
+        if not (value.isascii() and value.isdigit()):
+            raise ProtocolError('400 Bad Request', f"无效的Content-Length: {value}")
+        return int(value)
+
+    @property
+    def expects_continue(self) -> bool:
+        return self.version == 'HTTP/1.1' and (self.get('Expect') or '').lower() == '100-continue'
+
+def parse_request_head(block: bytes) -> RequestHead:
+    """解析以空行结束的请求行和请求头，请求之间多余的空行被忽略"""
+    lines = block.lstrip(b'\r\n').split(b'\r\n')
+    try:
+        method, target, version = lines[0].decode('latin-1').split(' ')
+    except ValueError:
+        raise ProtocolError('400 Bad Request', f"无效的请求行: {lines[0][:100]!r}") from None
+    if version not in ('HTTP/1.1', 'HTTP/1.0'):
+        raise ProtocolError('505 HTTP Version Not Supported', f"不支持的协议版本: {version}")
+
+    headers: List[Tuple[str, str]] = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, colon, value = line.decode('latin-1').partition(':')
+        if not colon or not name or name != name.strip():
+            raise ProtocolError('400 Bad Request', f"无效的请求头: {line[:100]!r}")
+        headers.append((name, value.strip()))
+    if len(headers) > MAX_HEADER_COUNT:
+        raise ProtocolError('431 Request Header Fields Too Large', f"请求头过多: {len(headers)}")
+
+    head = RequestHead(method, target, version, headers)
+    if head.chunked and head.get('Content-Length') is not None:
+        raise ProtocolError('400 Bad Request', "请求同时带有Transfer-Encoding和Content-Length")
+    return head
+
+def build_environ(head: RequestHead, body: BinaryIO, content_length: int,
+                  server_address: Tuple[str, int], client_address: Tuple[str, int],
+                  url_scheme: str = 'http') -> Dict[str, Any]:
+    """构造WSGI environ，请求体已由引擎完整读取（分块请求体已解码）"""
+    target = head.target
+    if target.startswith(('http://', 'https://')):
+        # 绝对形式的请求目标，只取路径和查询串
+        parts = urlsplit(target)
+        path, query = parts.path or '/', parts.query
+    else:
+        path, _, query = target.partition('?')
+
+    environ = {
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': url_scheme,
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'wsgi.input_terminated': True,
+        'SERVER_SOFTWARE': SERVER_SOFTWARE,
+        'REQUEST_METHOD': head.method,
+        'SCRIPT_NAME': '',
+        # PEP 3333：PATH_INFO是按latin-1解码的原始字节
+        'PATH_INFO': unquote_to_bytes(path).decode('latin-1'),
+        'QUERY_STRING': query,
+        'REQUEST_URI': target,
+        'RAW_URI': target,
+        'REMOTE_ADDR': client_address[0],
+        'REMOTE_PORT': client_address[1],
+        'SERVER_NAME': server_address[0],
+        'SERVER_PORT': str(server_address[1]),
+        'SERVER_PROTOCOL': head.version,
+        'CONTENT_LENGTH': str(content_length),
+    }
+    for name, value in head.headers:
+        key = name.upper().replace('-', '_')
+        if '_' in name or key in ('CONTENT_LENGTH', 'TRANSFER_ENCODING'):
+            # 带下划线的头部可能伪装成其他头部，直接丢弃；请求体长度由引擎给出
+            continue
+        if key != 'CONTENT_TYPE':
+            key = 'HTTP_' + key
+        if key in environ:
+            environ[key] = f"{environ[key]},{value}"
+        else:
+            environ[key] = value
+    return environ
+
+def parse_chunk_size(line: bytes) -> int:
+    """解析分块长度行（忽略分块扩展），只接受ASCII十六进制数字（int() 还会接受正负号和下划线）"""
+    digits = line.split(b';', 1)[0].strip()
+    if not digits or len(digits) > MAX_CHUNK_SIZE_DIGITS or not all(c in HEX_DIGITS for c in digits):
+        raise ProtocolError('400 Bad Request', f"无效的分块长度: {line[:20]!r}")
+    return int(digits, 16)
+
+class ChunkedDecoder:
+    """分块传输编码的增量解码器，done 后 remainder 是属于下一个请求的字节"""
+
+    SIZE, DATA, DATA_END, TRAILER = range(4)
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.state = self.SIZE
+        self.remaining = 0
+        self.done = False
+
+    @property
+    def remainder(self) -> bytes:
+        return bytes(self.buffer)
+
+    def _take_line(self) -> Optional[bytes]:
+        end = self.buffer.find(b'\r\n')
+        if end < 0:
+            if len(self.buffer) > MAX_CHUNK_LINE_BYTES:
+                raise ProtocolError('400 Bad Request', "分块长度行过长")
+            return None
+        line = bytes(self.buffer[:end])
+        del self.buffer[:end + 2]
+        return line
+
+    def feed(self, data: bytes) -> bytes:
+        """输入收到的字节，返回解码出的请求体"""
+        self.buffer += data
+        output: List[bytes] = []
+        while not self.done:
+            if self.state == self.SIZE:
+                line = self._take_line()
+                if line is None:
+                    break
+                self.remaining = parse_chunk_size(line)
+                self.state = self.DATA if self.remaining else self.TRAILER
+            elif self.state == self.DATA:
+                if not self.buffer:
+                    break
+                piece = bytes(self.buffer[:self.remaining])
+                del self.buffer[:len(piece)]
+                output.append(piece)
+                self.remaining -= len(piece)
+                if not self.remaining:
+                    self.state = self.DATA_END
+            elif self.state == self.DATA_END:
+                if len(self.buffer) < 2:
+                    break
+                if self.buffer[:2] != b'\r\n':
+                    raise ProtocolError('400 Bad Request', "分块数据后缺少CRLF")
+                del self.buffer[:2]
+                self.state = self.SIZE
+            else:
+                line = self._take_line()
+                if line is None:
+                    break
+                if not line:
+                    self.done = True
+        return b''.join(output)
+
+def encode_chunk(data: bytes) -> bytes:
+    """按分块传输编码包装一段响应体"""
+    return b'%x\r\n%s\r\n' % (len(data), data)
+
+_date_cache: Tuple[int, str] = (0, '')
+
+def http_date() -> str:
+    """当前时间的HTTP日期，每秒只格式化一次"""
+    global _date_cache
+    now = int(time.time())
+    if _date_cache[0] != now:
+        _date_cache = (now, formatdate(now, usegmt=True))
+    return _date_cache[1]
+
+class ResponseFraming(NamedTuple):
+    """响应头字节及响应体的传输方式"""
+    head: bytes
+    chunked: bool      # 响应体按分块编码发送
+    send_body: bool    # HEAD请求和204/304响应不发送响应体
+    keep_alive: bool   # 响应结束后连接是否可以复用
+
+def frame_response(request: RequestHead, status: str, headers: List[Tuple[str, str]]) -> ResponseFraming:
+    """决定响应体的分界方式并格式化响应头
+
+    应用给出Content-Length时按长度发送；HTTP/1.1客户端改用分块编码；
+    HTTP/1.0客户端只能以关闭连接作为响应体的结束。
+    """
+    keep_alive = request.keep_alive
+    send_body = request.method != 'HEAD' and int(status[:3]) not in BODILESS_STATUSES \
+        and not status.startswith('1')
+    has_length = False
+    has_date = has_server = False
+    lines = [f"{request.version} {status}"]
+    for name, value in headers:
+        lower = name.lower()
+        if lower in HOP_BY_HOP_RESPONSE_HEADERS:
+            if lower == 'connection' and 'close' in value.lower():
+                keep_alive = False
+            continue
+        if lower == 'content-length':
+            has_length = True
+        elif lower == 'date':
+            has_date = True
+        elif lower == 'server':
+            has_server = True
+        lines.append(f"{name}: {value}")
+
+    chunked = False
+    if send_body and not has_length:
+        if request.version == 'HTTP/1.1':
+            chunked = True
+            lines.append("Transfer-Encoding: chunked")
+        else:
+            keep_alive = False
+    if not has_date:
+        lines.append(f"Date: {http_date()}")
+    if not has_server:
+        lines.append(f"Server: {SERVER_SOFTWARE}")
+    if not keep_alive:
+        lines.append("Connection: close")
+    elif request.version == 'HTTP/1.0':
+        lines.append("Connection: keep-alive")
+    lines.append('\r\n')
+    return ResponseFraming('\r\n'.join(lines).encode('latin-1'), chunked, send_body, keep_alive)
+
+def error_response(status: str, message: str = '') -> bytes:
+    """引擎自身产生的错误响应，发送后关闭连接"""
+    body = (message or status).encode('utf-8')
+    return (f"HTTP/1.1 {status}\r\nContent-Type: text/plain; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nDate: {http_date()}\r\nServer: {SERVER_SOFTWARE}\r\n"
+            f"Connection: close\r\n\r\n").encode('latin-1') + body
+
+def start_wsgi(app, environ: Dict[str, Any]) -> Tuple[str, List[Tuple[str, str]], Any]:
+    """调用WSGI应用，返回 (状态行, 响应头, 响应体迭代器)
+
+    延迟调用 start_response 的应用会先取出第一段响应体，再把它放回迭代器前面。
+    """
+    started: List[Any] = []
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info is not None and started:
+            raise exc_info[1].with_traceback(exc_info[2])
+        started[:] = [status, headers]
+        return lambda data: None
+
+    app_iter = app(environ, start_response)
+    if started:
+        return started[0], started[1], app_iter
+
+    iterator = iter(app_iter)
+    first = next(iterator, b'')
+    if not started:
+        raise RuntimeError("WSGI应用没有调用start_response")
+
+    def chained():
+        yield first
+        yield from iterator
+
+    body = chained()
+    close = getattr(app_iter, 'close', None)
+    if close is not None:
+        body = ClosingIterator(body, close)
+    return started[0], started[1], body
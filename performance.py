@@ -3,14 +3,16 @@
 提供针对密集型请求的优化功能
 """
 
+import math
 import threading
 import queue
 import time
 import weakref
-from typing import Dict, List, Optional, Callable
+from typing import Dict, List, Optional, Callable, Tuple
 from dataclasses import dataclass
 import logging
 from collections import defaultdict, deque
+from .config import Config
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +24,34 @@ class RequestMetrics:
     status_code: int
     app_id: str
 
+class WorkerStats:
+    """应用工作线程的利用率统计（每个实例只由对应的工作线程写入）"""
+    
+    def __init__(self, worker_index: int):
+        self.worker_index = worker_index
+        self.started_at = time.time()
+        self.requests_handled = 0
+        self.busy_time = 0.0
+        self.expired = 0  # 因超过截止时间而跳过的请求数
+        self.cancelled = 0  # 因客户端断开而跳过的请求数
+    
+    def record(self, duration: float):
+        """记录一次请求处理耗时"""
+        self.requests_handled += 1
+        self.busy_time += duration
+    
+    def to_dict(self) -> Dict:
+        """导出统计信息"""
+        uptime = max(time.time() - self.started_at, 1e-9)
+        return {
+            "worker": self.worker_index,
+            "requests_handled": self.requests_handled,
+            "expired": self.expired,
+            "cancelled": self.cancelled,
+            "busy_time": self.busy_time,
+            "utilization": min(self.busy_time / uptime, 1.0) * 100
+        }
+
 class PerformanceMonitor:
     """性能监控器"""
     
@@ -135,6 +165,189 @@ class RequestThrottler:
             
             return True
 
+class AdmissionController:
+    """准入控制器 - 根据队列深度和排空速率在入队前拒绝注定超时的请求"""
+    
+    # 过载时每个请求都会被拒绝，每个应用每隔这么多秒才输出一次警告日志，其余拒绝记为调试日志
+    REJECTION_LOG_INTERVAL = 10.0
+    
+    def __init__(self, max_queue_wait: float = 5.0, smoothing: float = 0.2):
+        self.max_queue_wait = max_queue_wait
+        self.smoothing = smoothing
+        self.last_warned: Dict[str, float] = {}
+        self.unlogged_rejections: Dict[str, int] = defaultdict(int)
+        
+        # 每个应用的平均服务时间（指数加权移动平均）和工作线程数
+        self.service_times: Dict[str, float] = {}
+        self.workers: Dict[str, float] = {}
+        self.rejected_counts: Dict[str, int] = defaultdict(int)
+        
+        self.lock = threading.Lock()
+    
+    def record_completion(self, app_id: str, service_time: float, workers: float = 1):
+        """记录一次请求的处理耗时"""
+        with self.lock:
+            previous = self.service_times.get(app_id)
+            if previous is None:
+                self.service_times[app_id] = service_time
+            else:
+                self.service_times[app_id] = previous + self.smoothing * (service_time - previous)
+            # 共享线程池中按权重分到的线程数可能不足一个
+            self.workers[app_id] = workers if workers > 0 else 1
+    
+    def drain_rate(self, app_id: str) -> Optional[float]:
+        """应用每秒能处理的请求数，尚无数据时返回None"""
+        with self.lock:
+            service_time = self.service_times.get(app_id)
+            if not service_time:
+                return None
+            return self.workers.get(app_id, 1) / service_time
+    
+    def admit(self, app_id: str, queue_depth: int, queue_capacity: int) -> Tuple[bool, float]:
+        """判断请求能否入队，返回 (是否允许, 预计等待秒数)"""
+        rate = self.drain_rate(app_id)
+        expected_wait = (queue_depth + 1) / rate if rate else 0.0
+        
+        if (queue_capacity > 0 and queue_depth >= queue_capacity) or expected_wait > self.max_queue_wait:
+            now = time.monotonic()
+            with self.lock:
+                self.rejected_counts[app_id] += 1
+                warn = now - self.last_warned.get(app_id, -self.REJECTION_LOG_INTERVAL) >= self.REJECTION_LOG_INTERVAL
+                if warn:
+                    self.last_warned[app_id] = now
+                    suppressed = self.unlogged_rejections.pop(app_id, 0)
+                else:
+                    self.unlogged_rejections[app_id] += 1
+            message = f"应用 {app_id} 队列积压 {queue_depth} 个请求，预计等待 {expected_wait:.2f}秒，拒绝请求"
+            if warn:
+                if suppressed:
+                    message += f"（上次警告后另有 {suppressed} 个请求被拒绝）"
+                logger.warning(message)
+            else:
+                logger.debug(message)
+            return False, expected_wait
+        
+        return True, expected_wait
+    
+    @staticmethod
+    def retry_after(expected_wait: float) -> int:
+        """根据预计等待时间计算Retry-After秒数"""
+        return max(1, int(math.ceil(expected_wait)))
+    
+    def get_stats(self, app_id: str) -> Dict:
+        """获取应用的准入统计"""
+        rate = self.drain_rate(app_id)
+        with self.lock:
+            return {
+                "drain_rate": rate,
+                "avg_service_time": self.service_times.get(app_id),
+                "rejected": self.rejected_counts.get(app_id, 0)
+            }
+
+class ConcurrencyLimit:
+    """单个应用的自适应并发限制状态"""
+    
+    def __init__(self, limit: float):
+        self.limit = limit
+        self.inflight = 0
+        self.short_rtt: Optional[float] = None  # 近期延迟（短窗口指数加权移动平均）
+        self.long_rtt: Optional[float] = None   # 基线延迟（长窗口指数加权移动平均）
+        self.rejected = 0
+
+class AdaptiveConcurrencyLimiter:
+    """自适应并发限制器 - 根据延迟变化自动调整每个应用允许的在途请求数（梯度算法）
+    
+    近期延迟相对基线延迟升高说明请求开始排队，限制按二者之比收缩；
+    延迟平稳时每次增加 sqrt(limit)，吞吐量自己找到上限，无需手工设置固定的限流值。
+    请求超时或队列溢出时限制按 backoff 倍数退让。
+    """
+    
+    def __init__(self, initial_limit: int = 20, min_limit: int = 1, max_limit: int = 1000,
+                 smoothing: float = 0.2, tolerance: float = 1.5, backoff: float = 0.9,
+                 short_window: int = 10, long_window: int = 600):
+        self.initial_limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.smoothing = smoothing
+        self.tolerance = tolerance  # 近期延迟超过基线的这个倍数才开始收缩
+        self.backoff = backoff
+        self.short_alpha = 2.0 / (short_window + 1)
+        self.long_alpha = 2.0 / (long_window + 1)
+        
+        self.limits: Dict[str, ConcurrencyLimit] = {}
+        self.lock = threading.Lock()
+    
+    def _state(self, app_id: str) -> ConcurrencyLimit:
+        state = self.limits.get(app_id)
+        if state is None:
+            state = self.limits[app_id] = ConcurrencyLimit(float(self.initial_limit))
+        return state
+    
+    def acquire(self, app_id: str) -> bool:
+        """占用一个在途名额，达到限制时返回False"""
+        with self.lock:
+            state = self._state(app_id)
+            if state.inflight >= int(state.limit):
+                state.rejected += 1
+                return False
+            state.inflight += 1
+            return True
+    
+    def release(self, app_id: str, rtt: Optional[float] = None, dropped: bool = False):
+        """释放在途名额
+        
+        Args:
+            rtt: 请求从入队到拿到响应的耗时，None表示不作为延迟样本（例如客户端断开）
+            dropped: 请求因过载而失败（超时、队列溢出）
+        """
+        with self.lock:
+            state = self._state(app_id)
+            inflight = state.inflight
+            state.inflight = max(0, inflight - 1)
+            
+            if dropped:
+                state.limit = max(self.min_limit, state.limit * self.backoff)
+                return
+            if rtt is None:
+                return
+            
+            if state.short_rtt is None:
+                state.short_rtt = state.long_rtt = rtt
+            else:
+                state.short_rtt += self.short_alpha * (rtt - state.short_rtt)
+                state.long_rtt += self.long_alpha * (rtt - state.long_rtt)
+                # 延迟明显下降时让基线更快跟上，避免旧的高基线掩盖之后的排队
+                if state.long_rtt > 2 * state.short_rtt:
+                    state.long_rtt *= 0.95
+            
+            # 在途请求不到限制的一半时说明瓶颈不在并发，不放大限制
+            if inflight < state.limit / 2:
+                return
+            
+            gradient = max(0.5, min(1.0, self.tolerance * state.long_rtt / max(state.short_rtt, 1e-9)))
+            new_limit = state.limit * gradient + math.sqrt(state.limit)
+            new_limit = state.limit * (1 - self.smoothing) + new_limit * self.smoothing
+            state.limit = max(self.min_limit, min(self.max_limit, new_limit))
+    
+    def get_stats(self, app_id: Optional[str] = None) -> Dict:
+        """获取并发限制统计，指定app_id时只返回该应用"""
+        with self.lock:
+            stats = {
+                limit_app_id: {
+                    "limit": int(state.limit),
+                    "inflight": state.inflight,
+                    "short_rtt": state.short_rtt,
+                    "long_rtt": state.long_rtt,
+                    "rejected": state.rejected
+                }
+                for limit_app_id, state in self.limits.items()
+                if app_id is None or limit_app_id == app_id
+            }
+        if app_id is not None:
+            return stats.get(app_id, {"limit": self.initial_limit, "inflight": 0,
+                                      "short_rtt": None, "long_rtt": None, "rejected": 0})
+        return stats
+
 class ConnectionPool:
     """连接池管理器"""
     
@@ -197,15 +410,27 @@ class PerformanceOptimizer:
     
     def __init__(self, 
                  enable_monitoring: bool = True,
-                 enable_throttling: bool = True,
+                 enable_throttling: Optional[bool] = None,
                  enable_connection_pool: bool = True,
                  enable_async_processing: bool = True,
+                 enable_admission_control: bool = True,
+                 enable_adaptive_concurrency: bool = True,
                  max_requests_per_second: int = 100,
                  max_requests_per_app: int = 50,
                  max_connections: int = 100,
-                 max_workers: int = 50):
+                 max_workers: int = 50,
+                 max_queue_wait: float = Config.MAX_QUEUE_WAIT,
+                 initial_concurrency: int = 20,
+                 max_concurrency: int = 1000):
         
+        # 固定速率限流默认只在关闭自适应并发限制时启用：固定的每秒请求数上限会让
+        # 自适应限制无法根据延迟找到应用真正的吞吐上限
+        if enable_throttling is None:
+            enable_throttling = not enable_adaptive_concurrency
         self.monitor = PerformanceMonitor() if enable_monitoring else None
+        self.admission = AdmissionController(max_queue_wait) if enable_admission_control else None
+        self.concurrency = (AdaptiveConcurrencyLimiter(initial_concurrency, max_limit=max_concurrency)
+                            if enable_adaptive_concurrency else None)
         self.throttler = RequestThrottler(max_requests_per_second, max_requests_per_app) if enable_throttling else None
         self.connection_pool = ConnectionPool(max_connections) if enable_connection_pool else None
         self.async_processor = AsyncRequestProcessor(max_workers) if enable_async_processing else None
@@ -219,6 +444,28 @@ class PerformanceOptimizer:
             return self.throttler.should_allow_request(app_id)
         return True
     
+    def admit_request(self, app_id: str, queue_depth: int, queue_capacity: int) -> Tuple[bool, float]:
+        """入队前的准入检查，返回 (是否允许, 预计等待秒数)"""
+        if self.admission:
+            return self.admission.admit(app_id, queue_depth, queue_capacity)
+        return True, 0.0
+    
+    def acquire_concurrency(self, app_id: str) -> bool:
+        """占用应用的一个在途名额，超过自适应并发限制时返回False"""
+        if self.concurrency:
+            return self.concurrency.acquire(app_id)
+        return True
+    
+    def release_concurrency(self, app_id: str, rtt: Optional[float] = None, dropped: bool = False):
+        """释放在途名额并用请求延迟调整并发限制"""
+        if self.concurrency:
+            self.concurrency.release(app_id, rtt, dropped)
+    
+    def record_app_completion(self, app_id: str, service_time: float, workers: float = 1):
+        """记录应用处理一个请求的耗时，用于估算排空速率"""
+        if self.admission:
+            self.admission.record_completion(app_id, service_time, workers)
+    
     def record_request_metrics(self, app_id: str, duration: float, status_code: int):
         """记录请求指标"""
         if self.monitor:
@@ -226,9 +473,12 @@ class PerformanceOptimizer:
     
     def get_performance_stats(self, app_id: Optional[str] = None) -> Dict:
         """获取性能统计"""
-        if self.monitor:
-            return self.monitor.get_stats(app_id)
-        return {"message": "性能监控未启用"}
+        stats = self.monitor.get_stats(app_id) if self.monitor else {"message": "性能监控未启用"}
+        if app_id and self.admission:
+            stats["admission"] = self.admission.get_stats(app_id)
+        if self.concurrency:
+            stats["concurrency"] = self.concurrency.get_stats(app_id)
+        return stats
     
     def cleanup(self):
         """清理资源"""
@@ -252,9 +502,13 @@ def enable_performance_optimization(
     max_requests_per_second: int = 100,
     max_requests_per_app: int = 50,
     max_connections: int = 100,
-    max_workers: int = 50
+    max_workers: int = 50,
+    max_queue_wait: float = Config.MAX_QUEUE_WAIT,
+    initial_concurrency: int = 20,
+    max_concurrency: int = 1000,
+    enable_throttling: Optional[bool] = None
 ) -> PerformanceOptimizer:
-    """启用性能优化功能"""
+    """启用性能优化功能，max_requests_per_* 只在启用固定速率限流时生效"""
     global _performance_optimizer
     
     with _optimizer_lock:
@@ -263,7 +517,11 @@ def enable_performance_optimization(
                 max_requests_per_second=max_requests_per_second,
                 max_requests_per_app=max_requests_per_app,
                 max_connections=max_connections,
-                max_workers=max_workers
+                max_workers=max_workers,
+                max_queue_wait=max_queue_wait,
+                initial_concurrency=initial_concurrency,
+                max_concurrency=max_concurrency,
+                enable_throttling=enable_throttling
             )
             logger.info("性能优化已启用")
         return _performance_optimizer
\ No newline at end of file
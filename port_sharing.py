@@ -5,70 +5,445 @@ Flask端口复用核心实现
 import threading
 import time
 import queue
+import tempfile
+import io
+import os
+import select
+import socket
 import uuid
 import json
 import requests
-from typing import Dict, Any, Optional, Callable
+from typing import Dict, Any, BinaryIO, Iterable, List, NamedTuple, Optional, Callable, Tuple, Union
 from flask import Flask, request, jsonify, Response
 from werkzeug.serving import make_server
+from werkzeug.datastructures import EnvironHeaders
+from werkzeug.wsgi import get_input_stream, ClosingIterator
+import itertools
 import asyncio
 import concurrent.futures
-from dataclasses import dataclass, asdict
 import logging
-from .performance import get_performance_optimizer
+from .config import Config
+from .performance import get_performance_optimizer, WorkerStats, AdmissionController
+from .routing import PrefixTrie, normalize_prefix
+from .scheduling import (
+    PriorityRequestQueue, PriorityClassifier, FairScheduler, PRIORITY_NORMAL, PRIORITY_LEVELS
+)
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-@dataclass
+# 进程内单调递增的请求ID，next() 在CPython中是原子操作
+_request_ids = itertools.count(1)
+_process_tag = f"{os.getpid():x}"
+
+def next_request_id() -> int:
+    """分配一个进程内唯一的请求ID"""
+    return next(_request_ids)
+
+def format_request_id(request_id: int) -> str:
+    """请求ID的字符串形式，只在启用请求追踪时生成"""
+    return f"{_process_tag}-{request_id:x}"
+
 class AppRequest:
-    """应用请求数据结构"""
-    request_id: str
-    app_prefix: str
-    method: str
-    path: str
-    headers: Dict[str, str]
-    data: bytes
-    query_string: str
-
-@dataclass
+    """应用请求数据结构（使用__slots__，没有实例字典）"""
+    
+    __slots__ = ('request_id', 'app_prefix', 'method', 'path', 'headers', 'data',
+                 'query_string', 'environ', 'deadline', 'cancelled')
+    
+    def __init__(self, request_id: int, app_prefix: str, method: str, path: str,
+                 headers: Dict[str, str],
+                 data: Union[bytes, memoryview, BinaryIO],
+                 query_string: str,
+                 environ: Optional[Dict[str, Any]] = None,
+                 deadline: Optional[float] = None):
+        self.request_id = request_id
+        self.app_prefix = app_prefix
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.data = data  # 内存中的请求体是memoryview，超过阈值时是已落盘的临时文件
+        self.query_string = query_string
+        self.environ = environ  # WSGI直通模式下携带主控服务器的原始environ
+        self.deadline = deadline  # time.monotonic() 下的绝对截止时间，过期后不再处理
+        self.cancelled = False  # 客户端断开后由主控线程置为True
+    
+    def expired(self, now: Optional[float] = None) -> bool:
+        """请求是否已超过截止时间"""
+        if self.deadline is None:
+            return False
+        return (time.monotonic() if now is None else now) >= self.deadline
+    
+    def __repr__(self) -> str:
+        return f"AppRequest(request_id={self.request_id!r}, method={self.method!r}, path={self.path!r})"
+
 class AppResponse:
-    """应用响应数据结构"""
-    request_id: str
-    status_code: int
-    headers: Dict[str, str]
-    data: bytes
+    """应用响应数据结构（使用__slots__，没有实例字典）"""
+    
+    __slots__ = ('request_id', 'status_code', 'headers', 'data', 'body')
+    
+    def __init__(self, request_id: int, status_code: int,
+                 headers: List[Tuple[str, str]], data: bytes,
+                 body: Optional[Iterable[bytes]] = None):
+        self.request_id = request_id
+        self.status_code = status_code
+        self.headers = headers
+        self.data = data
+        self.body = body  # 流式响应体，由主控线程边迭代边写给客户端
+    
+    def __repr__(self) -> str:
+        return f"AppResponse(request_id={self.request_id!r}, status_code={self.status_code!r})"
+
+# 请求分发模式
+DISPATCH_MODE_WSGI = 'wsgi'                # 直接调用应用的wsgi_app
+DISPATCH_MODE_TEST_CLIENT = 'test_client'  # 通过test_client重新构造请求
+DISPATCH_MODE_PROXY = 'proxy'              # 应用运行自己的服务器，经长连接池转发
+DISPATCH_MODES = (DISPATCH_MODE_WSGI, DISPATCH_MODE_TEST_CLIENT, DISPATCH_MODE_PROXY)
+
+# 请求超时配置：客户端可通过请求头缩短（不能延长）服务端的默认超时
+DEFAULT_REQUEST_TIMEOUT = Config.REQUEST_TIMEOUT
+REQUEST_TIMEOUT_HEADER = 'X-Request-Timeout'
+REQUEST_TIMEOUT_ENVIRON_KEY = 'HTTP_X_REQUEST_TIMEOUT'
+DEADLINE_ENVIRON_KEY = 'port_sharing.deadline'
+REQUEST_ENVIRON_KEY = 'port_sharing.request'
+# 服务器引擎可以在environ中提供检查客户端是否断开的回调，代替对werkzeug.socket的探测
+DISCONNECTED_ENVIRON_KEY = 'port_sharing.disconnected'
+
+# 等待响应期间检测客户端断开的间隔（秒）
+DEFAULT_DISCONNECT_CHECK_INTERVAL = 0.5
+CLIENT_CLOSED_STATUS = 499
+
+# 热替换时等待旧应用实例处理完在途请求的最长时间（秒）
+DEFAULT_DRAIN_TIMEOUT = 30.0
+
+# 集群节点之间转发的请求带有发出节点的ID，接收节点只在本地处理，避免请求在节点之间循环
+FORWARDED_NODE_HEADER = 'X-Port-Sharing-Forwarded'
+FORWARDED_NODE_ENVIRON_KEY = 'HTTP_X_PORT_SHARING_FORWARDED'
+
+class ClientDisconnected(Exception):
+    """客户端在收到响应前断开了连接"""
+
+def client_disconnected(sock: socket.socket, eof_is_disconnect: bool = True) -> bool:
+    """检查客户端是否已断开连接
+    
+    客户端正常关闭连接时读方向只会读到EOF，默认EOF即算断开。eof_is_disconnect 为False时
+    容忍半关闭（客户端 shutdown(SHUT_WR) 后仍在等待响应），只有连接被重置或套接字报告错误才算断开。
+    """
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        if sock.recv(1, socket.MSG_PEEK):
+            return False
+        return eof_is_disconnect or sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) != 0
+    except ValueError:
+        # 例如TLS套接字不支持MSG_PEEK，无法判断时视为仍然连接
+        return False
+    except OSError:
+        return True
+
+def is_request_cancelled() -> bool:
+    """在应用的视图函数中检查当前请求的客户端是否已断开，耗时较长的任务可据此提前结束"""
+    from flask import request as current_request
+    app_request = current_request.environ.get(REQUEST_ENVIRON_KEY)
+    return bool(app_request is not None and app_request.cancelled)
+
+class CancellableBody:
+    """流式响应体包装，未迭代完就被关闭时（客户端断开）把请求标记为已取消
+    
+    on_close 在响应体第一次被关闭时调用，流式响应到这时才算处理完。
+    """
+    
+    def __init__(self, body: Iterable[bytes], app_request: 'AppRequest',
+                 on_close: Optional[Callable[[], None]] = None):
+        self.body = body
+        self.iterator = iter(body)
+        self.app_request = app_request
+        self.on_close = on_close
+        self.finished = False
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self) -> bytes:
+        try:
+            return next(self.iterator)
+        except StopIteration:
+            self.finished = True
+            raise
+    
+    def close(self):
+        if not self.finished:
+            self.app_request.cancelled = True
+        on_close, self.on_close = self.on_close, None
+        try:
+            close = getattr(self.body, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            if on_close is not None:
+                on_close()
+
+# 请求体在内存中缓存的上限，超过后写入临时文件
+DEFAULT_BODY_SPOOL_THRESHOLD = Config.BODY_SPOOL_THRESHOLD
+BODY_CHUNK_SIZE = 64 * 1024
+
+class BufferReader(io.RawIOBase):
+    """只读的内存缓冲区流，readinto直接从memoryview切片复制到调用方的缓冲区"""
+    
+    def __init__(self, buffer: memoryview):
+        self.buffer = buffer
+        self.position = 0
+    
+    def readable(self) -> bool:
+        return True
+    
+    def seekable(self) -> bool:
+        return True
+    
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: len(self.buffer)}[whence]
+        self.position = max(0, min(base + offset, len(self.buffer)))
+        return self.position
+    
+    def tell(self) -> int:
+        return self.position
+    
+    def readinto(self, b) -> int:
+        size = min(len(b), len(self.buffer) - self.position)
+        b[:size] = self.buffer[self.position:self.position + size]
+        self.position += size
+        return size
+
+class DetachableInput(io.RawIOBase):
+    """直通模式交给应用的输入流
+    
+    主控服务器放弃等待响应（超时或客户端断开）时调用 detach()，等应用正在进行的读取结束后收回
+    输入流，之后应用的读取会失败。服务器引擎这时才能关闭或排空原始的输入流，不会和工作线程同时读取。
+    """
+    
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.detached = False
+    
+    def readable(self) -> bool:
+        return True
+    
+    def _check(self):
+        if self.detached:
+            raise ValueError("请求已被主控服务器放弃，不能再读取请求体")
+    
+    def read(self, size: int = -1) -> bytes:
+        with self.lock:
+            self._check()
+            return self.stream.read(size)
+    
+    def readline(self, size: int = -1) -> bytes:
+        with self.lock:
+            self._check()
+            return self.stream.readline(size)
+    
+    def readinto(self, b) -> int:
+        with self.lock:
+            self._check()
+            readinto = getattr(self.stream, 'readinto', None)
+            if readinto is not None:
+                return readinto(b)
+            data = self.stream.read(len(b))
+            b[:len(data)] = data
+            return len(data)
+    
+    def detach(self):
+        with self.lock:
+            self.detached = True
+
+def read_request_body(environ: Dict[str, Any],
+                      spool_threshold: int = DEFAULT_BODY_SPOOL_THRESHOLD) -> Union[memoryview, BinaryIO]:
+    """读取请求体
+    
+    已知长度且不超过阈值的请求体用readinto直接读入预先分配的bytearray，
+    以memoryview的形式按引用传递；更大或长度未知的请求体分块写入临时文件。
+    """
+    stream = get_input_stream(environ)
+    content_length = environ.get('CONTENT_LENGTH')
+    if content_length and content_length.isascii() and content_length.isdigit() \
+            and int(content_length) <= spool_threshold:
+        buffer = memoryview(bytearray(int(content_length)))
+        # Werkzeug 2.3之前的LimitedStream没有readinto，退回到read后复制
+        readinto = getattr(stream, 'readinto', None)
+        received = 0
+        while received < len(buffer):
+            if readinto is not None:
+                size = readinto(buffer[received:])
+            else:
+                chunk = stream.read(len(buffer) - received)
+                size = len(chunk)
+                buffer[received:received + size] = chunk
+            if not size:
+                break
+            received += size
+        return buffer[:received]
+    
+    spooled = tempfile.SpooledTemporaryFile(max_size=spool_threshold)
+    while True:
+        chunk = stream.read(BODY_CHUNK_SIZE)
+        if not chunk:
+            break
+        spooled.write(chunk)
+    spooled.seek(0)
+    return spooled
+
+class ResponseCorrelator:
+    """响应关联器 - 按request_id把响应投递给对应的等待者"""
+    
+    def __init__(self):
+        self.waiters: Dict[int, concurrent.futures.Future] = {}
+        self.lock = threading.Lock()
+    
+    def register(self, request_id: int) -> concurrent.futures.Future:
+        """为请求登记一个等待者，返回用于等待响应的future"""
+        future = concurrent.futures.Future()
+        with self.lock:
+            self.waiters[request_id] = future
+        return future
+    
+    def complete(self, response: AppResponse) -> bool:
+        """完成对应请求的等待者，等待者已不存在（超时放弃）时返回False"""
+        with self.lock:
+            future = self.waiters.pop(response.request_id, None)
+        
+        if future is None:
+            return False
+        
+        future.set_result(response)
+        return True
+    
+    def discard(self, request_id: int):
+        """移除等待者（超时或出错时调用）"""
+        with self.lock:
+            self.waiters.pop(request_id, None)
+    
+    def pending_count(self) -> int:
+        """当前等待响应的请求数"""
+        with self.lock:
+            return len(self.waiters)
+
+class PendingDispatch(NamedTuple):
+    """已放入应用队列、正在等待响应的请求"""
+    app_request: AppRequest
+    future: concurrent.futures.Future
+    app_id: str
+    start_time: float       # time.time()，用于记录请求耗时
+    acquired_at: float      # 取得并发配额的 time.monotonic()，用于自适应并发限制的延迟采样
+    expected_wait: float    # 准入时估算的排队时间，用于计算Retry-After
+
+class RouteEntry(NamedTuple):
+    """路由表中的一个应用（不可变）"""
+    app_id: str
+    prefix: str
+    active: bool
+    dispatch_mode: str
+    request_queue: PriorityRequestQueue
+    classifier: Optional[PriorityClassifier] = None
+    remote: bool = False  # 由集群中其他主控节点提供的应用
+
+class RoutingSnapshot(NamedTuple):
+    """不可变的路由快照，发布后不会再被修改，读取时无需加锁"""
+    routes: PrefixTrie                 # 前缀 -> RouteEntry 的最长匹配索引
+    entries: Dict[str, RouteEntry]     # 应用ID -> RouteEntry
+    
+    def resolve(self, path: str) -> Optional[RouteEntry]:
+        """根据请求路径找到对应的应用"""
+        match = self.routes.longest_match(path)
+        return match[1] if match else None
+
+# 每个应用请求队列的长度上限，防止内存溢出
+REQUEST_QUEUE_MAXSIZE = 1000
 
 class AppRegistry:
     """应用注册器 - 管理所有注册的Flask应用"""
     
     def __init__(self):
         self.apps: Dict[str, Dict[str, Any]] = {}
-        self.request_queues: Dict[str, queue.Queue] = {}
-        self.response_queues: Dict[str, queue.Queue] = {}
+        self.routes = PrefixTrie()  # 写入端的前缀索引，只在持有锁时修改
+        self.request_queues: Dict[str, PriorityRequestQueue] = {}
+        self.responses = ResponseCorrelator()
         self.app_threads: Dict[str, threading.Thread] = {}
+        self.worker_stats: Dict[str, List[WorkerStats]] = {}
         self.lock = threading.RLock()
+        self.snapshot = RoutingSnapshot(self.routes.copy(), {})
+    
+    def _update_route(self, prefix: str, entry: Optional[RouteEntry]):
+        """修改写入端的路由并发布新快照（调用方需持有锁）"""
+        entries = dict(self.snapshot.entries)
+        if entry is None:
+            self.routes.remove(prefix)
+            for app_id, old_entry in self.snapshot.entries.items():
+                if old_entry.prefix == prefix:
+                    del entries[app_id]
+        else:
+            self.routes.insert(prefix, entry)
+            entries[entry.app_id] = entry
+        
+        # 引用赋值是原子的，分发线程要么看到旧快照，要么看到新快照
+        self.snapshot = RoutingSnapshot(self.routes.copy(), entries)
     
-    def register_app(self, app_id: str, prefix: str, app: Flask) -> bool:
-        """注册一个Flask应用"""
+    def register_app(self, app_id: str, prefix: str, app: Optional[Flask],
+                     dispatch_mode: str = DISPATCH_MODE_TEST_CLIENT,
+                     classifier: Optional[PriorityClassifier] = None,
+                     priority_weights: Optional[Dict[str, int]] = None,
+                     remote: bool = False) -> bool:
+        """注册一个Flask应用
+        
+        remote 表示应用由集群中的其他节点提供；本地应用注册到相同前缀时取代远程路由。
+        前缀先规范化，"/api" 和 "/api/" 视为同一个前缀。
+        """
+        prefix = normalize_prefix(prefix)
         with self.lock:
-            if prefix in self.apps:
-                logger.warning(f"应用前缀 '{prefix}' 已存在")
-                return False
+            existing = self.apps.get(prefix)
+            if existing is not None:
+                if remote or not existing.get('remote'):
+                    logger.warning(f"应用前缀 '{prefix}' 已存在")
+                    return False
+                logger.info(f"本地应用 {app_id} 取代集群远程路由 {existing['app_id']}")
+                self.unregister_app(existing['app_id'])
             
             self.apps[prefix] = {
                 'app_id': app_id,
                 'app': app,
                 'prefix': prefix,
-                'active': False
+                'active': False,
+                'remote': remote
             }
-            self.request_queues[app_id] = queue.Queue(maxsize=1000)  # 限制队列大小防止内存溢出
-            self.response_queues[app_id] = queue.Queue(maxsize=1000)
+            self.request_queues[app_id] = PriorityRequestQueue(maxsize=REQUEST_QUEUE_MAXSIZE,
+                                                               weights=priority_weights)
+            self._update_route(prefix, RouteEntry(app_id, prefix, False, dispatch_mode,
+                                                  self.request_queues[app_id], classifier, remote))
             
             logger.info(f"应用已注册: {app_id} -> {prefix}")
             return True
     
+    def replace_app(self, app_id: str, app: Optional[Flask], request_queue: PriorityRequestQueue,
+                    dispatch_mode: str = DISPATCH_MODE_TEST_CLIENT,
+                    classifier: Optional[PriorityClassifier] = None) -> Optional[PriorityRequestQueue]:
+        """把已注册的应用ID指向新的应用实例和请求队列（热替换），返回旧的请求队列
+        
+        新旧路由在同一次快照发布中切换，前缀不会出现无人响应的间隙。
+        """
+        with self.lock:
+            entry = self.snapshot.entries.get(app_id)
+            if entry is None:
+                return None
+            self.apps[entry.prefix]['app'] = app
+            old_queue = self.request_queues[app_id]
+            self.request_queues[app_id] = request_queue
+            self._update_route(entry.prefix, entry._replace(dispatch_mode=dispatch_mode,
+                                                            request_queue=request_queue,
+                                                            classifier=classifier))
+            logger.info(f"应用已替换: {app_id} -> {entry.prefix}")
+            return old_queue
+    
     def unregister_app(self, app_id: str) -> bool:
         """注销一个Flask应用"""
         with self.lock:
@@ -78,32 +453,43 @@ class AppRegistry:
                     prefix_to_remove = prefix
                     break
             
-            if prefix_to_remove:
+            if prefix_to_remove is not None:
                 del self.apps[prefix_to_remove]
+                self._update_route(prefix_to_remove, None)
                 if app_id in self.request_queues:
                     del self.request_queues[app_id]
-                if app_id in self.response_queues:
-                    del self.response_queues[app_id]
                 if app_id in self.app_threads:
                     del self.app_threads[app_id]
+                if app_id in self.worker_stats:
+                    del self.worker_stats[app_id]
                 
                 logger.info(f"应用已注销: {app_id}")
                 return True
             return False
     
     def get_app_by_prefix(self, path: str) -> Optional[str]:
-        """根据请求路径获取对应的应用ID"""
+        """根据请求路径获取对应的应用ID（读取快照，不加锁）"""
+        entry = self.snapshot.resolve(path)
+        return entry.app_id if entry else None
+    
+    def get_worker_stats(self, app_id: Optional[str] = None) -> Dict[str, List[Dict]]:
+        """获取应用工作线程的利用率统计"""
         with self.lock:
-            # 找到最长匹配的前缀
-            best_match = ""
-            best_app_id = None
-            
-            for prefix, app_info in self.apps.items():
-                if path.startswith(prefix) and len(prefix) > len(best_match):
-                    best_match = prefix
-                    best_app_id = app_info['app_id']
-            
-            return best_app_id
+            return {
+                stats_app_id: [stats.to_dict() for stats in worker_stats]
+                for stats_app_id, worker_stats in self.worker_stats.items()
+                if app_id is None or stats_app_id == app_id
+            }
+    
+    def get_queue_stats(self, app_id: Optional[str] = None) -> Dict[str, Dict]:
+        """获取应用请求队列各优先级通道的排队统计"""
+        with self.lock:
+            queues = [
+                (queue_app_id, request_queue)
+                for queue_app_id, request_queue in self.request_queues.items()
+                if app_id is None or queue_app_id == app_id
+            ]
+        return {queue_app_id: request_queue.get_stats() for queue_app_id, request_queue in queues}
     
     def set_app_active(self, app_id: str, active: bool):
         """设置应用的活跃状态"""
@@ -112,22 +498,148 @@ class AppRegistry:
                 if app_info['app_id'] == app_id:
                     app_info['active'] = active
                     break
+            
+            entry = self.snapshot.entries.get(app_id)
+            if entry is not None and entry.active != active:
+                self._update_route(entry.prefix, entry._replace(active=active))
 
 class RequestDispatcher:
     """请求分发器 - 处理请求的路由和分发"""
     
-    def __init__(self, registry: AppRegistry):
+    def __init__(self, registry: AppRegistry,
+                 body_spool_threshold: int = DEFAULT_BODY_SPOOL_THRESHOLD,
+                 enable_tracing: bool = Config.ENABLE_REQUEST_TRACING,
+                 request_timeout: float = DEFAULT_REQUEST_TIMEOUT,
+                 disconnect_check_interval: Optional[float] = DEFAULT_DISCONNECT_CHECK_INTERVAL,
+                 shared_workers: Optional[int] = None,
+                 disconnect_on_eof: bool = True):
         self.registry = registry
-        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=50)  # 线程池优化
+        self.body_spool_threshold = body_spool_threshold
+        self.enable_tracing = enable_tracing
+        self.request_timeout = request_timeout
+        self.disconnect_check_interval = disconnect_check_interval  # None 表示不检测客户端断开
+        self.disconnect_on_eof = disconnect_on_eof  # 读到EOF是否视为断开，False 时容忍客户端半关闭
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=shared_workers or 50)  # 线程池优化
+        # 指定 shared_workers 时所有应用共用上面的线程池，由加权公平调度器选择要服务的应用
+        self.scheduler = FairScheduler(shared_workers, self.executor) if shared_workers else None
+    
+    def request_timeout_for(self, environ: Dict[str, Any]) -> float:
+        """计算请求的超时时间，客户端只能缩短不能延长服务端的默认超时"""
+        header = environ.get(REQUEST_TIMEOUT_ENVIRON_KEY)
+        if header:
+            try:
+                requested = float(header)
+                if requested > 0:
+                    return min(requested, self.request_timeout)
+            except ValueError:
+                logger.warning(f"无效的 {REQUEST_TIMEOUT_HEADER} 请求头: {header}")
+        return self.request_timeout
+    
+    def wait_for_response(self, future: concurrent.futures.Future, deadline: float,
+                          disconnected: Optional[Callable[[], bool]]) -> AppResponse:
+        """等待应用响应，期间定期检查客户端是否断开"""
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise concurrent.futures.TimeoutError()
+            
+            if disconnected is None:
+                return future.result(timeout=remaining)
+            
+            try:
+                return future.result(timeout=min(remaining, self.disconnect_check_interval))
+            except concurrent.futures.TimeoutError:
+                if disconnected():
+                    raise ClientDisconnected()
+    
+    async def wait_for_response_async(self, future: concurrent.futures.Future, deadline: float,
+                                      disconnected: Optional[Callable[[], bool]]) -> AppResponse:
+        """在事件循环中等待应用响应，不占用线程，期间定期检查客户端是否断开"""
+        waiter = asyncio.wrap_future(future)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise concurrent.futures.TimeoutError()
+            
+            if disconnected is None:
+                timeout = remaining
+            else:
+                timeout = min(remaining, self.disconnect_check_interval)
+            try:
+                # shield 保证等待超时时不会取消应用线程将要完成的future
+                return await asyncio.wait_for(asyncio.shield(waiter), timeout)
+            except asyncio.TimeoutError:
+                if disconnected is not None and disconnected():
+                    raise ClientDisconnected()
+    
+    def cancel(self, app_request: AppRequest):
+        """取消请求：排队中的请求会被工作线程跳过，正在处理的请求可通过 is_request_cancelled() 感知"""
+        app_request.cancelled = True
+        self.registry.responses.discard(app_request.request_id)
+    
+    def dispatch_request(self, environ: Dict[str, Any]) -> Response:
+        """分发请求到对应的应用，在当前线程中等待响应"""
+        pending = self.submit_request(environ)
+        if isinstance(pending, Response):
+            return pending
+        
+        try:
+            response = self.wait_for_response(pending.future, pending.app_request.deadline,
+                                              self.disconnect_check(environ))
+        except Exception as e:
+            return self.complete_request(pending, error=e)
+        return self.complete_request(pending, response)
+    
+    def disconnect_check(self, environ: Dict[str, Any]) -> Optional[Callable[[], bool]]:
+        """检查客户端是否断开的回调：优先使用服务器引擎提供的，否则探测werkzeug的套接字"""
+        if not self.disconnect_check_interval:
+            return None
+        disconnected = environ.get(DISCONNECTED_ENVIRON_KEY)
+        if disconnected is not None:
+            return disconnected
+        sock = environ.get('werkzeug.socket')
+        if sock is None:
+            return None
+        return lambda: client_disconnected(sock, self.disconnect_on_eof)
+    
+    async def dispatch_request_async(self, environ: Dict[str, Any],
+                                     disconnected: Optional[Callable[[], bool]] = None) -> Response:
+        """分发请求到对应的应用，在事件循环中await响应
+        
+        disconnected 是检查客户端是否已断开的回调，由服务器引擎提供。
+        """
+        pending = self.submit_request(environ)
+        if isinstance(pending, Response):
+            return pending
+        
+        if not self.disconnect_check_interval:
+            disconnected = None
+        try:
+            response = await self.wait_for_response_async(pending.future, pending.app_request.deadline,
+                                                          disconnected)
+        except Exception as e:
+            return self.complete_request(pending, error=e)
+        return self.complete_request(pending, response)
     
-    def dispatch_request(self, flask_request) -> Response:
-        """分发请求到对应的应用"""
+    def submit_request(self, environ: Dict[str, Any]) -> Union[Response, PendingDispatch]:
+        """路由请求并放入应用的请求队列
+        
+        未找到应用或被限流、准入控制拒绝时直接返回响应，否则返回等待响应所需的状态。
+        """
         start_time = time.time()
-        path = flask_request.path
-        app_id = self.registry.get_app_by_prefix(path)
+        timeout = self.request_timeout_for(environ)
+        deadline = time.monotonic() + timeout
+        # WSGI的PATH_INFO是按latin-1解码的原始字节，按UTF-8重新解码后才能匹配非ASCII前缀
+        path = '/' + environ.get('PATH_INFO', '').encode('latin-1').decode('utf-8', 'replace').lstrip('/')
+        method = environ.get('REQUEST_METHOD', 'GET')
+        route = self.registry.snapshot.resolve(path)
         
-        if not app_id:
+        if route is None:
             return Response("未找到匹配的应用", status=404)
+        if route.remote and FORWARDED_NODE_ENVIRON_KEY in environ:
+            # 其他节点转发来的请求不再继续转发
+            return Response("集群转发循环", status=508)
+        app_id = route.app_id
         
         # 获取性能优化器
         optimizer = get_performance_optimizer()
@@ -136,66 +648,230 @@ class RequestDispatcher:
         if not optimizer.should_process_request(app_id):
             return Response("请求频率超限", status=429)
         
+        # 准入控制：队列积压超过可接受的等待时间时立即拒绝，不再阻塞主控线程
+        request_queue = route.request_queue
+        admitted, expected_wait = optimizer.admit_request(app_id, request_queue.qsize(), request_queue.maxsize)
+        if not admitted or expected_wait > timeout:
+            optimizer.record_request_metrics(app_id, time.time() - start_time, 503)
+            return self.busy_response(expected_wait)
+        
         # 创建请求对象
-        app_request = AppRequest(
-            request_id=str(uuid.uuid4()),
-            app_prefix=path,
-            method=flask_request.method,
-            path=path,
-            headers=dict(flask_request.headers),
-            data=flask_request.get_data(),
-            query_string=flask_request.query_string.decode('utf-8')
-        )
+        request_id = next_request_id()
+        if route.dispatch_mode == DISPATCH_MODE_WSGI:
+            # 直通模式：只复制environ字典，请求体由应用直接从客户端的wsgi.input流式读取
+            app_request = AppRequest(
+                request_id=request_id,
+                app_prefix=path,
+                method=method,
+                path=path,
+                headers={},
+                data=b'',
+                query_string='',
+                environ=dict(environ),
+                deadline=deadline
+            )
+            app_request.environ[DEADLINE_ENVIRON_KEY] = deadline
+            app_request.environ[REQUEST_ENVIRON_KEY] = app_request
+            if 'wsgi.input' in environ:
+                app_request.environ['wsgi.input'] = DetachableInput(environ['wsgi.input'])
+        else:
+            app_request = AppRequest(
+                request_id=request_id,
+                app_prefix=path,
+                method=method,
+                path=path,
+                headers=dict(EnvironHeaders(environ)),
+                data=read_request_body(environ, self.body_spool_threshold),
+                query_string=environ.get('QUERY_STRING', '').encode('latin-1').decode('utf-8', 'replace'),
+                deadline=deadline
+            )
+        
+        # 自适应并发限制：在途请求数达到按延迟调整出的上限时拒绝
+        if not optimizer.acquire_concurrency(app_id):
+            if hasattr(app_request.data, 'close'):
+                app_request.data.close()
+            optimizer.record_request_metrics(app_id, time.time() - start_time, 503)
+            return self.busy_response(expected_wait)
         
+        # 先登记等待者，避免应用在登记前就完成响应
+        future = self.registry.responses.register(app_request.request_id)
+        pending = PendingDispatch(app_request, future, app_id, start_time, time.monotonic(), expected_wait)
         try:
-            # 将请求放入应用的请求队列
-            self.registry.request_queues[app_id].put(app_request, timeout=5)
-            
-            # 等待响应
-            response = self.registry.response_queues[app_id].get(timeout=30)
-            
-            if response.request_id != app_request.request_id:
-                logger.error(f"响应ID不匹配: 期望 {app_request.request_id}, 得到 {response.request_id}")
-                duration = time.time() - start_time
-                optimizer.record_request_metrics(app_id, duration, 500)
-                return Response("内部错误", status=500)
+            # 将请求放入应用请求队列中对应的优先级通道
+            priority = route.classifier.classify(environ, path) if route.classifier else PRIORITY_NORMAL
+            request_queue.put_nowait(app_request, priority)
+            if self.scheduler is not None:
+                self.scheduler.submit(app_id)
+        except Exception as e:
+            return self.complete_request(pending, error=e)
+        return pending
+    
+    def complete_request(self, pending: PendingDispatch, response: Optional[AppResponse] = None,
+                         error: Optional[BaseException] = None) -> Response:
+        """根据应用的响应或等待中出现的错误构建返回给客户端的响应，并释放并发配额"""
+        app_request = pending.app_request
+        app_id = pending.app_id
+        optimizer = get_performance_optimizer()
+        rtt: Optional[float] = None
+        overloaded = False
+        streaming = False
+        
+        try:
+            if error is not None:
+                raise error
+            rtt = time.monotonic() - pending.acquired_at
             
-            # 记录性能指标
-            duration = time.time() - start_time
-            optimizer.record_request_metrics(app_id, duration, response.status_code)
+            # 构建Flask响应，流式响应体直接透传，客户端写入阻塞时应用的生成器也随之暂停
+            if response.body is not None:
+                def finish_stream():
+                    # 流式响应体写完（或客户端断开）时才记录耗时并释放并发配额；
+                    # 延迟样本仍取到响应头为止，不受客户端读取速度影响
+                    optimizer.record_request_metrics(app_id, time.time() - pending.start_time,
+                                                     response.status_code)
+                    optimizer.release_concurrency(app_id, rtt, False)
+                
+                flask_response = Response(
+                    CancellableBody(response.body, app_request, finish_stream),
+                    status=response.status_code,
+                    headers=response.headers,
+                    direct_passthrough=True
+                )
+            else:
+                optimizer.record_request_metrics(app_id, time.time() - pending.start_time,
+                                                 response.status_code)
+                flask_response = Response(
+                    response.data,
+                    status=response.status_code,
+                    headers=response.headers
+                )
             
-            # 构建Flask响应
-            flask_response = Response(
-                response.data,
-                status=response.status_code,
-                headers=response.headers
-            )
+            if self.enable_tracing:
+                trace_id = format_request_id(app_request.request_id)
+                flask_response.headers['X-Request-ID'] = trace_id
+                logger.debug(f"请求 {trace_id} {app_request.method} {app_request.path} -> {response.status_code}")
+            streaming = response.body is not None
             return flask_response
             
         except queue.Full:
+            overloaded = True
             logger.error(f"应用 {app_id} 的请求队列已满")
-            duration = time.time() - start_time
+            duration = time.time() - pending.start_time
             optimizer.record_request_metrics(app_id, duration, 503)
-            return Response("服务繁忙", status=503)
-        except queue.Empty:
+            return self.busy_response(pending.expected_wait)
+        except concurrent.futures.TimeoutError:
+            overloaded = True
             logger.error(f"应用 {app_id} 响应超时")
-            duration = time.time() - start_time
+            duration = time.time() - pending.start_time
             optimizer.record_request_metrics(app_id, duration, 504)
             return Response("请求超时", status=504)
+        except ClientDisconnected:
+            logger.info(f"客户端已断开，取消应用 {app_id} 的请求 {app_request.request_id}")
+            self.cancel(app_request)
+            duration = time.time() - pending.start_time
+            optimizer.record_request_metrics(app_id, duration, CLIENT_CLOSED_STATUS)
+            return Response("客户端已断开", status=CLIENT_CLOSED_STATUS)
         except Exception as e:
             logger.error(f"分发请求时出错: {e}")
-            duration = time.time() - start_time
+            duration = time.time() - pending.start_time
             optimizer.record_request_metrics(app_id, duration, 500)
             return Response("内部错误", status=500)
+        finally:
+            self.registry.responses.discard(app_request.request_id)
+            if error is not None and app_request.environ is not None:
+                # 直通模式的应用可能仍在读取客户端的输入流，收回后服务器引擎才能关闭它
+                stream = app_request.environ.get('wsgi.input')
+                if isinstance(stream, DetachableInput):
+                    stream.detach()
+            if not streaming:
+                optimizer.release_concurrency(app_id, rtt, overloaded)
+    
+    @staticmethod
+    def busy_response(expected_wait: float) -> Response:
+        """应用繁忙时的503响应，Retry-After由预计等待时间计算"""
+        return Response("服务繁忙", status=503,
+                        headers={'Retry-After': str(AdmissionController.retry_after(expected_wait))})
+
+def create_listen_socket(host: str, port: int, backlog: int = 128) -> socket.socket:
+    """创建监听套接字（设置SO_REUSEADDR，与werkzeug的服务器一致）"""
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        sock.listen(backlog)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+def create_reuse_port_socket(host: str, port: int, backlog: int = 128) -> socket.socket:
+    """创建设置了SO_REUSEPORT的监听套接字，多个进程可以同时绑定同一端口"""
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        raise RuntimeError("当前平台不支持SO_REUSEPORT")
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((host, port))
+        sock.listen(backlog)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+# 主控服务器管理路由的前缀
+MASTER_ROUTE_PREFIX = '/_master/'
+
+# 主控服务器引擎
+ENGINE_WERKZEUG = 'werkzeug'  # werkzeug的多线程服务器，每个连接一个线程
+ENGINE_ASYNCIO = 'asyncio'    # 在事件循环上处理连接，等待响应时不占用线程
+ENGINE_SELECTORS = 'selectors'  # 单个I/O线程多路复用所有连接，请求由固定大小的线程池处理
+ENGINES = (ENGINE_WERKZEUG, ENGINE_ASYNCIO, ENGINE_SELECTORS)
 
 class MasterServer:
     """主控服务器 - 真正占用端口的Flask服务器"""
     
-    def __init__(self, host: str = '127.0.0.1', port: int = 5000):
+    def __init__(self, host: str = '127.0.0.1', port: int = 5000,
+                 body_spool_threshold: int = DEFAULT_BODY_SPOOL_THRESHOLD,
+                 enable_tracing: bool = Config.ENABLE_REQUEST_TRACING,
+                 request_timeout: float = DEFAULT_REQUEST_TIMEOUT,
+                 disconnect_check_interval: Optional[float] = DEFAULT_DISCONNECT_CHECK_INTERVAL,
+                 shared_workers: Optional[int] = None,
+                 disconnect_on_eof: bool = True,
+                 unix_socket: Optional[str] = None,
+                 unix_socket_mode: int = 0o600,
+                 reuse_port: bool = False,
+                 engine: str = ENGINE_WERKZEUG,
+                 engine_options: Optional[Dict[str, Any]] = None,
+                 cluster_peers: Optional[List[str]] = None,
+                 cluster_address: Optional[str] = None,
+                 cluster_options: Optional[Dict[str, Any]] = None):
+        if engine not in ENGINES:
+            raise ValueError(f"不支持的服务器引擎: {engine}")
         self.host = host
         self.port = port
+        self.reuse_port = reuse_port  # 多个进程绑定同一端口，由内核分配连接
+        self.engine = engine
+        self.engine_options = engine_options or {}  # 内置引擎的参数，例如超时和监听队列长度
+        self.unix_socket = unix_socket  # 进程外应用连接的Unix域套接字路径
+        self.unix_socket_mode = unix_socket_mode  # 套接字文件的权限，默认只有当前用户能连接
+        self.transport = None
+        self.upstreams: Dict[str, Any] = {}  # 反向代理模式的应用ID -> UpstreamProxy
+        self.wrappers: Dict[str, 'AppWrapper'] = {}  # 应用ID -> 正在运行的应用包装器，供热替换使用
+        # 集群模式：cluster_peers 为其他节点的 host:port 列表（可以为空，等待其他节点加入），
+        # cluster_address 是其他节点访问本节点的地址，默认使用监听地址；
+        # cluster_options['secret'] 是所有节点共用的密钥，用于签名节点之间的同步消息
+        self.cluster_peers = cluster_peers
+        self.cluster_address = cluster_address
+        self.cluster_options = cluster_options or {}
+        if cluster_peers is not None and not self.cluster_options.get('secret'):
+            raise ValueError("集群模式需要在 cluster_options 中设置共享密钥 secret")
+        self.cluster = None
         self.registry = AppRegistry()
-        self.dispatcher = RequestDispatcher(self.registry)
+        self.dispatcher = RequestDispatcher(self.registry, body_spool_threshold, enable_tracing,
+                                            request_timeout, disconnect_check_interval,
+                                            shared_workers, disconnect_on_eof)
         self.master_app = Flask(__name__)
         self.server = None
         self.running = False
@@ -210,23 +886,24 @@ class MasterServer:
         @self.master_app.route('/_master/health', methods=['GET'])
         def health_check():
             """健康检查端点"""
+            entries = self.registry.snapshot.entries
             return jsonify({
                 'status': 'healthy',
-                'registered_apps': len(self.registry.apps),
-                'active_apps': sum(1 for app in self.registry.apps.values() if app['active'])
+                'registered_apps': len(entries),
+                'active_apps': sum(1 for entry in entries.values() if entry.active)
             })
         
         @self.master_app.route('/_master/apps', methods=['GET'])
         def list_apps():
             """列出所有注册的应用"""
-            apps_info = []
-            with self.registry.lock:
-                for prefix, app_info in self.registry.apps.items():
-                    apps_info.append({
-                        'app_id': app_info['app_id'],
-                        'prefix': prefix,
-                        'active': app_info['active']
-                    })
+            apps_info = [
+                {
+                    'app_id': entry.app_id,
+                    'prefix': entry.prefix,
+                    'active': entry.active
+                }
+                for entry in self.registry.snapshot.entries.values()
+            ]
             return jsonify(apps_info)
         
         @self.master_app.route('/_master/stats', methods=['GET'])
@@ -235,6 +912,16 @@ class MasterServer:
             app_id = request.args.get('app_id')
             optimizer = get_performance_optimizer()
             stats = optimizer.get_performance_stats(app_id)
+            stats['workers'] = self.registry.get_worker_stats(app_id)
+            stats['queues'] = self.registry.get_queue_stats(app_id)
+            if self.dispatcher.scheduler is not None:
+                stats['scheduler'] = self.dispatcher.scheduler.get_stats()
+            if self.upstreams:
+                stats['upstreams'] = {
+                    upstream_app_id: upstream.get_stats()
+                    for upstream_app_id, upstream in list(self.upstreams.items())
+                    if app_id is None or upstream_app_id == app_id
+                }
             return jsonify(stats)
         
         @self.master_app.route('/_master/stats/<app_id>', methods=['GET'])
@@ -242,17 +929,43 @@ class MasterServer:
             """获取特定应用的性能统计"""
             optimizer = get_performance_optimizer()
             stats = optimizer.get_performance_stats(app_id)
+            stats['workers'] = self.registry.get_worker_stats(app_id).get(app_id, [])
+            stats['queues'] = self.registry.get_queue_stats(app_id).get(app_id, {})
+            upstream = self.upstreams.get(app_id)
+            if upstream is not None:
+                stats['upstream'] = upstream.get_stats()
             return jsonify(stats)
         
-        @self.master_app.before_request
-        def before_request():
-            """在每个请求前执行的钩子"""
-            # 跳过主控路由
-            if request.path.startswith('/_master/'):
-                return None
-            
-            # 分发到对应的应用
-            return self.dispatcher.dispatch_request(request)
+        @self.master_app.route('/_master/cluster', methods=['GET', 'POST'])
+        def cluster_state():
+            """集群对等协议：POST 交换节点状态，GET 查看集群成员和远程路由"""
+            if self.cluster is None:
+                return jsonify({'error': '未启用集群模式'}), 404
+            if request.method == 'GET':
+                return jsonify(self.cluster.get_stats())
+            from .cluster import CLUSTER_SIGNATURE_HEADER, ClusterAuthError
+            try:
+                body, signature = self.cluster.handle_signed_sync(
+                    request.get_data(), request.headers.get(CLUSTER_SIGNATURE_HEADER, ''))
+            except ClusterAuthError as e:
+                logger.warning(f"拒绝来自 {request.remote_addr} 的集群消息: {e}")
+                return jsonify({'error': str(e)}), 403
+            except (KeyError, TypeError, ValueError) as e:
+                return jsonify({'error': f'无效的集群消息: {e}'}), 400
+            return Response(body, mimetype='application/json',
+                            headers={CLUSTER_SIGNATURE_HEADER: signature})
+        
+    def wsgi_app(self, environ: Dict[str, Any], start_response):
+        """主控服务器的WSGI入口
+        
+        只有 /_master/ 管理路由经过Flask，其余请求直接交给分发器，
+        省去Flask请求上下文和URL匹配的开销。
+        """
+        if environ.get('PATH_INFO', '').startswith(MASTER_ROUTE_PREFIX):
+            return self.master_app(environ, start_response)
+        
+        response = self.dispatcher.dispatch_request(environ)
+        return response(environ, start_response)
     
     def start(self):
         """启动主控服务器"""
@@ -260,16 +973,43 @@ class MasterServer:
             logger.warning("主控服务器已在运行中")
             return
         
-        self.server = make_server(self.host, self.port, self.master_app, threaded=True)
+        if self.engine != ENGINE_WERKZEUG:
+            if self.engine == ENGINE_ASYNCIO:
+                from .async_server import AsyncMasterEngine as engine_class
+            else:
+                from .selector_server import SelectorMasterEngine as engine_class
+            self.server = engine_class(self, self.host, self.port, reuse_port=self.reuse_port,
+                                       **self.engine_options)
+        elif self.reuse_port:
+            listener = create_reuse_port_socket(self.host, self.port)
+            try:
+                self.server = make_server(self.host, self.port, self.wsgi_app, threaded=True,
+                                          fd=listener.fileno())
+            finally:
+                # make_server 复制了文件描述符，这里的副本可以关闭
+                listener.close()
+        else:
+            self.server = make_server(self.host, self.port, self.wsgi_app, threaded=True)
         self.running = True
         
         def run_server():
-            logger.info(f"主控服务器启动在 {self.host}:{self.port}")
+            logger.info(f"主控服务器启动在 {self.host}:{self.port} (引擎: {self.engine})")
             self.server.serve_forever()
         
         self.server_thread = threading.Thread(target=run_server, daemon=True)
         self.server_thread.start()
         
+        if self.unix_socket:
+            from .transport import TransportServer
+            self.transport = TransportServer(self, self.unix_socket, self.unix_socket_mode)
+            self.transport.start()
+        
+        if self.cluster_peers is not None:
+            from .cluster import ClusterNode
+            address = self.cluster_address or f"{self.host}:{self.server.server_port}"
+            self.cluster = ClusterNode(self, address, self.cluster_peers, **self.cluster_options)
+            self.cluster.start()
+        
         # 等待服务器启动
         time.sleep(0.5)
         
@@ -279,6 +1019,10 @@ class MasterServer:
             return
         
         self.running = False
+        if self.cluster:
+            self.cluster.stop()
+        if self.transport:
+            self.transport.stop()
         if self.server:
             self.server.shutdown()
         
@@ -290,13 +1034,26 @@ class MasterServer:
 class AppWrapper:
     """应用包装器 - 重写Flask应用的run方法"""
     
-    def __init__(self, app: Flask, app_id: str, prefix: str, master_server: MasterServer):
+    def __init__(self, app: Flask, app_id: str, prefix: str, master_server: MasterServer,
+                 workers: int = Config.APP_WORKERS, dispatch_mode: str = DISPATCH_MODE_TEST_CLIENT,
+                 priority_rules: Optional[Dict[str, str]] = None,
+                 priority_weights: Optional[Dict[str, int]] = None,
+                 weight: float = 1.0):
         self.app = app
         self.app_id = app_id
-        self.prefix = prefix
+        self.prefix = normalize_prefix(prefix)
         self.master_server = master_server
+        self.workers = max(1, workers)
+        self.dispatch_mode = dispatch_mode
+        self.priority_rules = priority_rules
+        self.priority_weights = priority_weights
+        self.weight = weight
         self.running = False
-        self.polling_thread = None
+        self.polling_threads: List[threading.Thread] = []
+        self.request_queue: Optional[PriorityRequestQueue] = None
+        self.successor: Optional['AppWrapper'] = None  # 热替换后接替本实例的包装器
+        self.in_flight = 0  # 正在处理的请求数，热替换时据此等待旧实例排空
+        self.in_flight_lock = threading.Lock()
         
         # 保存原始的run方法
         self.original_run = app.run
@@ -307,57 +1064,220 @@ class AppWrapper:
     def wrapped_run(self, host=None, port=None, debug=None, load_dotenv=True, **options):
         """重写的run方法 - 启动轮询而不是真正的服务器"""
         logger.info(f"应用 {self.app_id} 开始轮询模式运行")
+        self.prepare()
         
-        # 注册到主控服务器
-        if not self.master_server.registry.register_app(self.app_id, self.prefix, self.app):
+        # 注册到主控服务器，此时视图函数都已定义，可以收集优先级装饰器
+        classifier = PriorityClassifier(self.app, self.prefix, self.priority_rules)
+        if not self.master_server.registry.register_app(self.app_id, self.prefix, self.app,
+                                                        self.dispatch_mode, classifier,
+                                                        self.priority_weights):
             logger.error(f"注册应用失败: {self.app_id}")
             return
+        self.request_queue = self.master_server.registry.request_queues[self.app_id]
         
-        # 设置为活跃状态
-        self.master_server.registry.set_app_active(self.app_id, True)
-        
-        # 启动轮询线程
+        # 先启动工作线程（或加入共享线程池）再设置为活跃状态，否则活跃后最早到达的请求
+        # 没有线程池任务处理
         self.running = True
-        self.polling_thread = threading.Thread(target=self.polling_loop, daemon=True)
-        self.polling_thread.start()
+        self.start_workers()
+        self.master_server.registry.set_app_active(self.app_id, True)
+        self.master_server.wrappers[self.app_id] = self
         
+        current = self
         try:
-            # 保持主线程运行
-            while self.running:
-                time.sleep(0.1)
+            # 保持主线程运行，热替换后继续等待接替的实例
+            while True:
+                while current.running:
+                    time.sleep(0.1)
+                if current.successor is None:
+                    break
+                current = current.successor
         except KeyboardInterrupt:
             logger.info(f"应用 {self.app_id} 收到中断信号")
         finally:
-            self.stop()
+            current.stop()
+    
+    def prepare(self):
+        """注册到主控服务器之前的准备工作，子类可以在这里启动应用自己的服务器"""
+    
+    def start_workers(self):
+        """启动消费 self.request_queue 的工作线程，或加入主控服务器的共享线程池"""
+        scheduler = self.master_server.dispatcher.scheduler
+        if scheduler is not None:
+            # 共享线程池模式：不启动专属线程，请求由调度器按权重分配到共享线程上处理
+            stats = WorkerStats(0)
+            with self.master_server.registry.lock:
+                self.master_server.registry.worker_stats[self.app_id] = [stats]
+            scheduler.add_app(self.app_id, self.request_queue,
+                              lambda app_request: self.handle_request(app_request, stats),
+                              self.weight)
+            worker_stats = []
+        else:
+            # 启动轮询线程池，所有工作线程共同消费同一个请求队列
+            worker_stats = [WorkerStats(index) for index in range(self.workers)]
+            with self.master_server.registry.lock:
+                self.master_server.registry.worker_stats[self.app_id] = worker_stats
+        
+        self.polling_threads = [
+            threading.Thread(target=self.polling_loop, args=(stats,), daemon=True,
+                             name=f"port-sharing-{self.app_id[:8]}-{stats.worker_index}")
+            for stats in worker_stats
+        ]
+        for thread in self.polling_threads:
+            thread.start()
+    
+    def capacity(self) -> float:
+        """应用可用的处理线程数，准入控制据此估算排队等待时间"""
+        scheduler = self.master_server.dispatcher.scheduler
+        if scheduler is not None:
+            return scheduler.worker_share(self.app_id)
+        return self.workers
+    
+    def create_successor(self, app: Flask) -> 'AppWrapper':
+        """用相同的前缀和配置为新的应用实例创建包装器"""
+        return AppWrapper(app, self.app_id, self.prefix, self.master_server, workers=self.workers,
+                          dispatch_mode=self.dispatch_mode, priority_rules=self.priority_rules,
+                          priority_weights=self.priority_weights, weight=self.weight)
+    
+    def warm_up(self, paths: Iterable[str]):
+        """在接收流量之前请求一遍给定的路径（不含前缀），触发首次请求的初始化和缓存加载"""
+        with self.app.test_client() as client:
+            for path in paths:
+                response = client.get(path)
+                status_code = response.status_code
+                response.close()
+                if status_code >= 500:
+                    raise RuntimeError(f"应用 {self.app_id} 预热请求 {path} 失败: {status_code}")
     
-    def polling_loop(self):
+    def hot_swap(self, app: Flask, warmup_paths: Optional[Iterable[str]] = None,
+                 drain_timeout: float = DEFAULT_DRAIN_TIMEOUT) -> 'AppWrapper':
+        """用新的应用实例替换正在运行的应用，前缀始终可用
+        
+        新实例预热并启动工作线程后，路由快照原子地切换到它的请求队列，尚未开始处理的排队请求
+        一并移过去；旧实例处理完在途请求（最多等待 drain_timeout 秒）后释放。
+        预热失败时抛出异常，旧实例继续服务。返回新实例的包装器。
+        """
+        if not self.running or self.successor is not None:
+            raise RuntimeError(f"应用 {self.app_id} 未在运行，无法热替换")
+        
+        registry = self.master_server.registry
+        successor = self.create_successor(app)
+        successor.prepare()
+        try:
+            successor.warm_up(warmup_paths or ())
+        except Exception:
+            successor.release()
+            raise
+        
+        successor.request_queue = PriorityRequestQueue(maxsize=REQUEST_QUEUE_MAXSIZE,
+                                                       weights=successor.priority_weights)
+        successor.running = True
+        successor.start_workers()
+        classifier = PriorityClassifier(app, self.prefix, successor.priority_rules)
+        old_queue = registry.replace_app(self.app_id, app, successor.request_queue,
+                                         successor.dispatch_mode, classifier)
+        if old_queue is None:
+            # 应用已在替换前被注销
+            successor.running = False
+            successor.release()
+            raise RuntimeError(f"应用 {self.app_id} 已注销，无法热替换")
+        
+        self.successor = successor
+        self.master_server.wrappers[self.app_id] = successor
+        self.running = False
+        self.transfer_queued(old_queue, successor.request_queue)
+        
+        # 等待旧实例处理完在途请求
+        deadline = time.monotonic() + drain_timeout
+        while self.in_flight and time.monotonic() < deadline:
+            time.sleep(0.01)
+        if self.in_flight:
+            logger.warning(f"应用 {self.app_id} 的旧实例在 {drain_timeout} 秒内未处理完 {self.in_flight} 个请求")
+        self.stop()
+        # 切换前读到旧快照的分发线程可能在这之后才入队
+        self.transfer_queued(old_queue, successor.request_queue)
+        logger.info(f"应用 {self.app_id} 已热替换")
+        return successor
+    
+    def transfer_queued(self, old_queue: PriorityRequestQueue, new_queue: PriorityRequestQueue):
+        """把旧队列中尚未处理的请求交给新实例"""
+        moved = old_queue.transfer_to(new_queue)
+        scheduler = self.master_server.dispatcher.scheduler
+        if scheduler is not None:
+            # 为移过去的请求重新安排共享线程池任务
+            for _ in range(moved):
+                scheduler.submit(self.app_id)
+    
+    def polling_loop(self, stats: Optional[WorkerStats] = None):
         """轮询循环 - 处理来自主控服务器的请求"""
         logger.info(f"应用 {self.app_id} 开始轮询循环")
         
         while self.running:
             try:
                 # 从请求队列获取请求
-                app_request = self.master_server.registry.request_queues[self.app_id].get(timeout=1)
-                
-                # 处理请求
-                response = self.process_request(app_request)
-                
-                # 将响应放入响应队列
-                self.master_server.registry.response_queues[self.app_id].put(response, timeout=5)
-                
+                app_request = self.request_queue.get(timeout=1)
+                self.handle_request(app_request, stats)
             except queue.Empty:
                 # 轮询超时，继续下一次循环
                 continue
-            except queue.Full:
-                logger.error(f"应用 {self.app_id} 的响应队列已满")
             except Exception as e:
                 logger.error(f"应用 {self.app_id} 轮询循环出错: {e}")
                 time.sleep(0.1)  # 避免疯狂循环
         
         logger.info(f"应用 {self.app_id} 轮询循环结束")
     
+    def handle_request(self, app_request: AppRequest, stats: Optional[WorkerStats] = None):
+        """处理一个排队的请求并把响应交给等待它的主控线程"""
+        # 主控线程已经放弃等待的请求直接丢弃，不再占用工作线程
+        if app_request.cancelled or app_request.expired():
+            if app_request.cancelled:
+                logger.info(f"应用 {self.app_id} 的请求 {app_request.request_id} 已被取消，跳过处理")
+                if stats is not None:
+                    stats.cancelled += 1
+            else:
+                logger.warning(f"应用 {self.app_id} 的请求 {app_request.request_id} 已超过截止时间，跳过处理")
+                if stats is not None:
+                    stats.expired += 1
+            self.master_server.registry.responses.discard(app_request.request_id)
+            if hasattr(app_request.data, 'close'):
+                app_request.data.close()
+            return
+        
+        # 处理请求
+        with self.in_flight_lock:
+            self.in_flight += 1
+        streaming = False
+        try:
+            started = time.time()
+            response = self.process_request(app_request)
+            service_time = time.time() - started
+            if response.body is not None:
+                # 流式响应体由主控线程继续迭代，关闭后才算处理完，热替换据此等待旧实例排空
+                response.body = ClosingIterator(response.body, self.finish_request)
+                streaming = True
+        finally:
+            if not streaming:
+                self.finish_request()
+        if stats is not None:
+            stats.record(service_time)
+        get_performance_optimizer().record_app_completion(self.app_id, service_time, self.capacity())
+        
+        # 将响应交给等待该请求的主控线程
+        if not self.master_server.registry.responses.complete(response):
+            logger.warning(f"应用 {self.app_id} 的请求 {response.request_id} 已无人等待，响应被丢弃")
+            if response.body is not None:
+                response.body.close()
+    
+    def finish_request(self):
+        """一个请求处理完（流式响应体已关闭）"""
+        with self.in_flight_lock:
+            self.in_flight -= 1
+    
     def process_request(self, app_request: AppRequest) -> AppResponse:
         """处理单个请求"""
+        if app_request.environ is not None:
+            return self.process_wsgi_request(app_request)
+        
+        close_body = True
         try:
             # 移除前缀，获取应用内的路径
             app_path = app_request.path
@@ -371,63 +1291,163 @@ class AppWrapper:
                     'method': app_request.method,
                     'path': app_path,
                     'headers': app_request.headers,
-                    'query_string': app_request.query_string
+                    'query_string': app_request.query_string,
+                    'environ_overrides': {REQUEST_ENVIRON_KEY: app_request}
                 }
                 
-                if app_request.data:
+                if hasattr(app_request.data, 'read'):
+                    # 已落盘的请求体以流的形式交给应用，不再整体读入内存
+                    body = app_request.data
+                    body.seek(0, 2)
+                    kwargs['content_length'] = body.tell()
+                    body.seek(0)
+                    kwargs['input_stream'] = body
+                    kwargs['headers'] = {
+                        key: value for key, value in app_request.headers.items()
+                        if key.lower() not in ('content-length', 'transfer-encoding')
+                    }
+                elif isinstance(app_request.data, memoryview):
+                    kwargs['content_length'] = len(app_request.data)
+                    kwargs['input_stream'] = BufferReader(app_request.data)
+                elif app_request.data:
                     kwargs['data'] = app_request.data
                 
-                # 发送请求到应用
-                response = client.open(**kwargs)
+                # 发送请求到应用，不缓冲响应体
+                response = client.open(buffered=False, **kwargs)
+                
+                # 响应体迭代结束后再关闭应用的响应和落盘的请求体
+                callbacks = [response.close]
+                if hasattr(app_request.data, 'close'):
+                    callbacks.append(app_request.data.close)
+                close_body = False
                 
                 # 构建响应对象
                 app_response = AppResponse(
                     request_id=app_request.request_id,
                     status_code=response.status_code,
-                    headers=dict(response.headers),
-                    data=response.get_data()
+                    headers=response.headers.to_wsgi_list(),
+                    data=b'',
+                    body=ClosingIterator(response.iter_encoded(), callbacks)
                 )
                 
                 return app_response
                 
         except Exception as e:
             logger.error(f"处理请求时出错: {e}")
+            return self.error_response(app_request, e)
+        finally:
+            if close_body and hasattr(app_request.data, 'close'):
+                app_request.data.close()
+    
+    def process_wsgi_request(self, app_request: AppRequest) -> AppResponse:
+        """直通模式 - 用主控服务器的environ直接调用应用的wsgi_app"""
+        environ = app_request.environ
+        
+        # 把前缀从PATH_INFO移到SCRIPT_NAME，应用内的url_for会自动带上前缀
+        # environ中的路径是WSGI字符串（原始字节按latin-1解码），前缀也要按同样的方式编码后比较
+        path_info = environ.get('PATH_INFO', '')
+        wsgi_prefix = self.prefix.encode('utf-8').decode('latin-1')
+        if wsgi_prefix and path_info.startswith(wsgi_prefix):
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + wsgi_prefix
+            environ['PATH_INFO'] = path_info[len(wsgi_prefix):]
+        
+        status_line = []
+        written = []  # 通过旧式write()回调写出的数据
+        
+        def start_response(status, headers, exc_info=None):
+            if exc_info and status_line:
+                raise exc_info[1].with_traceback(exc_info[2])
+            status_line[:] = [status, headers]
+            return written.append
+        
+        try:
+            app_iter = self.app.wsgi_app(environ, start_response)
+            close = getattr(app_iter, 'close', None)
+            chunks = iter(app_iter)
+            
+            # WSGI允许应用在第一次迭代时才调用start_response
+            if not status_line:
+                try:
+                    written.append(next(chunks))
+                except StopIteration:
+                    pass
+                except Exception:
+                    if close is not None:
+                        close()
+                    raise
+            
+            status, headers = status_line
             return AppResponse(
                 request_id=app_request.request_id,
-                status_code=500,
-                headers={'Content-Type': 'text/plain'},
-                data=f"内部错误: {str(e)}".encode('utf-8')
+                status_code=int(status.split(' ', 1)[0]),
+                headers=headers,
+                data=b'',
+                body=ClosingIterator(itertools.chain(written, chunks), close)
             )
+        except Exception as e:
+            logger.error(f"处理请求时出错: {e}")
+            return self.error_response(app_request, e)
+    
+    def error_response(self, app_request: AppRequest, error: Exception) -> AppResponse:
+        """构建处理失败时的500响应"""
+        return AppResponse(
+            request_id=app_request.request_id,
+            status_code=500,
+            headers=[('Content-Type', 'text/plain; charset=utf-8')],
+            data=f"内部错误: {str(error)}".encode('utf-8')
+        )
     
     def stop(self):
-        """停止应用轮询"""
+        """停止应用轮询；已被热替换的实例只释放自己，不影响接替它的实例"""
         self.running = False
-        self.master_server.registry.set_app_active(self.app_id, False)
+        replaced = self.successor is not None
+        if not replaced:
+            self.master_server.registry.set_app_active(self.app_id, False)
+            if self.master_server.dispatcher.scheduler is not None:
+                self.master_server.dispatcher.scheduler.remove_app(self.app_id)
         
-        if self.polling_thread and self.polling_thread.is_alive():
-            self.polling_thread.join(timeout=5)
+        self.release()
         
-        # 注销应用
-        self.master_server.registry.unregister_app(self.app_id)
+        if not replaced:
+            # 注销应用
+            self.master_server.registry.unregister_app(self.app_id)
+            if self.master_server.wrappers.get(self.app_id) is self:
+                del self.master_server.wrappers[self.app_id]
         logger.info(f"应用 {self.app_id} 已停止")
+    
+    def release(self):
+        """等待工作线程退出，子类在这里释放应用自己的资源"""
+        for thread in self.polling_threads:
+            if thread.is_alive() and thread is not threading.current_thread():
+                thread.join(timeout=5)
 
 # 全局主控服务器实例
 _master_server: Optional[MasterServer] = None
 _master_server_lock = threading.Lock()
 
-def get_or_create_master_server(host: str = '127.0.0.1', port: int = 5000) -> MasterServer:
-    """获取或创建主控服务器实例"""
+def get_or_create_master_server(host: str = '127.0.0.1', port: int = 5000,
+                                **options) -> MasterServer:
+    """获取或创建主控服务器实例，options 在首次创建时传给 MasterServer"""
     global _master_server
     
     with _master_server_lock:
         if _master_server is None:
-            _master_server = MasterServer(host, port)
+            _master_server = MasterServer(host, port, **options)
             _master_server.start()
         return _master_server
 
 def enable_port_sharing(app: Flask, prefix: str = "", 
                        master_host: str = '127.0.0.1', 
-                       master_port: int = 5000) -> str:
+                       master_port: int = 5000,
+                       workers: int = Config.APP_WORKERS,
+                       dispatch_mode: str = DISPATCH_MODE_TEST_CLIENT,
+                       priority_rules: Optional[Dict[str, str]] = None,
+                       priority_weights: Optional[Dict[str, int]] = None,
+                       weight: float = 1.0,
+                       master_socket: Optional[str] = None,
+                       master_transport: str = 'socket',
+                       max_connections: Optional[int] = None,
+                       health_check_path: Optional[str] = None) -> str:
     """
     为Flask应用启用端口复用功能
     
@@ -436,10 +1456,37 @@ def enable_port_sharing(app: Flask, prefix: str = "",
         prefix: 应用的路径前缀，例如 "/api/v1"
         master_host: 主控服务器主机地址
         master_port: 主控服务器端口
+        workers: 处理该应用请求的工作线程数
+        dispatch_mode: 请求分发模式，'test_client'（默认）通过测试客户端重新构造请求，
+            'wsgi' 直接调用应用的wsgi_app，
+            'proxy' 在本机临时端口上启动应用自己的服务器，经持久连接池转发
+        priority_rules: 路由模式到优先级通道的映射，例如 {'/health': 'high', '/batch/*': 'low'}，
+            模式匹配去掉前缀后的路径
+        priority_weights: 各优先级通道的出队权重，例如 {'high': 6, 'normal': 3, 'low': 1}；
+            不指定时严格按优先级出队
+        weight: 主控服务器使用共享线程池（shared_workers）时该应用的调度权重，进程外应用不支持
+        master_socket: 已运行的主控进程的Unix域套接字路径；指定后应用在自己的进程中运行，
+            run() 时连接该主控进程，不再在本进程中创建主控服务器
+        master_transport: 进程外应用传输请求的通道，'socket' 直接走Unix域套接字，
+            'shm' 走共享内存环形缓冲区（需要Linux和Python 3.10+），
+            'proxy' 应用在自己进程的临时端口上运行服务器，主控经持久连接池转发
+        max_connections: 反向代理模式下到该应用的上游连接数上限，默认等于 workers
+        health_check_path: 反向代理模式下健康检查请求的路径（不含前缀），默认只检查TCP连接
     
     Returns:
         应用ID
     """
+    if dispatch_mode not in DISPATCH_MODES:
+        raise ValueError(f"不支持的分发模式: {dispatch_mode}")
+    if weight <= 0:
+        raise ValueError(f"应用权重必须大于0: {weight}")
+    for pattern, priority in (priority_rules or {}).items():
+        if priority not in PRIORITY_LEVELS:
+            raise ValueError(f"路由 {pattern} 的优先级无效: {priority}")
+    for priority, lane_weight in (priority_weights or {}).items():
+        if priority not in PRIORITY_LEVELS or lane_weight <= 0:
+            raise ValueError(f"无效的优先级权重: {priority}={lane_weight}")
+    
     # 生成唯一的应用ID
     app_id = str(uuid.uuid4())
     
@@ -449,18 +1496,69 @@ def enable_port_sharing(app: Flask, prefix: str = "",
     if prefix == '/':
         prefix = ''
     
+    if master_socket:
+        from .transport import RemoteAppWrapper, TRANSPORTS
+        if master_transport not in TRANSPORTS:
+            raise ValueError(f"不支持的传输方式: {master_transport}")
+        if weight != 1.0:
+            # 进程外应用的请求由连接上的发送线程转发，不经过共享线程池调度
+            raise ValueError("进程外应用（master_socket）不支持设置调度权重 weight")
+        RemoteAppWrapper(app, app_id, prefix, master_socket, workers=workers,
+                         priority_rules=priority_rules, priority_weights=priority_weights,
+                         transport=master_transport, health_check_path=health_check_path)
+        logger.info(f"为进程外应用启用端口复用: {app_id} -> {prefix} (经由 {master_socket})")
+        return app_id
+    
     # 获取或创建主控服务器
     master_server = get_or_create_master_server(master_host, master_port)
     
     # 创建应用包装器
-    wrapper = AppWrapper(app, app_id, prefix, master_server)
+    if dispatch_mode == DISPATCH_MODE_PROXY:
+        from .proxy import ProxyAppWrapper
+        wrapper = ProxyAppWrapper(app, app_id, prefix, master_server, workers=workers,
+                                  max_connections=max_connections, health_check_path=health_check_path,
+                                  priority_rules=priority_rules, priority_weights=priority_weights,
+                                  weight=weight)
+    else:
+        wrapper = AppWrapper(app, app_id, prefix, master_server, workers=workers,
+                             dispatch_mode=dispatch_mode, priority_rules=priority_rules,
+                             priority_weights=priority_weights, weight=weight)
     
     logger.info(f"为应用启用端口复用: {app_id} -> {prefix}")
     return app_id
 
-def start_master_server(host: str = '127.0.0.1', port: int = 5000):
-    """手动启动主控服务器"""
-    master_server = get_or_create_master_server(host, port)
+def reload_app(app_id: str, app: Flask, warmup_paths: Optional[Iterable[str]] = None,
+               drain_timeout: float = DEFAULT_DRAIN_TIMEOUT) -> str:
+    """
+    用新的Flask应用实例热替换已注册的应用，前缀在替换过程中始终可用
+    
+    Args:
+        app_id: enable_port_sharing 返回的应用ID
+        app: 新的Flask应用实例，不需要再调用它的 run()
+        warmup_paths: 切换前在新实例上请求的路径（不含前缀），返回5xx时放弃替换
+        drain_timeout: 等待旧实例处理完在途请求的最长时间（秒）
+    
+    Returns:
+        应用ID
+    """
+    wrapper = _master_server.wrappers.get(app_id) if _master_server is not None else None
+    if wrapper is None:
+        raise ValueError(f"应用未在主控服务器中运行: {app_id}")
+    wrapper.hot_swap(app, warmup_paths, drain_timeout)
+    return app_id
+
+def start_master_server(host: str = '127.0.0.1', port: int = 5000, **options):
+    """手动启动主控服务器
+    
+    Args:
+        host: 监听地址
+        port: 监听端口
+        **options: 传给 MasterServer 的其他参数，例如 body_spool_threshold、
+            enable_tracing、request_timeout、disconnect_check_interval、disconnect_on_eof、shared_workers、
+            unix_socket、unix_socket_mode、reuse_port、engine、engine_options、cluster_peers、
+            cluster_address、cluster_options
+    """
+    master_server = get_or_create_master_server(host, port, **options)
     logger.info(f"主控服务器已在 {host}:{port} 上运行")
 
 def get_master_server_status() -> Dict[str, Any]:
@@ -470,19 +1568,19 @@ def get_master_server_status() -> Dict[str, Any]:
     if _master_server is None:
         return {'status': 'not_running'}
     
-    with _master_server.registry.lock:
-        return {
-            'status': 'running' if _master_server.running else 'stopped',
-            'host': _master_server.host,
-            'port': _master_server.port,
-            'registered_apps': len(_master_server.registry.apps),
-            'active_apps': sum(1 for app in _master_server.registry.apps.values() if app['active']),
-            'apps': [
-                {
-                    'app_id': app_info['app_id'],
-                    'prefix': prefix,
-                    'active': app_info['active']
-                }
-                for prefix, app_info in _master_server.registry.apps.items()
-            ]
-        }
\ No newline at end of file
+    entries = _master_server.registry.snapshot.entries
+    return {
+        'status': 'running' if _master_server.running else 'stopped',
+        'host': _master_server.host,
+        'port': _master_server.port,
+        'registered_apps': len(entries),
+        'active_apps': sum(1 for entry in entries.values() if entry.active),
+        'apps': [
+            {
+                'app_id': entry.app_id,
+                'prefix': entry.prefix,
+                'active': entry.active
+            }
+            for entry in entries.values()
+        ]
+    }
\ No newline at end of file
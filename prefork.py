@@ -0,0 +1,199 @@
+"""
+预派生多进程模块
+启动多个主控服务器进程，用SO_REUSEPORT绑定同一端口，由内核在进程之间分配连接
+
+每个子进程有自己的注册器副本和应用工作线程，应用由 app_factory 在子进程中创建，
+CPU密集型应用的吞吐量随进程数增长，不再受单个解释器的GIL限制。
+
+子进程用 multiprocessing 的 spawn 方式启动：监督者本身运行在线程中，在多线程的父进程里
+fork 会把其他线程持有的锁（日志、导入锁等）原样复制到子进程中造成死锁。因此 app_factory
+必须是可以被pickle的模块级函数，主程序需要放在 if __name__ == '__main__' 之下。
+"""
+
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import logging
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from flask import Flask
+
+from . import port_sharing
+from .port_sharing import MasterServer
+
+logger = logging.getLogger(__name__)
+
+# 子进程存活不到这么久就退出时按崩溃处理，重启间隔逐次加倍
+MIN_HEALTHY_UPTIME = 5.0
+MAX_RESTART_DELAY = 30.0
+
+AppFactory = Callable[[], Iterable[Flask]]
+
+def default_process_count() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def run_child(app_factory: AppFactory, host: str, port: int, options: Dict[str, Any], index: int):
+    """子进程入口：启动本进程的主控服务器和应用，直到收到SIGTERM"""
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+
+    master = MasterServer(host, port, reuse_port=True, **options)
+    master.start()
+    # app_factory 中的 enable_port_sharing 使用本进程的主控服务器
+    with port_sharing._master_server_lock:
+        port_sharing._master_server = master
+
+    for app in app_factory() or []:
+        threading.Thread(target=app.run, daemon=True,
+                         name=f"port-sharing-app-{app.name}").start()
+
+    stop_event.wait()
+    master.stop()
+
+class ChildProcess:
+    """一个主控子进程的记录"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[multiprocessing.Process] = None
+        self.pid: Optional[int] = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.restart_delay = 0.0
+        self.restart_at: Optional[float] = None
+
+class PreforkMaster:
+    """预派生多进程主控服务器及其监督者
+
+    app_factory 在每个子进程中调用一次，负责创建应用并对它们调用 enable_port_sharing，
+    返回需要运行的应用；子进程在各自的线程中调用这些应用的 run()。
+    """
+
+    def __init__(self, app_factory: AppFactory, host: str = '127.0.0.1', port: int = 5000,
+                 processes: Optional[int] = None, restart_delay: float = 1.0, **options):
+        if options.get('unix_socket'):
+            raise ValueError("预派生模式下每个进程有自己的注册器，不支持进程外应用的unix_socket")
+        self.app_factory = app_factory
+        self.host = host
+        self.port = port
+        self.processes = processes or default_process_count()
+        self.restart_delay = restart_delay
+        self.options: Dict[str, Any] = options
+        self.children = [ChildProcess(index) for index in range(self.processes)]
+        self.context = multiprocessing.get_context('spawn')
+        self.running = False
+        self.supervisor_thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """派生所有子进程并启动监督线程"""
+        self.running = True
+        for child in self.children:
+            self.spawn(child)
+        self.supervisor_thread = threading.Thread(target=self.supervise, daemon=True,
+                                                  name="port-sharing-supervisor")
+        self.supervisor_thread.start()
+        logger.info(f"预派生主控服务器已在 {self.host}:{self.port} 上启动 {self.processes} 个进程")
+
+    def spawn(self, child: ChildProcess):
+        process = self.context.Process(
+            target=run_child, args=(self.app_factory, self.host, self.port, self.options, child.index),
+            name=f"port-sharing-master-{child.index}", daemon=True)
+        process.start()
+
+        child.process = process
+        child.pid = process.pid
+        child.started_at = time.monotonic()
+        child.restart_at = None
+        logger.info(f"主控子进程 {child.index} 已启动 (pid {process.pid})")
+
+    def supervise(self):
+        """回收退出的子进程并按退避间隔重启"""
+        while self.running:
+            now = time.monotonic()
+            for child in self.children:
+                if child.process is None:
+                    if child.restart_at is not None and now >= child.restart_at and self.running:
+                        self.spawn(child)
+                    continue
+
+                status = child.process.exitcode
+                if status is None:
+                    continue
+
+                uptime = now - child.started_at
+                logger.warning(f"主控子进程 {child.index} (pid {child.pid}) 已退出，状态 {status}，"
+                               f"运行了 {uptime:.1f}秒")
+                child.process.close()
+                child.process = None
+                child.pid = None
+                child.restarts += 1
+                # 反复启动失败时逐次加倍重启间隔，避免疯狂派生
+                if uptime < MIN_HEALTHY_UPTIME:
+                    child.restart_delay = min(MAX_RESTART_DELAY, max(self.restart_delay, child.restart_delay * 2))
+                else:
+                    child.restart_delay = self.restart_delay
+                child.restart_at = now + child.restart_delay
+
+            time.sleep(0.1)
+
+    def stop(self, timeout: float = 5.0):
+        """向所有子进程发送SIGTERM并等待退出"""
+        self.running = False
+        if self.supervisor_thread:
+            self.supervisor_thread.join(timeout=1)
+
+        for child in self.children:
+            if child.process is not None:
+                child.process.terminate()
+
+        deadline = time.monotonic() + timeout
+        for child in self.children:
+            if child.process is None:
+                continue
+            child.process.join(max(0.0, deadline - time.monotonic()))
+            if child.process.exitcode is None:
+                child.process.kill()
+                child.process.join()
+            child.process.close()
+            child.process = None
+            child.pid = None
+        logger.info("预派生主控服务器已停止")
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            'host': self.host,
+            'port': self.port,
+            'processes': [
+                {'index': child.index, 'pid': child.pid, 'restarts': child.restarts}
+                for child in self.children
+            ]
+        }
+
+def run_prefork_master(app_factory: AppFactory, host: str = '127.0.0.1', port: int = 5000,
+                       processes: Optional[int] = None, **options):
+    """以预派生多进程模式运行主控服务器，阻塞直到收到SIGINT/SIGTERM
+
+    Args:
+        app_factory: 在每个子进程中调用，创建应用并调用 enable_port_sharing，返回要运行的应用；
+            必须是模块级函数，子进程以spawn方式启动并重新导入它
+        host: 监听地址
+        port: 监听端口
+        processes: 子进程数，默认等于可用的CPU核数
+        **options: 传给每个子进程的 MasterServer 的其他参数
+    """
+    master = PreforkMaster(app_factory, host, port, processes, **options)
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+
+    master.start()
+    try:
+        stop_event.wait()
+    finally:
+        master.stop()
@@ -0,0 +1,640 @@
+"""
+反向代理模块
+应用在本机的临时端口上运行自己的HTTP服务器，主控服务器通过持久的HTTP/1.1长连接池转发请求
+
+连接池按应用限制连接数，空闲超过 idle_timeout 的连接由健康检查线程回收；健康检查失败时
+转发直接返回502，不再等待连接超时。应用可以和主控在同一进程中（dispatch_mode='proxy'），
+也可以在自己的进程中（master_transport='proxy'），后者只通过Unix域套接字注册端口。
+"""
+
+import http.client
+import queue
+import socket
+import threading
+import time
+import logging
+from urllib.parse import quote
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from flask import Flask
+from werkzeug.serving import WSGIRequestHandler, make_server
+from werkzeug.wsgi import LimitedStream
+
+from .performance import get_performance_optimizer
+from .port_sharing import (
+    AppRequest, AppResponse, AppWrapper, MasterServer, DISPATCH_MODE_TEST_CLIENT
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IDLE_TIMEOUT = 30.0
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_HEALTH_CHECK_INTERVAL = 5.0
+# 连续失败这么多次健康检查后认为上游不可用
+UNHEALTHY_THRESHOLD = 2
+RESPONSE_CHUNK_SIZE = 64 * 1024
+UPSTREAM_UNAVAILABLE_STATUS = 502
+
+# 逐跳头部只对一个连接有效，不能转发（RFC 9110 7.6.1）
+HOP_BY_HOP_HEADERS = frozenset((
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailer', 'transfer-encoding', 'upgrade'
+))
+
+# 复用的空闲连接可能已被上游关闭，这些错误出现在复用连接上时换一条新连接重试一次
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+# 只有幂等方法可以重试：上游可能已经处理了请求才关闭连接，重发POST等请求会重复执行
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+
+class PoolTimeout(Exception):
+    """在截止时间前没有可用的上游连接"""
+
+class PooledConnection:
+    """连接池中的一条上游连接"""
+
+    def __init__(self, connection: http.client.HTTPConnection):
+        self.connection = connection
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.requests = 0  # 已经在这条连接上完成的请求数，大于0说明是复用的连接
+
+    def close(self):
+        try:
+            self.connection.close()
+        except OSError:
+            pass
+
+class UpstreamConnectionPool:
+    """到一个上游HTTP服务器的持久连接池
+
+    空闲连接后进先出，最近用过的连接最可能仍然有效；连接数达到上限时等待其他请求归还。
+    """
+
+    def __init__(self, host: str, port: int, max_connections: int = 10,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT):
+        if max_connections < 1:
+            raise ValueError(f"连接数上限必须大于0: {max_connections}")
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.idle: List[PooledConnection] = []
+        self.open_connections = 0
+        self.closed = False
+        self.lock = threading.Lock()
+        self.available = threading.Condition(self.lock)
+
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+        self.connect_failures = 0
+
+    def acquire(self, timeout: Optional[float] = None, fresh: bool = False) -> PooledConnection:
+        """取出一条连接，没有空闲连接且未达上限时新建；超时抛出 PoolTimeout"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.available:
+            while True:
+                if self.closed:
+                    raise ConnectionError("上游连接池已关闭")
+                self._evict_expired()
+                if self.idle and not fresh:
+                    pooled = self.idle.pop()
+                    self.reused += 1
+                    return pooled
+                if self.idle and fresh:
+                    # 调用方要求新连接时腾出一个空闲名额
+                    self.idle.pop(0).close()
+                    self.open_connections -= 1
+                if self.open_connections < self.max_connections:
+                    self.open_connections += 1
+                    break
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise PoolTimeout(f"等待上游 {self.host}:{self.port} 的连接超时")
+                self.available.wait(remaining)
+
+        # 建立连接时不持有锁，其他线程可以继续归还和取用连接
+        try:
+            pooled = PooledConnection(self.connect())
+        except OSError:
+            with self.available:
+                self.open_connections -= 1
+                self.connect_failures += 1
+                self.available.notify()
+            raise
+        with self.lock:
+            self.created += 1
+        return pooled
+
+    def connect(self) -> http.client.HTTPConnection:
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.connect_timeout)
+        connection.connect()
+        # 请求头和小请求体分开写出时避免Nagle算法带来的延迟
+        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return connection
+
+    def release(self, pooled: PooledConnection, reusable: bool = True):
+        """归还连接；不可复用的连接（响应未读完、上游要求关闭、出错）直接关闭"""
+        with self.available:
+            if reusable and not self.closed:
+                pooled.last_used = time.monotonic()
+                self.idle.append(pooled)
+            else:
+                pooled.close()
+                self.open_connections -= 1
+            self.available.notify()
+
+    def _evict_expired(self) -> int:
+        """关闭空闲过久的连接（调用方需持有锁）"""
+        if not self.idle:
+            return 0
+        cutoff = time.monotonic() - self.idle_timeout
+        expired = [pooled for pooled in self.idle if pooled.last_used < cutoff]
+        if expired:
+            self.idle = [pooled for pooled in self.idle if pooled.last_used >= cutoff]
+            for pooled in expired:
+                pooled.close()
+            self.open_connections -= len(expired)
+            self.evicted += len(expired)
+            self.available.notify(len(expired))
+        return len(expired)
+
+    def evict_idle(self) -> int:
+        """回收空闲过久的连接，返回关闭的连接数"""
+        with self.lock:
+            return self._evict_expired()
+
+    def close(self):
+        """关闭所有空闲连接，借出的连接归还时关闭"""
+        with self.available:
+            self.closed = True
+            for pooled in self.idle:
+                pooled.close()
+            self.open_connections -= len(self.idle)
+            self.idle = []
+            self.available.notify_all()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "max_connections": self.max_connections,
+                "open": self.open_connections,
+                "idle": len(self.idle),
+                "in_use": self.open_connections - len(self.idle),
+                "created": self.created,
+                "reused": self.reused,
+                "evicted": self.evicted,
+                "connect_failures": self.connect_failures
+            }
+
+def _replayable(data: Any) -> bool:
+    """请求体能否在重试时重新发送"""
+    return not hasattr(data, 'read') or hasattr(data, 'seek')
+
+def _body_length(data: Any) -> int:
+    if hasattr(data, 'read'):
+        data.seek(0, 2)
+        length = data.tell()
+        data.seek(0)
+        return length
+    return len(data)
+
+class UpstreamResponseBody:
+    """上游响应体：按块流式读取，读完时立即把连接还回池中；客户端中途断开时在关闭时归还"""
+
+    def __init__(self, response: http.client.HTTPResponse, pooled: PooledConnection,
+                 pool: UpstreamConnectionPool):
+        self.response = response
+        self.pooled: Optional[PooledConnection] = pooled
+        self.pool = pool
+
+    def __iter__(self):
+        return self.chunks()
+
+    def chunks(self):
+        while True:
+            chunk = self.response.read1(RESPONSE_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+        # HEAD和无响应体的状态码要再读一次才会把响应标记为结束
+        self.response.read()
+        self.release()
+
+    def release(self):
+        pooled, self.pooled = self.pooled, None
+        if pooled is None:
+            return
+        # 响应读完且上游没有要求关闭时连接才能复用，否则连接上还留有未读的数据
+        reusable = self.response.isclosed() and not self.response.will_close
+        if reusable:
+            pooled.requests += 1
+        else:
+            self.response.close()
+        self.pool.release(pooled, reusable)
+
+    def close(self):
+        self.release()
+
+class UpstreamProxy:
+    """主控一侧：把一个前缀的请求经连接池转发给上游HTTP服务器"""
+
+    def __init__(self, app_id: str, prefix: str, host: str, port: int,
+                 max_connections: int = 10,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 health_check_path: Optional[str] = None,
+                 health_check_interval: float = DEFAULT_HEALTH_CHECK_INTERVAL,
+                 on_health_change: Optional[Callable[[bool], None]] = None,
+                 extra_headers: Optional[Dict[str, str]] = None):
+        self.app_id = app_id
+        self.prefix = prefix
+        self.pool = UpstreamConnectionPool(host, port, max_connections, idle_timeout, connect_timeout)
+        self.health_check_path = health_check_path  # 为空时只检查能否建立TCP连接
+        self.health_check_interval = health_check_interval
+        self.on_health_change = on_health_change
+        self.extra_headers = extra_headers or {}  # 转发时附加的请求头
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.retries = 0
+        self.running = False
+        self.stop_event = threading.Event()
+        self.health_thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """启动健康检查线程"""
+        self.running = True
+        self.health_thread = threading.Thread(target=self.health_loop, daemon=True,
+                                              name=f"port-sharing-health-{self.app_id[:8]}")
+        self.health_thread.start()
+
+    def stop(self):
+        self.running = False
+        self.stop_event.set()
+        if self.health_thread and self.health_thread is not threading.current_thread():
+            self.health_thread.join(timeout=5)
+        self.pool.close()
+
+    def forward(self, app_request: AppRequest) -> AppResponse:
+        """把请求转发给上游，响应体按块流式读取，读完后连接回到池中"""
+        if not self.healthy:
+            return self.unavailable_response(app_request, "上游应用未通过健康检查")
+
+        url = self.request_target(app_request)
+        headers = {key: value for key, value in app_request.headers.items()
+                   if key.lower() not in HOP_BY_HOP_HEADERS and key.lower() != 'content-length'}
+        body = app_request.data
+        if body or hasattr(body, 'read') or app_request.method in ('POST', 'PUT', 'PATCH'):
+            headers['Content-Length'] = str(_body_length(body))
+        headers.update(self.extra_headers)
+
+        timeout = None
+        if app_request.deadline is not None:
+            timeout = max(app_request.deadline - time.monotonic(), 0.001)
+
+        pooled: Optional[PooledConnection] = None
+        try:
+            pooled = self.pool.acquire(timeout)
+            try:
+                response = self.send(pooled, app_request.method, url, body, headers, timeout)
+            except STALE_CONNECTION_ERRORS:
+                if not pooled.requests or app_request.method not in IDEMPOTENT_METHODS \
+                        or not _replayable(body):
+                    raise
+                # 空闲期间被上游关闭的连接，换一条新连接重试
+                self.pool.release(pooled, reusable=False)
+                pooled = None
+                self.retries += 1
+                if hasattr(body, 'seek'):
+                    body.seek(0)
+                pooled = self.pool.acquire(timeout, fresh=True)
+                response = self.send(pooled, app_request.method, url, body, headers, timeout)
+        except (PoolTimeout, OSError, http.client.HTTPException) as e:
+            if pooled is not None:
+                self.pool.release(pooled, reusable=False)
+            logger.warning(f"转发应用 {self.app_id} 的请求 {app_request.request_id} 失败: {e}")
+            return self.unavailable_response(app_request, f"上游应用不可用: {e}")
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+        return AppResponse(
+            request_id=app_request.request_id,
+            status_code=response.status,
+            headers=[(key, value) for key, value in response.getheaders()
+                     if key.lower() not in HOP_BY_HOP_HEADERS],
+            data=b'',
+            body=UpstreamResponseBody(response, pooled, self.pool)
+        )
+
+    def request_target(self, app_request: AppRequest) -> str:
+        """去掉前缀后的请求目标；路径已按UTF-8解码，重新编码并转义为ASCII"""
+        path = app_request.path
+        if self.prefix and path.startswith(self.prefix):
+            path = path[len(self.prefix):] or '/'
+        target = quote(path.encode('utf-8'), safe="/:@!$&'()*+,;=~")
+        if app_request.query_string:
+            target += '?' + quote(app_request.query_string.encode('utf-8'), safe="/?:@!$&'()*+,;=~%")
+        return target
+
+    @staticmethod
+    def send(pooled: PooledConnection, method: str, url: str, body: Any,
+             headers: Dict[str, str], timeout: Optional[float]) -> http.client.HTTPResponse:
+        connection = pooled.connection
+        connection.sock.settimeout(timeout)
+        connection.request(method, url, body=body if body else None, headers=headers)
+        return connection.getresponse()
+
+    def unavailable_response(self, app_request: AppRequest, message: str) -> AppResponse:
+        return AppResponse(
+            request_id=app_request.request_id,
+            status_code=UPSTREAM_UNAVAILABLE_STATUS,
+            headers=[('Content-Type', 'text/plain; charset=utf-8')],
+            data=message.encode('utf-8')
+        )
+
+    def check_health(self) -> bool:
+        """探测上游：指定了 health_check_path 时发送GET请求，否则只建立TCP连接"""
+        pool = self.pool
+        if self.health_check_path is None:
+            try:
+                socket.create_connection((pool.host, pool.port), timeout=pool.connect_timeout).close()
+                return True
+            except OSError:
+                return False
+
+        try:
+            pooled = pool.acquire(timeout=pool.connect_timeout)
+        except PoolTimeout:
+            # 所有连接都在处理请求，说明上游仍在响应
+            return True
+        except OSError:
+            return False
+        try:
+            response = self.send(pooled, 'GET', self.health_check_path, None, {}, pool.connect_timeout)
+            response.read()
+            pooled.requests += 1
+            pool.release(pooled, not response.will_close)
+            return response.status < 500
+        except (OSError, http.client.HTTPException):
+            pool.release(pooled, reusable=False)
+            return False
+
+    def health_loop(self):
+        while not self.stop_event.wait(self.health_check_interval):
+            evicted = self.pool.evict_idle()
+            if evicted:
+                logger.debug(f"回收了应用 {self.app_id} 的 {evicted} 条空闲上游连接")
+
+            if self.check_health():
+                self.consecutive_failures = 0
+                if not self.healthy:
+                    logger.info(f"应用 {self.app_id} 的上游已恢复")
+                    self.set_healthy(True)
+            else:
+                self.consecutive_failures += 1
+                if self.healthy and self.consecutive_failures >= UNHEALTHY_THRESHOLD:
+                    logger.warning(f"应用 {self.app_id} 的上游连续 {self.consecutive_failures} 次健康检查失败")
+                    self.set_healthy(False)
+
+    def set_healthy(self, healthy: bool):
+        self.healthy = healthy
+        if self.on_health_change is not None:
+            self.on_health_change(healthy)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = self.pool.get_stats()
+        stats.update({
+            "upstream": f"{self.pool.host}:{self.pool.port}",
+            "healthy": self.healthy,
+            "retries": self.retries
+        })
+        return stats
+
+class PrefixMiddleware:
+    """上游服务器一侧：主控转发前去掉了前缀，这里把它放回SCRIPT_NAME，url_for 生成的链接带上前缀"""
+
+    def __init__(self, wsgi_app: Callable, prefix: str):
+        self.wsgi_app = wsgi_app
+        self.prefix = prefix
+
+    def __call__(self, environ: Dict[str, Any], start_response):
+        if self.prefix:
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + self.prefix
+        return self.wsgi_app(environ, start_response)
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """支持HTTP/1.1长连接的请求处理器
+
+    werkzeug的开发服务器在每个响应后关闭连接，并在关闭前读走套接字上剩余的数据，
+    长连接上的下一个请求会被它吞掉。这里用 LimitedStream 限定请求体的边界，响应结束后
+    只丢弃本请求未读完的请求体，连接保持打开，同一连接上的请求依次处理。
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def run_wsgi(self):
+        environ = self.make_environ()
+        if environ.get('wsgi.input_terminated'):
+            # 分块编码的请求体无法可靠地确定读到了哪里，处理完后关闭连接
+            self.close_connection = True
+        else:
+            environ['wsgi.input'] = LimitedStream(self.rfile, int(environ.get('CONTENT_LENGTH') or 0))
+            environ['wsgi.input_terminated'] = True
+
+        response_start: List[Any] = []
+        headers_sent = False
+        chunked = False
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and headers_sent:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response_start[:] = [status, headers]
+            return write
+
+        def write(data: bytes):
+            nonlocal headers_sent, chunked
+            if not headers_sent:
+                status, headers = response_start
+                code, _, message = status.partition(' ')
+                self.send_response(int(code), message)
+                header_keys = set()
+                for key, value in headers:
+                    self.send_header(key, value)
+                    header_keys.add(key.lower())
+                if not ('content-length' in header_keys or environ['REQUEST_METHOD'] == 'HEAD'
+                        or int(code) < 200 or int(code) in (204, 304)):
+                    chunked = True
+                    self.send_header('Transfer-Encoding', 'chunked')
+                if self.close_connection:
+                    self.send_header('Connection', 'close')
+                self.end_headers()
+                headers_sent = True
+            if data:
+                if chunked:
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+                else:
+                    self.wfile.write(data)
+
+        try:
+            app_iter = self.server.app(environ, start_response)
+            try:
+                for data in app_iter:
+                    write(data)
+                if not headers_sent:
+                    write(b'')
+                if chunked:
+                    self.wfile.write(b'0\r\n\r\n')
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+        except (ConnectionError, TimeoutError):
+            self.close_connection = True
+            return
+        except Exception as e:
+            logger.error(f"上游服务器处理请求出错: {e}")
+            # 响应已经开始时无法再改成500，只能关闭连接让客户端发现响应不完整
+            self.close_connection = True
+            if not headers_sent:
+                response_start[:] = ['500 INTERNAL SERVER ERROR', [('Content-Length', '0')]]
+                write(b'')
+            return
+
+        if isinstance(environ['wsgi.input'], LimitedStream):
+            # 应用没有读完的请求体留在套接字上会被当作下一个请求，丢弃到本请求的边界
+            environ['wsgi.input'].exhaust()
+
+def start_upstream_server(app: Flask, prefix: str, host: str = '127.0.0.1') -> Tuple[Any, threading.Thread]:
+    """在本机的临时端口上启动应用自己的多线程HTTP/1.1长连接服务器，返回 (服务器, 线程)"""
+    server = make_server(host, 0, PrefixMiddleware(app.wsgi_app, prefix), threaded=True,
+                         request_handler=KeepAliveRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True,
+                              name=f"port-sharing-upstream-{app.name}")
+    thread.start()
+    return server, thread
+
+class ProxyAppWrapper(AppWrapper):
+    """反向代理模式的包装器 - run() 启动应用自己的服务器，主控的工作线程经连接池转发请求
+
+    每个工作线程同时最多占用一条上游连接，连接数上限默认等于工作线程数。
+    """
+
+    def __init__(self, app: Flask, app_id: str, prefix: str, master_server: MasterServer,
+                 workers: int = 1, max_connections: Optional[int] = None,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 health_check_path: Optional[str] = None,
+                 health_check_interval: float = DEFAULT_HEALTH_CHECK_INTERVAL, **options):
+        # 主控读取请求头和请求体后交给工作线程，与 test_client 模式相同
+        super().__init__(app, app_id, prefix, master_server, workers=workers,
+                         dispatch_mode=DISPATCH_MODE_TEST_CLIENT, **options)
+        self.max_connections = max_connections or self.workers
+        self.idle_timeout = idle_timeout
+        self.health_check_path = health_check_path
+        self.health_check_interval = health_check_interval
+        self.server = None
+        self.upstream: Optional[UpstreamProxy] = None
+
+    def prepare(self):
+        """在临时端口上启动应用的服务器，之后再注册到主控服务器"""
+        self.server, _ = start_upstream_server(self.app, self.prefix)
+        self.upstream = UpstreamProxy(
+            self.app_id, self.prefix, '127.0.0.1', self.server.server_port,
+            max_connections=self.max_connections, idle_timeout=self.idle_timeout,
+            health_check_path=self.health_check_path,
+            health_check_interval=self.health_check_interval,
+            on_health_change=lambda healthy: self.master_server.registry.set_app_active(self.app_id, healthy)
+        )
+        self.upstream.start()
+        logger.info(f"应用 {self.app_id} 的上游服务器运行在 127.0.0.1:{self.server.server_port}")
+
+    def start_workers(self):
+        super().start_workers()
+        self.master_server.upstreams[self.app_id] = self.upstream
+
+    def create_successor(self, app: Flask) -> 'ProxyAppWrapper':
+        return ProxyAppWrapper(app, self.app_id, self.prefix, self.master_server, workers=self.workers,
+                               max_connections=self.max_connections, idle_timeout=self.idle_timeout,
+                               health_check_path=self.health_check_path,
+                               health_check_interval=self.health_check_interval,
+                               priority_rules=self.priority_rules, priority_weights=self.priority_weights,
+                               weight=self.weight)
+
+    def process_request(self, app_request: AppRequest) -> AppResponse:
+        return self.upstream.forward(app_request)
+
+    def release(self):
+        super().release()
+        if self.master_server.upstreams.get(self.app_id) is self.upstream:
+            # 热替换后这里已经是新实例的上游
+            del self.master_server.upstreams[self.app_id]
+        if self.upstream is not None:
+            self.upstream.stop()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+class RemoteUpstream:
+    """主控一侧：在自己进程中运行服务器的应用，工作线程从请求队列取出请求经连接池转发
+
+    prefix 是转发前从路径中去掉的前缀；转发给集群中其他主控节点时为空，保留完整路径。
+    """
+
+    def __init__(self, master_server: MasterServer, app_id: str, prefix: str, port: int,
+                 workers: int = 1, host: str = '127.0.0.1', **options):
+        self.master_server = master_server
+        self.app_id = app_id
+        self.workers = workers
+        self.upstream = UpstreamProxy(
+            app_id, prefix, host, port, max_connections=workers,
+            on_health_change=lambda healthy: master_server.registry.set_app_active(app_id, healthy),
+            **options
+        )
+        self.running = False
+        self.threads: List[threading.Thread] = []
+
+    def start(self):
+        self.running = True
+        self.upstream.start()
+        self.master_server.upstreams[self.app_id] = self.upstream
+        self.threads = [
+            threading.Thread(target=self.worker_loop, daemon=True,
+                             name=f"port-sharing-proxy-{self.app_id[:8]}-{index}")
+            for index in range(self.workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def worker_loop(self):
+        registry = self.master_server.registry
+        request_queue = registry.request_queues[self.app_id]
+        optimizer = get_performance_optimizer()
+        while self.running:
+            try:
+                app_request = request_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            if app_request.cancelled or app_request.expired():
+                registry.responses.discard(app_request.request_id)
+                if hasattr(app_request.data, 'close'):
+                    app_request.data.close()
+                continue
+
+            started = time.time()
+            response = self.upstream.forward(app_request)
+            optimizer.record_app_completion(self.app_id, time.time() - started, self.workers)
+            if not registry.responses.complete(response):
+                logger.warning(f"应用 {self.app_id} 的请求 {response.request_id} 已无人等待，响应被丢弃")
+                if response.body is not None:
+                    response.body.close()
+
+    def stop(self):
+        self.running = False
+        self.master_server.upstreams.pop(self.app_id, None)
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=5)
+        self.upstream.stop()
@@ -0,0 +1,197 @@
+"""
+路由索引模块
+按路径段组织的基数树，用于前缀的最长匹配查找
+"""
+
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+def split_segments(path: str) -> List[str]:
+    """把路径拆分为路径段，忽略首尾的/"""
+    return [segment for segment in path.strip('/').split('/') if segment]
+
+def normalize_prefix(prefix: str) -> str:
+    """规范化应用前缀：以/开头、不以/结尾，根前缀为空字符串
+
+    "/api"、"/api/" 和 "api" 都对应同一个前缀 "/api"。
+    """
+    segments = split_segments(prefix)
+    return '/' + '/'.join(segments) if segments else ''
+
+class _TrieNode:
+    """基数树节点，边上保存一个或多个连续的路径段"""
+
+    __slots__ = ('label', 'children', 'prefix', 'value', 'has_value', 'owner')
+
+    def __init__(self, label: Tuple[str, ...] = (), owner: object = None):
+        self.label = label
+        self.children: Dict[str, '_TrieNode'] = {}
+        self.prefix: Optional[str] = None
+        self.value: Any = None
+        self.has_value = False
+        self.owner = owner
+
+class PrefixTrie:
+    """按路径段匹配的基数树
+
+    前缀只在路径段边界上匹配，例如 "/api" 匹配 "/api/users"，但不匹配 "/apis"。
+    查找的复杂度是 O(路径段数)，与注册的前缀数量无关。
+
+    copy() 是 O(1) 的写时复制：拷贝与原树共享所有节点，之后任何一方的修改
+    只复制从根到被修改节点的路径，另一方看到的内容保持不变。
+    """
+
+    def __init__(self):
+        self.owner = object()
+        self.root = _TrieNode(owner=self.owner)
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def copy(self) -> 'PrefixTrie':
+        """写时复制的拷贝"""
+        clone = PrefixTrie.__new__(PrefixTrie)
+        clone.owner = object()
+        clone.root = self.root
+        clone.size = self.size
+        # 原树也换一个所有者标记，之后双方都不会原地修改共享的节点
+        self.owner = object()
+        return clone
+
+    def _own(self, node: _TrieNode) -> _TrieNode:
+        """返回可以原地修改的节点，共享节点会先被复制"""
+        if node.owner is self.owner:
+            return node
+        clone = _TrieNode(node.label, self.owner)
+        clone.children = dict(node.children)
+        clone.prefix = node.prefix
+        clone.value = node.value
+        clone.has_value = node.has_value
+        return clone
+
+    def insert(self, prefix: str, value: Any):
+        """插入前缀，已存在时覆盖其值；记录的是规范化后的前缀"""
+        prefix = normalize_prefix(prefix)
+        segments = split_segments(prefix)
+        node = self.root = self._own(self.root)
+        index = 0
+
+        while index < len(segments):
+            child = node.children.get(segments[index])
+            if child is None:
+                # 剩余的路径段压缩到同一条边上
+                child = _TrieNode(tuple(segments[index:]), self.owner)
+                node.children[segments[index]] = child
+                node = child
+                index = len(segments)
+                break
+
+            # 计算与边标签的公共部分
+            common = 0
+            label = child.label
+            while (common < len(label) and index + common < len(segments)
+                   and label[common] == segments[index + common]):
+                common += 1
+
+            child = node.children[segments[index]] = self._own(child)
+            if common < len(label):
+                # 拆分边
+                middle = _TrieNode(label[:common], self.owner)
+                child.label = label[common:]
+                middle.children[child.label[0]] = child
+                node.children[segments[index]] = middle
+                child = middle
+
+            node = child
+            index += common
+
+        if not node.has_value:
+            self.size += 1
+        node.prefix = prefix
+        node.value = value
+        node.has_value = True
+
+    def remove(self, prefix: str) -> bool:
+        """删除前缀，不存在时返回False"""
+        segments = split_segments(prefix)
+        node = self.root
+        keys: List[str] = []
+        index = 0
+
+        while index < len(segments):
+            child = node.children.get(segments[index])
+            if child is None or tuple(segments[index:index + len(child.label)]) != child.label:
+                return False
+            keys.append(segments[index])
+            node = child
+            index += len(child.label)
+
+        if not node.has_value:
+            return False
+
+        # 确认存在后再复制路径上的节点
+        node = self.root = self._own(self.root)
+        path: List[Tuple[_TrieNode, str]] = []
+        for key in keys:
+            path.append((node, key))
+            child = self._own(node.children[key])
+            node.children[key] = child
+            node = child
+
+        node.prefix = None
+        node.value = None
+        node.has_value = False
+        self.size -= 1
+
+        # 回收空节点，并把只剩一个子节点的节点与子节点合并
+        while path:
+            parent, key = path.pop()
+            if not node.has_value and not node.children:
+                del parent.children[key]
+            elif not node.has_value and len(node.children) == 1:
+                (only_child,) = node.children.values()
+                only_child = self._own(only_child)
+                only_child.label = node.label + only_child.label
+                parent.children[key] = only_child
+                break
+            else:
+                break
+            node = parent
+
+        return True
+
+    def longest_match(self, path: str) -> Optional[Tuple[str, Any]]:
+        """返回与路径匹配的最长前缀及其值"""
+        node = self.root
+        best = (node.prefix, node.value) if node.has_value else None
+        segments = path.split('/')
+        index = 1 if segments and segments[0] == '' else 0
+        count = len(segments)
+
+        while index < count:
+            child = node.children.get(segments[index])
+            if child is None:
+                break
+
+            label = child.label
+            end = index + len(label)
+            if end > count:
+                break
+            if len(label) > 1 and tuple(segments[index:end]) != label:
+                break
+
+            node = child
+            index = end
+            if node.has_value:
+                best = (node.prefix, node.value)
+
+        return best
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        """遍历所有前缀及其值"""
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.has_value:
+                yield node.prefix, node.value
+            stack.extend(node.children.values())
@@ -0,0 +1,341 @@
+"""
+请求调度模块
+提供应用请求队列的优先级通道，以及多个应用共享工作线程池时的加权公平调度
+"""
+
+import concurrent.futures
+import fnmatch
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from flask import Flask
+
+logger = logging.getLogger(__name__)
+
+# 优先级通道，按从高到低排列
+PRIORITY_HIGH = 'high'
+PRIORITY_NORMAL = 'normal'
+PRIORITY_LOW = 'low'
+PRIORITY_LEVELS = (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)
+
+PRIORITY_HEADER = 'X-Request-Priority'
+PRIORITY_ENVIRON_KEY = 'HTTP_X_REQUEST_PRIORITY'
+PRIORITY_VIEW_ATTRIBUTE = 'port_sharing_priority'
+
+def request_priority(priority: str) -> Callable:
+    """视图函数装饰器：指定该路由的请求进入哪个优先级通道
+
+    用法:
+        @app.route('/health')
+        @request_priority('high')
+        def health():
+            ...
+    """
+    if priority not in PRIORITY_LEVELS:
+        raise ValueError(f"不支持的优先级: {priority}")
+
+    def decorator(view_func: Callable) -> Callable:
+        setattr(view_func, PRIORITY_VIEW_ATTRIBUTE, priority)
+        return view_func
+
+    return decorator
+
+class LaneStats:
+    """单个优先级通道的排队统计"""
+
+    def __init__(self):
+        self.enqueued = 0
+        self.dequeued = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def to_dict(self, queued: int) -> Dict:
+        """导出统计信息"""
+        return {
+            "queued": queued,
+            "enqueued": self.enqueued,
+            "dequeued": self.dequeued,
+            "avg_wait": self.total_wait / self.dequeued if self.dequeued else 0.0,
+            "max_wait": self.max_wait
+        }
+
+class PriorityRequestQueue:
+    """带优先级通道的请求队列，接口与 queue.Queue 的 put_nowait/get/qsize 兼容
+
+    weights 为空时严格按优先级出队；给定权重（例如 {'high': 6, 'normal': 3, 'low': 1}）
+    时按平滑加权轮询在非空通道之间出队，低优先级通道不会被完全饿死。
+    """
+
+    def __init__(self, maxsize: int = 1000, weights: Optional[Dict[str, int]] = None):
+        self.maxsize = maxsize
+        self.weights = dict(weights) if weights else None
+        if self.weights:
+            for priority, weight in self.weights.items():
+                if priority not in PRIORITY_LEVELS or weight <= 0:
+                    raise ValueError(f"无效的优先级权重: {priority}={weight}")
+
+        self.lanes: Dict[str, deque] = {priority: deque() for priority in PRIORITY_LEVELS}
+        self.lane_stats: Dict[str, LaneStats] = {priority: LaneStats() for priority in PRIORITY_LEVELS}
+        self.current_weights: Dict[str, int] = {priority: 0 for priority in PRIORITY_LEVELS}
+        self.size = 0
+
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+
+    def qsize(self) -> int:
+        return self.size
+
+    def empty(self) -> bool:
+        return self.size == 0
+
+    def put_nowait(self, item: Any, priority: str = PRIORITY_NORMAL):
+        """放入请求，队列已满时抛出 queue.Full"""
+        with self.lock:
+            if self.maxsize > 0 and self.size >= self.maxsize:
+                raise queue.Full
+            self.lanes[priority].append((time.monotonic(), item))
+            self.lane_stats[priority].enqueued += 1
+            self.size += 1
+            self.not_empty.notify()
+
+    def put(self, item: Any, block: bool = True, timeout: Optional[float] = None,
+            priority: str = PRIORITY_NORMAL):
+        """与 queue.Queue.put 兼容的入口，不阻塞等待空位"""
+        self.put_nowait(item, priority)
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> Any:
+        """取出下一个请求，超时抛出 queue.Empty"""
+        with self.not_empty:
+            if not block:
+                if not self.size:
+                    raise queue.Empty
+            elif timeout is None:
+                while not self.size:
+                    self.not_empty.wait()
+            else:
+                end_time = time.monotonic() + timeout
+                while not self.size:
+                    remaining = end_time - time.monotonic()
+                    if remaining <= 0:
+                        raise queue.Empty
+                    self.not_empty.wait(remaining)
+            return self._pop()
+
+    def get_nowait(self) -> Any:
+        return self.get(block=False)
+
+    def transfer_to(self, other: 'PriorityRequestQueue') -> int:
+        """把排队中的请求按原通道和入队时间移到另一个队列（不检查容量），返回移动的数量"""
+        with self.lock:
+            moved = {priority: list(self.lanes[priority]) for priority in PRIORITY_LEVELS}
+            for lane in self.lanes.values():
+                lane.clear()
+            self.size = 0
+        count = sum(len(items) for items in moved.values())
+        if count:
+            with other.lock:
+                for priority, items in moved.items():
+                    other.lanes[priority].extend(items)
+                    other.lane_stats[priority].enqueued += len(items)
+                other.size += count
+                other.not_empty.notify(count)
+        return count
+
+    def _pop(self) -> Any:
+        """按调度策略从非空通道取出一个请求（调用方需持有锁）"""
+        priority = self._next_lane()
+        enqueued_at, item = self.lanes[priority].popleft()
+        self.size -= 1
+
+        wait = time.monotonic() - enqueued_at
+        stats = self.lane_stats[priority]
+        stats.dequeued += 1
+        stats.total_wait += wait
+        stats.max_wait = max(stats.max_wait, wait)
+        return item
+
+    def _next_lane(self) -> str:
+        if not self.weights:
+            return next(priority for priority in PRIORITY_LEVELS if self.lanes[priority])
+
+        # 平滑加权轮询：每轮给非空通道加上权重，选出当前值最大的并减去总权重
+        candidates = [priority for priority in PRIORITY_LEVELS if self.lanes[priority]]
+        total = 0
+        for priority in candidates:
+            weight = self.weights.get(priority, 1)
+            self.current_weights[priority] += weight
+            total += weight
+        chosen = max(candidates, key=lambda priority: self.current_weights[priority])
+        self.current_weights[chosen] -= total
+        return chosen
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """各优先级通道的排队统计"""
+        with self.lock:
+            return {
+                priority: self.lane_stats[priority].to_dict(len(self.lanes[priority]))
+                for priority in PRIORITY_LEVELS
+            }
+
+class PriorityClassifier:
+    """为请求选择优先级通道
+
+    顺序：视图函数装饰器 > 路由模式规则 > X-Request-Priority 请求头 > 默认通道。
+    服务端的配置优先于客户端的提示。
+    """
+
+    def __init__(self, app: Optional[Flask], prefix: str, rules: Optional[Dict[str, str]] = None,
+                 default: str = PRIORITY_NORMAL):
+        self.app = app
+        self.prefix = prefix
+        self.default = default
+        self.rules = list((rules or {}).items())
+        for pattern, priority in self.rules:
+            if priority not in PRIORITY_LEVELS:
+                raise ValueError(f"路由 {pattern} 的优先级无效: {priority}")
+
+        # 只有存在带装饰器的视图时才需要在主控线程里做URL匹配；进程外应用的视图不在主控进程中
+        self.decorated_endpoints = {
+            endpoint: getattr(view_func, PRIORITY_VIEW_ATTRIBUTE)
+            for endpoint, view_func in app.view_functions.items()
+            if hasattr(view_func, PRIORITY_VIEW_ATTRIBUTE)
+        } if app is not None else {}
+
+    def classify(self, environ: Dict[str, Any], path: str) -> str:
+        """返回请求应进入的优先级通道"""
+        app_path = path[len(self.prefix):] if path.startswith(self.prefix) else path
+        app_path = app_path or '/'
+
+        if self.decorated_endpoints:
+            try:
+                adapter = self.app.url_map.bind('localhost')
+                endpoint, _ = adapter.match(app_path, method=environ.get('REQUEST_METHOD', 'GET'))
+                if endpoint in self.decorated_endpoints:
+                    return self.decorated_endpoints[endpoint]
+            except Exception:
+                # 匹配失败（404/405/重定向）交给应用自己处理
+                pass
+
+        for pattern, priority in self.rules:
+            if fnmatch.fnmatchcase(app_path, pattern):
+                return priority
+
+        header = environ.get(PRIORITY_ENVIRON_KEY, '').strip().lower()
+        if header in PRIORITY_LEVELS:
+            return header
+
+        return self.default
+
+class ScheduledApp:
+    """共享线程池中的一个应用"""
+
+    def __init__(self, app_id: str, request_queue: PriorityRequestQueue,
+                 handler: Callable[[Any], None], weight: float):
+        self.app_id = app_id
+        self.request_queue = request_queue
+        self.handler = handler
+        self.weight = weight
+        self.pass_value = 0.0  # 虚拟时间，每服务一个请求前进 1/weight
+        self.served = 0
+
+class FairScheduler:
+    """跨应用的加权公平调度器（stride调度）
+
+    所有应用共用一个线程池，每个排队的请求对应线程池中的一个任务。任务开始执行时
+    才选择要服务的应用：在有积压的应用中选虚拟时间最小的一个，因此繁忙的应用
+    只能按权重占用线程，空闲的应用不占用任何线程。
+    """
+
+    def __init__(self, max_workers: int = 50,
+                 executor: Optional[concurrent.futures.ThreadPoolExecutor] = None):
+        self.max_workers = max_workers
+        self.executor = executor or concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="port-sharing-shared")
+        self.apps: Dict[str, ScheduledApp] = {}
+        self.virtual_time = 0.0
+        self.lock = threading.Lock()
+
+    def add_app(self, app_id: str, request_queue: PriorityRequestQueue,
+                handler: Callable[[Any], None], weight: float = 1.0):
+        """加入共享线程池，handler 在工作线程中处理一个请求"""
+        if weight <= 0:
+            raise ValueError(f"应用权重必须大于0: {weight}")
+        with self.lock:
+            scheduled = ScheduledApp(app_id, request_queue, handler, weight)
+            scheduled.pass_value = self.virtual_time
+            self.apps[app_id] = scheduled
+
+    def remove_app(self, app_id: str):
+        with self.lock:
+            self.apps.pop(app_id, None)
+
+    def worker_share(self, app_id: str) -> float:
+        """应用按权重分到的线程数：所有应用都有积压时它至少能得到这么多线程"""
+        with self.lock:
+            scheduled = self.apps.get(app_id)
+            if scheduled is None:
+                return 0.0
+            total_weight = sum(app.weight for app in self.apps.values())
+            return self.max_workers * scheduled.weight / total_weight
+
+    def submit(self, app_id: str):
+        """应用的队列中加入了一个请求，为它安排一个线程池任务"""
+        with self.lock:
+            scheduled = self.apps.get(app_id)
+            if scheduled is None:
+                return
+            if scheduled.request_queue.qsize() <= 1:
+                # 从空闲恢复的应用不能用空闲期间积累的虚拟时间插队
+                scheduled.pass_value = max(scheduled.pass_value, self.virtual_time)
+        self.executor.submit(self.run_next)
+
+    def next_request(self) -> Optional[Tuple[ScheduledApp, Any]]:
+        """按加权公平顺序取出下一个要处理的请求"""
+        with self.lock:
+            candidates = [scheduled for scheduled in self.apps.values()
+                          if scheduled.request_queue.qsize()]
+            while candidates:
+                scheduled = min(candidates, key=lambda candidate: candidate.pass_value)
+                try:
+                    item = scheduled.request_queue.get_nowait()
+                except queue.Empty:
+                    candidates.remove(scheduled)
+                    continue
+                self.virtual_time = scheduled.pass_value
+                scheduled.pass_value += 1.0 / scheduled.weight
+                scheduled.served += 1
+                return scheduled, item
+        return None
+
+    def run_next(self):
+        """线程池任务：处理一个请求"""
+        picked = self.next_request()
+        if picked is None:
+            return
+        scheduled, item = picked
+        try:
+            scheduled.handler(item)
+        except Exception as e:
+            logger.error(f"共享线程池处理应用 {scheduled.app_id} 的请求出错: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """调度统计"""
+        with self.lock:
+            return {
+                "max_workers": self.max_workers,
+                "apps": {
+                    app_id: {
+                        "weight": scheduled.weight,
+                        "served": scheduled.served,
+                        "queued": scheduled.request_queue.qsize()
+                    }
+                    for app_id, scheduled in self.apps.items()
+                }
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
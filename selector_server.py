@@ -0,0 +1,515 @@
+"""
+selectors主控服务器引擎
+一个I/O线程用 selectors（Linux上是epoll）处理所有连接的接受、读取、HTTP解析和写出，
+完整的请求交给固定大小的处理线程池执行WSGI应用。支持持久连接和流水线请求，
+同一连接上的响应按请求顺序写出。
+
+限制：请求体不流式传给应用。I/O线程先接收完整的请求体（超过 body_spool_threshold 的部分写入临时文件），
+再把请求交给处理线程，即使应用使用WSGI直通模式也是如此。
+"""
+
+import collections
+import concurrent.futures
+import io
+import logging
+import selectors
+import socket
+import tempfile
+import threading
+import time
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from .http_protocol import (
+    CONTINUE_RESPONSE, HEADER_TERMINATOR, LAST_CHUNK, MAX_HEADER_BYTES,
+    ChunkedDecoder, ProtocolError, RequestHead, build_environ, encode_chunk,
+    error_response, frame_response, parse_request_head, start_wsgi
+)
+from .port_sharing import DISCONNECTED_ENVIRON_KEY, create_listen_socket, create_reuse_port_socket
+
+logger = logging.getLogger(__name__)
+
+# 接收完整请求头的超时（秒），从连接建立或请求的第一个字节开始计算
+DEFAULT_HEADER_TIMEOUT = 10.0
+# 持久连接上两个请求之间、读取请求体以及写出响应时允许的空闲时间（秒）
+DEFAULT_IDLE_TIMEOUT = 5.0
+DEFAULT_BACKLOG = 1024
+# 执行WSGI应用的线程数，以及已解析但还没有处理完的请求数上限
+DEFAULT_HANDLER_THREADS = 32
+DEFAULT_MAX_PENDING = 1024
+
+RECV_SIZE = 64 * 1024
+# 一个连接上待写出的数据超过该值时，处理线程等待客户端读取
+OUTPUT_HIGH_WATER = 256 * 1024
+# 一个连接上已解析、等待处理的流水线请求数上限，超过后暂停读取
+MAX_PIPELINED_REQUESTS = 16
+# 检查超时的间隔（秒）
+TIMER_INTERVAL = 0.25
+
+# 连接状态
+STATE_IDLE = 'idle'    # 持久连接上等待下一个请求
+STATE_HEAD = 'head'    # 正在接收请求头
+STATE_BODY = 'body'    # 正在接收请求体
+
+class Connection:
+    """一个客户端连接，除输出缓冲区外只由I/O线程访问"""
+
+    def __init__(self, sock: socket.socket, address: Tuple[str, int], deadline: float):
+        self.sock = sock
+        self.address = address
+        self.inbuf = bytearray()
+        self.state = STATE_HEAD
+        self.deadline = deadline
+        # 正在接收的请求
+        self.head: Optional[RequestHead] = None
+        self.body: Any = None
+        self.body_size = 0
+        self.body_remaining = 0
+        self.decoder: Optional[ChunkedDecoder] = None
+        # 已完整接收、等待处理的请求
+        self.requests: Deque[Tuple[RequestHead, Any, int]] = collections.deque()
+        self.busy = False           # 处理线程正在执行该连接的一个请求
+        self.reading = True
+        self.last_request = False   # 已收到不复用连接的请求，之后的字节不再解析
+        self.eof = False            # 客户端关闭了写方向（正常关闭，或者半关闭后仍在等待响应）
+        self.reset = False          # 读取时出错，连接已被重置
+        self.close_after_flush = False
+        # 连接不再复用时的错误响应，排在已接收请求的响应之后发送
+        self.pending_error: Optional[bytes] = None
+        self.events = 0
+        # 输出缓冲区由处理线程写入、I/O线程发送
+        self.lock = threading.Lock()
+        self.writable = threading.Condition(self.lock)
+        self.outbuf = bytearray()
+        # 输出缓冲区在该时间之前没有任何进展时关闭连接（客户端不读取响应）
+        self.write_deadline = 0.0
+        self.closed = False
+
+class SelectorMasterEngine:
+    """基于selectors的HTTP/1.1主控服务器，接口与werkzeug的服务器一致（serve_forever / shutdown）"""
+
+    def __init__(self, master_server, host: str, port: int, reuse_port: bool = False,
+                 header_timeout: float = DEFAULT_HEADER_TIMEOUT,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 backlog: int = DEFAULT_BACKLOG,
+                 handler_threads: int = DEFAULT_HANDLER_THREADS,
+                 max_pending: int = DEFAULT_MAX_PENDING):
+        self.master_server = master_server
+        self.header_timeout = header_timeout
+        self.idle_timeout = idle_timeout
+        self.max_pending = max_pending
+        if reuse_port:
+            self.socket = create_reuse_port_socket(host, port, backlog)
+        else:
+            self.socket = create_listen_socket(host, port, backlog)
+        self.socket.setblocking(False)
+        self.server_address = self.socket.getsockname()[:2]
+        self.server_port = self.server_address[1]
+        self.handlers = concurrent.futures.ThreadPoolExecutor(max_workers=handler_threads,
+                                                              thread_name_prefix="selector-handler")
+        self.selector = selectors.DefaultSelector()
+        self.connections: Dict[int, Connection] = {}
+        self.pending = 0  # 已交给处理线程池、尚未完成的请求数
+        # 处理线程通过唤醒套接字通知I/O线程有输出要发送或请求已完成
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+        self.events: Deque[Tuple[Connection, Optional[bool]]] = collections.deque()
+        self.running = False
+        self.stopped = threading.Event()
+
+    @property
+    def connection_count(self) -> int:
+        """当前打开的客户端连接数"""
+        return len(self.connections)
+
+    def serve_forever(self):
+        """在当前线程中运行I/O循环，直到 shutdown() 被调用"""
+        self.selector.register(self.socket, selectors.EVENT_READ, None)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ, self.wakeup_reader)
+        self.running = True
+        next_timer = time.monotonic() + TIMER_INTERVAL
+        try:
+            while self.running:
+                for key, mask in self.selector.select(TIMER_INTERVAL):
+                    if key.data is None:
+                        self.accept()
+                    elif key.data is self.wakeup_reader:
+                        self.process_events()
+                    else:
+                        self.handle_events(key.data, mask)
+                now = time.monotonic()
+                if now >= next_timer:
+                    self.expire_connections(now)
+                    next_timer = now + TIMER_INTERVAL
+        finally:
+            for connection in list(self.connections.values()):
+                self.close(connection)
+            self.selector.close()
+            self.socket.close()
+            self.wakeup_reader.close()
+            self.wakeup_writer.close()
+            self.handlers.shutdown(wait=False)
+            self.stopped.set()
+
+    def handle_events(self, connection: Connection, mask: int):
+        """处理一个连接上的就绪事件；意外的异常只关闭这个连接，不会让I/O线程退出"""
+        try:
+            if mask & selectors.EVENT_READ:
+                self.on_readable(connection)
+            if mask & selectors.EVENT_WRITE and not connection.closed:
+                self.flush(connection)
+        except Exception as e:
+            logger.error(f"处理来自 {connection.address[0]} 的连接时出错: {e}")
+            self.close(connection)
+
+    def shutdown(self):
+        """停止I/O循环并等待其退出，可在任意线程中调用"""
+        self.running = False
+        self.wakeup()
+        self.stopped.wait()
+
+    def wakeup(self):
+        try:
+            self.wakeup_writer.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass  # 已有未处理的唤醒，或者引擎已停止
+
+    def accept(self):
+        while True:
+            try:
+                sock, address = self.socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logger.warning(f"接受连接失败: {e}")
+                return
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = Connection(sock, tuple(address[:2]), time.monotonic() + self.header_timeout)
+            self.connections[sock.fileno()] = connection
+            self.update_events(connection)
+
+    def update_events(self, connection: Connection):
+        """按连接是否在读、是否有待发送数据设置关注的事件"""
+        events = 0
+        if connection.reading:
+            events |= selectors.EVENT_READ
+        if connection.outbuf:
+            events |= selectors.EVENT_WRITE
+        if events == connection.events:
+            return
+        if not connection.events:
+            self.selector.register(connection.sock, events, connection)
+        elif not events:
+            self.selector.unregister(connection.sock)
+        else:
+            self.selector.modify(connection.sock, events, connection)
+        connection.events = events
+
+    def on_readable(self, connection: Connection):
+        if connection.closed:
+            return
+        try:
+            data = connection.sock.recv(RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            connection.reset = True
+            data = b''
+        if not data:
+            # 客户端关闭或重置了连接：没有请求在处理时直接关闭；否则停止读取，
+            # 已接收的请求处理完后关闭（分发器容忍半关闭时客户端仍能收到响应）
+            connection.eof = True
+            if connection.busy or connection.requests:
+                connection.reading = False
+                connection.last_request = True
+                self.update_events(connection)
+            else:
+                self.close(connection)
+            return
+
+        connection.inbuf += data
+        try:
+            self.parse(connection)
+        except ProtocolError as e:
+            logger.debug(f"来自 {connection.address[0]} 的请求无效: {e}")
+            self.reject(connection, error_response(e.status, str(e)))
+            return
+        self.dispatch_next(connection)
+
+    def parse(self, connection: Connection):
+        """从输入缓冲区中解析出尽可能多的完整请求"""
+        now = time.monotonic()
+        while not connection.last_request:
+            if connection.head is None:
+                if connection.state == STATE_IDLE:
+                    if not connection.inbuf.strip(b'\r\n'):
+                        break
+                    connection.state = STATE_HEAD
+                    connection.deadline = now + self.header_timeout
+                end = connection.inbuf.find(HEADER_TERMINATOR)
+                if end < 0:
+                    if len(connection.inbuf) > MAX_HEADER_BYTES:
+                        raise ProtocolError('431 Request Header Fields Too Large', "请求头过大")
+                    break
+                head = parse_request_head(bytes(connection.inbuf[:end + 4]))
+                del connection.inbuf[:end + 4]
+                self.start_body(connection, head)
+            if not self.receive_body(connection):
+                connection.deadline = now + self.idle_timeout
+                break
+
+            # 请求已完整接收
+            connection.body.seek(0)
+            connection.requests.append((connection.head, connection.body, connection.body_size))
+            if not connection.head.keep_alive:
+                connection.last_request = True
+            connection.head = connection.body = connection.decoder = None
+            connection.state = STATE_IDLE
+            connection.deadline = now + self.idle_timeout
+
+        if len(connection.requests) >= MAX_PIPELINED_REQUESTS or connection.last_request:
+            connection.reading = False
+            self.update_events(connection)
+
+    def start_body(self, connection: Connection, head: RequestHead):
+        threshold = self.master_server.dispatcher.body_spool_threshold
+        connection.head = head
+        connection.state = STATE_BODY
+        connection.body_size = 0
+        if head.chunked:
+            connection.decoder = ChunkedDecoder()
+            connection.body = tempfile.SpooledTemporaryFile(max_size=threshold)
+        else:
+            connection.body_remaining = head.content_length
+            connection.body = io.BytesIO() if connection.body_remaining <= threshold \
+                else tempfile.SpooledTemporaryFile(max_size=threshold)
+        if head.expects_continue and not connection.inbuf:
+            self.send(connection, CONTINUE_RESPONSE)
+
+    def receive_body(self, connection: Connection) -> bool:
+        """把输入缓冲区中属于当前请求体的字节移入请求体，请求体接收完整时返回True"""
+        if connection.decoder is not None:
+            data = connection.decoder.feed(bytes(connection.inbuf))
+            connection.inbuf.clear()
+            connection.body.write(data)
+            connection.body_size += len(data)
+            if not connection.decoder.done:
+                return False
+            connection.inbuf += connection.decoder.remainder
+            return True
+
+        size = min(connection.body_remaining, len(connection.inbuf))
+        if size:
+            connection.body.write(connection.inbuf[:size])
+            del connection.inbuf[:size]
+            connection.body_remaining -= size
+            connection.body_size += size
+        return not connection.body_remaining
+
+    def dispatch_next(self, connection: Connection):
+        """连接空闲时把下一个已接收的请求交给处理线程池，同一连接上的请求按顺序处理"""
+        if connection.busy or connection.closed or not connection.requests:
+            return
+        head, body, size = connection.requests.popleft()
+        if self.pending >= self.max_pending:
+            body.close()
+            for _, queued_body, _ in connection.requests:
+                queued_body.close()
+            connection.requests.clear()
+            self.reject(connection, error_response('503 Service Unavailable', "服务繁忙"))
+            return
+
+        environ = build_environ(head, body, size, self.server_address, connection.address)
+        # 分发器用它检测等待响应期间客户端是否断开；只有I/O线程读取套接字，分发器不能再探测它
+        environ[DISCONNECTED_ENVIRON_KEY] = lambda: self.client_disconnected(connection)
+        connection.busy = True
+        self.pending += 1
+        self.handlers.submit(self.handle_request, connection, head, environ)
+
+        if not connection.reading and not connection.last_request \
+                and len(connection.requests) < MAX_PIPELINED_REQUESTS:
+            connection.reading = True
+            self.update_events(connection)
+
+    def client_disconnected(self, connection: Connection) -> bool:
+        """客户端是否已断开：连接被重置或已关闭；读到EOF只在分发器配置为视其为断开时才算"""
+        return connection.closed or connection.reset \
+            or (connection.eof and self.master_server.dispatcher.disconnect_on_eof)
+
+    def handle_request(self, connection: Connection, head: RequestHead, environ: Dict[str, Any]):
+        """在处理线程中执行WSGI应用并把响应写入连接的输出缓冲区"""
+        keep_alive = False
+        started = False
+        try:
+            status, headers, body = start_wsgi(self.master_server.wsgi_app, environ)
+            try:
+                framing = frame_response(head, status, headers)
+                # 响应头和第一段响应体一起写出，普通响应只需要一次发送
+                pending = [framing.head]
+                if framing.send_body:
+                    for chunk in body:
+                        if chunk:
+                            pending.append(encode_chunk(chunk) if framing.chunked else chunk)
+                            started = True
+                            self.write(connection, b''.join(pending))
+                            pending = []
+                    if framing.chunked:
+                        pending.append(LAST_CHUNK)
+                started = True
+                if pending:
+                    self.write(connection, b''.join(pending))
+                keep_alive = framing.keep_alive
+            finally:
+                close = getattr(body, 'close', None)
+                if close is not None:
+                    close()
+        except ConnectionError:
+            pass
+        except Exception as e:
+            logger.error(f"处理请求 {head.method} {head.target} 时出错: {e}")
+            if not started:
+                try:
+                    self.write(connection, error_response('500 Internal Server Error', "内部错误"))
+                except ConnectionError:
+                    pass
+        finally:
+            environ['wsgi.input'].close()
+            self.events.append((connection, keep_alive))
+            self.wakeup()
+
+    def write(self, connection: Connection, data: bytes):
+        """处理线程写出响应数据，缓冲区过大时等待I/O线程发送
+
+        客户端超过 idle_timeout 不读取响应时放弃写出，I/O线程会在超时检查中关闭连接，
+        处理线程不会被一直占用。
+        """
+        with connection.lock:
+            while len(connection.outbuf) > OUTPUT_HIGH_WATER and not connection.closed:
+                remaining = connection.write_deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ConnectionResetError("写出响应超时")
+                connection.writable.wait(remaining)
+            if connection.closed:
+                raise ConnectionResetError("客户端连接已关闭")
+            self.append_output(connection, data)
+        self.events.append((connection, None))
+        self.wakeup()
+
+    def process_events(self):
+        """处理处理线程发来的通知：None 表示有输出要发送，布尔值表示请求完成及连接能否复用"""
+        try:
+            while self.wakeup_reader.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        while self.events:
+            connection, keep_alive = self.events.popleft()
+            if keep_alive is not None:
+                self.pending -= 1
+                connection.busy = False
+                if connection.closed:
+                    continue
+                if not keep_alive:
+                    connection.close_after_flush = True
+                    connection.reading = False
+                    self.update_events(connection)
+                elif connection.state == STATE_IDLE:
+                    connection.deadline = time.monotonic() + self.idle_timeout
+            if not connection.closed:
+                self.flush(connection)
+            if not connection.closed and keep_alive:
+                self.dispatch_next(connection)
+                if connection.last_request and not connection.busy and not connection.requests:
+                    if connection.pending_error is not None:
+                        with connection.lock:
+                            self.append_output(connection, connection.pending_error)
+                        connection.pending_error = None
+                    connection.close_after_flush = True
+                    self.flush(connection)
+
+    def send(self, connection: Connection, data: bytes):
+        """I/O线程自己产生的输出（100 Continue、错误响应）"""
+        with connection.lock:
+            self.append_output(connection, data)
+        self.flush(connection)
+
+    def append_output(self, connection: Connection, data: bytes):
+        """追加到输出缓冲区（调用方需持有连接的锁），缓冲区从空变为非空时开始计算写出超时"""
+        if not connection.outbuf:
+            connection.write_deadline = time.monotonic() + self.idle_timeout
+        connection.outbuf += data
+
+    def flush(self, connection: Connection):
+        """尽量发送输出缓冲区，发不完时关注可写事件"""
+        with connection.lock:
+            if connection.outbuf:
+                try:
+                    sent = connection.sock.send(connection.outbuf)
+                except (BlockingIOError, InterruptedError):
+                    sent = 0
+                except OSError:
+                    sent = -1
+                if sent > 0:
+                    del connection.outbuf[:sent]
+                    connection.writable.notify_all()
+                    now = time.monotonic()
+                    connection.write_deadline = now + self.idle_timeout
+                    if not connection.busy:
+                        connection.deadline = now + self.idle_timeout
+            else:
+                sent = 0
+            done = not connection.outbuf
+        if sent < 0 or (done and connection.close_after_flush and not connection.busy):
+            self.close(connection)
+        else:
+            self.update_events(connection)
+
+    def reject(self, connection: Connection, response: bytes):
+        """发送错误响应后关闭连接
+
+        已接收的请求先处理完，错误响应排在它们的响应之后发送。
+        """
+        connection.last_request = True
+        connection.reading = False
+        if connection.busy or connection.requests:
+            connection.pending_error = response
+            self.update_events(connection)
+            self.dispatch_next(connection)
+            return
+        connection.close_after_flush = True
+        self.send(connection, response)
+
+    def expire_connections(self, now: float):
+        """关闭请求头、请求体接收、持久连接空闲或写出响应超时的连接"""
+        for connection in list(self.connections.values()):
+            with connection.lock:
+                write_expired = bool(connection.outbuf) and now >= connection.write_deadline
+            if write_expired:
+                # 客户端不读取响应：关闭连接会唤醒等待写出的处理线程
+                logger.debug(f"连接 {connection.address[0]}:{connection.address[1]} 写出响应超时")
+                self.close(connection)
+                continue
+            if connection.busy or connection.requests:
+                continue
+            if now >= connection.deadline:
+                logger.debug(f"连接 {connection.address[0]}:{connection.address[1]} "
+                             f"在 {connection.state} 状态超时")
+                self.close(connection)
+
+    def close(self, connection: Connection):
+        if connection.closed:
+            return
+        with connection.lock:
+            connection.closed = True
+            connection.writable.notify_all()
+        if connection.events:
+            self.selector.unregister(connection.sock)
+            connection.events = 0
+        self.connections.pop(connection.sock.fileno(), None)
+        for _, body, _ in connection.requests:
+            body.close()
+        connection.requests.clear()
+        if connection.body is not None:
+            connection.body.close()
+        connection.sock.close()
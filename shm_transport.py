@@ -0,0 +1,251 @@
+"""
+共享内存传输模块
+主控进程与应用进程之间基于 multiprocessing.shared_memory 的环形缓冲区，用eventfd唤醒对端
+
+每个环形缓冲区只有一个读者，写者在同一进程内由调用方加锁串行化。缓冲区对外表现为
+字节流（sendall/recv_into），transport 模块的帧格式可以原样运行在它上面，超过缓冲区
+容量的消息体会分段写入。需要 Linux 和 Python 3.10+（os.eventfd、socket.send_fds）。
+"""
+
+import os
+import select
+import socket
+import struct
+from multiprocessing import shared_memory
+from typing import List, Tuple
+
+DEFAULT_RING_CAPACITY = 4 * 1024 * 1024
+
+# 控制区布局：读写位置各占一个缓存行，避免两个进程互相使对方的缓存行失效
+_POSITION = struct.Struct('Q')
+_FLAG = struct.Struct('I')
+WRITE_POS_OFFSET = 0
+READ_POS_OFFSET = 64
+READER_WAITING_OFFSET = 128
+WRITER_WAITING_OFFSET = 132
+CLOSED_OFFSET = 136
+DATA_OFFSET = 192
+
+# 等待对端唤醒的最长时间；极少数情况下唤醒信号与等待标志交错丢失，最多延迟这么久
+WAIT_TIMEOUT = 0.05
+
+def _available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+# 读者睡眠前先轮询的次数；对端通常在几十微秒内回应，轮询命中时省去eventfd的系统调用。
+# 单核时对端必须等本进程让出CPU才能运行，轮询只会浪费时间片
+DEFAULT_SPIN_COUNT = 200 if _available_cpus() > 1 else 0
+
+def shm_supported() -> bool:
+    """当前平台是否支持共享内存传输"""
+    return hasattr(os, 'eventfd') and hasattr(socket, 'send_fds')
+
+def _attach_segment(name: str) -> shared_memory.SharedMemory:
+    """附加到对端创建的共享内存段，生命周期由创建者管理"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python 3.13 之前附加也会登记到resource_tracker，进程退出时会误删对端的段
+        from multiprocessing import resource_tracker
+        segment = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(segment._name, 'shared_memory')
+        return segment
+
+class ShmRing:
+    """单读者的共享内存环形字节流"""
+
+    def __init__(self, segment: shared_memory.SharedMemory, data_fd: int, space_fd: int,
+                 owner: bool = False, spin_count: int = DEFAULT_SPIN_COUNT):
+        self.segment = segment
+        self.spin_count = spin_count
+        self.buf = segment.buf
+        self.capacity = segment.size - DATA_OFFSET
+        self.data_fd = data_fd    # 有新数据时唤醒读者
+        self.space_fd = space_fd  # 有空闲空间时唤醒写者
+        self.owner = owner
+
+    @classmethod
+    def create(cls, capacity: int = DEFAULT_RING_CAPACITY) -> 'ShmRing':
+        segment = shared_memory.SharedMemory(create=True, size=DATA_OFFSET + capacity)
+        segment.buf[:DATA_OFFSET] = bytes(DATA_OFFSET)
+        return cls(segment, os.eventfd(0, os.EFD_NONBLOCK), os.eventfd(0, os.EFD_NONBLOCK), owner=True)
+
+    @classmethod
+    def attach(cls, name: str, data_fd: int, space_fd: int) -> 'ShmRing':
+        return cls(_attach_segment(name), data_fd, space_fd)
+
+    @property
+    def name(self) -> str:
+        return self.segment.name
+
+    @property
+    def fds(self) -> List[int]:
+        return [self.data_fd, self.space_fd]
+
+    def _get(self, layout: struct.Struct, offset: int) -> int:
+        return layout.unpack_from(self.buf, offset)[0]
+
+    def _set(self, layout: struct.Struct, offset: int, value: int):
+        layout.pack_into(self.buf, offset, value)
+
+    @property
+    def closed(self) -> bool:
+        return self.buf is None or self._get(_FLAG, CLOSED_OFFSET) != 0
+
+    def _wait(self, fd: int):
+        ready, _, _ = select.select([fd], [], [], WAIT_TIMEOUT)
+        if ready:
+            try:
+                os.eventfd_read(fd)
+            except BlockingIOError:
+                pass
+
+    def _signal(self, fd: int):
+        try:
+            os.eventfd_write(fd, 1)
+        except OSError:
+            pass
+
+    def sendall(self, data) -> None:
+        """写入全部数据，缓冲区满时等待读者腾出空间"""
+        view = memoryview(data).cast('B')
+        total = len(view)
+        sent = 0
+        while sent < total:
+            if self.closed:
+                raise ConnectionError("共享内存通道已关闭")
+            write_pos = self._get(_POSITION, WRITE_POS_OFFSET)
+            free = self.capacity - (write_pos - self._get(_POSITION, READ_POS_OFFSET))
+            if free == 0:
+                # 先登记等待再复查，读者在两次检查之间腾出的空间不会被错过
+                self._set(_FLAG, WRITER_WAITING_OFFSET, 1)
+                if self.capacity - (write_pos - self._get(_POSITION, READ_POS_OFFSET)) == 0:
+                    self._wait(self.space_fd)
+                self._set(_FLAG, WRITER_WAITING_OFFSET, 0)
+                continue
+
+            count = min(free, total - sent)
+            start = write_pos % self.capacity
+            first = min(count, self.capacity - start)
+            self.buf[DATA_OFFSET + start:DATA_OFFSET + start + first] = view[sent:sent + first]
+            if first < count:
+                self.buf[DATA_OFFSET:DATA_OFFSET + count - first] = view[sent + first:sent + count]
+            # 数据写完后再发布新的写位置
+            self._set(_POSITION, WRITE_POS_OFFSET, write_pos + count)
+            sent += count
+
+            if self._get(_FLAG, READER_WAITING_OFFSET):
+                self._set(_FLAG, READER_WAITING_OFFSET, 0)
+                self._signal(self.data_fd)
+
+    def recv_into(self, view: memoryview, nbytes: int = 0) -> int:
+        """读取最多nbytes字节到view，没有数据时阻塞；通道关闭且已读空时返回0"""
+        nbytes = nbytes or len(view)
+        while True:
+            read_pos = self._get(_POSITION, READ_POS_OFFSET)
+            available = self._get(_POSITION, WRITE_POS_OFFSET) - read_pos
+            if available:
+                count = min(available, nbytes)
+                start = read_pos % self.capacity
+                first = min(count, self.capacity - start)
+                view[:first] = self.buf[DATA_OFFSET + start:DATA_OFFSET + start + first]
+                if first < count:
+                    view[first:count] = self.buf[DATA_OFFSET:DATA_OFFSET + count - first]
+                self._set(_POSITION, READ_POS_OFFSET, read_pos + count)
+
+                if self._get(_FLAG, WRITER_WAITING_OFFSET):
+                    self._set(_FLAG, WRITER_WAITING_OFFSET, 0)
+                    self._signal(self.space_fd)
+                return count
+
+            if self.closed:
+                return 0
+            if self._spin(read_pos):
+                continue
+            self._set(_FLAG, READER_WAITING_OFFSET, 1)
+            if self._get(_POSITION, WRITE_POS_OFFSET) == read_pos:
+                self._wait(self.data_fd)
+            self._set(_FLAG, READER_WAITING_OFFSET, 0)
+
+    def _spin(self, read_pos: int) -> bool:
+        """短暂轮询写位置，有新数据时返回True"""
+        get = _POSITION.unpack_from
+        buf = self.buf
+        for _ in range(self.spin_count):
+            if get(buf, WRITE_POS_OFFSET)[0] != read_pos:
+                return True
+        return False
+
+    def close(self):
+        """标记关闭并唤醒双方，等待中的读写会立即返回"""
+        if self.buf is None:
+            return
+        self._set(_FLAG, CLOSED_OFFSET, 1)
+        self._signal(self.data_fd)
+        self._signal(self.space_fd)
+
+    def release(self):
+        """释放映射和文件描述符，创建者同时删除共享内存段"""
+        if self.buf is None:
+            return
+        self.close()
+        self.buf = None
+        for fd in self.fds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        try:
+            self.segment.close()
+        except BufferError:
+            # 仍有memoryview引用这块内存，等进程退出时回收映射
+            pass
+        if self.owner:
+            try:
+                self.segment.unlink()
+            except FileNotFoundError:
+                pass
+
+class ShmChannel:
+    """一对共享内存环形缓冲区组成的双向通道，接口与套接字的 sendall/recv_into 相同"""
+
+    def __init__(self, tx: ShmRing, rx: ShmRing):
+        self.tx = tx
+        self.rx = rx
+
+    def sendall(self, data) -> None:
+        self.tx.sendall(data)
+
+    def recv_into(self, view: memoryview, nbytes: int = 0) -> int:
+        return self.rx.recv_into(view, nbytes)
+
+    def close(self):
+        self.tx.close()
+        self.rx.close()
+
+    def release(self):
+        self.tx.release()
+        self.rx.release()
+
+def create_channel_pair(capacity: int = DEFAULT_RING_CAPACITY) -> Tuple[ShmRing, ShmRing]:
+    """创建主控到应用、应用到主控两个方向的环形缓冲区"""
+    return ShmRing.create(capacity), ShmRing.create(capacity)
+
+def send_channel(sock: socket.socket, requests: ShmRing, responses: ShmRing):
+    """通过Unix域套接字把两个环形缓冲区的eventfd传给应用进程"""
+    socket.send_fds(sock, [b'F'], requests.fds + responses.fds)
+
+def receive_channel(sock: socket.socket, request_name: str, response_name: str) -> ShmChannel:
+    """应用进程一侧：接收eventfd并附加到共享内存段"""
+    _, fds, _, _ = socket.recv_fds(sock, 1, 4)
+    if len(fds) != 4:
+        for fd in fds:
+            os.close(fd)
+        raise ConnectionError("没有收到共享内存通道的文件描述符")
+    requests = ShmRing.attach(request_name, fds[0], fds[1])
+    responses = ShmRing.attach(response_name, fds[2], fds[3])
+    # 应用进程读请求、写响应
+    return ShmChannel(tx=responses, rx=requests)
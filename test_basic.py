@@ -7,7 +7,7 @@ import threading
 import time
 import requests
 from flask import Flask, jsonify
-from . import enable_port_sharing, start_master_server, get_master_server_status
+from . import enable_port_sharing, start_master_server, get_master_server_status, reload_app
 
 class TestFlaskPortSharing(unittest.TestCase):
     """Flask端口复用基本功能测试"""
@@ -145,6 +145,311 @@ class TestFlaskPortSharing(unittest.TestCase):
         self.assertIsInstance(apps, list)
         self.assertGreaterEqual(len(apps), 2)
     
+    def test_concurrent_requests_get_own_response(self):
+        """测试同一应用的并发请求各自拿到自己的响应"""
+        import concurrent.futures
+        
+        app = Flask("concurrent_app")
+        
+        @app.route('/echo/<int:n>')
+        def echo(n):
+            time.sleep(0.01 * (n % 3))
+            return jsonify({"n": n})
+        
+        enable_port_sharing(app, prefix="/concurrent",
+                           master_host='127.0.0.1', master_port=5001)
+        app_thread = threading.Thread(target=app.run, daemon=True)
+        app_thread.start()
+        self.test_threads.append(app_thread)
+        time.sleep(1)
+        
+        def fetch(n):
+            response = requests.get(f"{self.base_url}/concurrent/echo/{n}")
+            return n, response.status_code, response.json()
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
+            results = list(executor.map(fetch, range(20)))
+        
+        for n, status_code, data in results:
+            self.assertEqual(status_code, 200)
+            self.assertEqual(data['n'], n)
+    
+    def test_multiple_workers(self):
+        """测试多工作线程并行处理同一应用的请求"""
+        import concurrent.futures
+        
+        app = Flask("workers_app")
+        
+        @app.route('/slow')
+        def slow():
+            time.sleep(0.5)
+            return jsonify({"ok": True})
+        
+        app_id = enable_port_sharing(app, prefix="/workers", workers=4,
+                                     master_host='127.0.0.1', master_port=5001)
+        app_thread = threading.Thread(target=app.run, daemon=True)
+        app_thread.start()
+        self.test_threads.append(app_thread)
+        time.sleep(1)
+        
+        started = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            statuses = list(executor.map(
+                lambda _: requests.get(f"{self.base_url}/workers/slow").status_code, range(4)))
+        elapsed = time.time() - started
+        
+        self.assertEqual(statuses, [200] * 4)
+        self.assertLess(elapsed, 1.5)
+        
+        stats = requests.get(f"{self.base_url}/_master/stats/{app_id}").json()
+        self.assertEqual(len(stats['workers']), 4)
+        self.assertEqual(sum(w['requests_handled'] for w in stats['workers']), 4)
+    
+    def test_dispatch_modes(self):
+        """测试WSGI直通模式和test_client模式都能正确转发请求体和前缀"""
+        from flask import request, url_for
+        
+        for mode in ("wsgi", "test_client"):
+            app = Flask(f"mode_{mode}")
+            
+            @app.route('/echo', methods=['POST'])
+            def echo():
+                return jsonify({
+                    "body": request.get_data(as_text=True),
+                    "arg": request.args.get('q'),
+                    "url": url_for('echo')
+                })
+            
+            enable_port_sharing(app, prefix=f"/mode_{mode}", dispatch_mode=mode,
+                               master_host='127.0.0.1', master_port=5001)
+            app_thread = threading.Thread(target=app.run, daemon=True)
+            app_thread.start()
+            self.test_threads.append(app_thread)
+            time.sleep(1)
+            
+            response = requests.post(f"{self.base_url}/mode_{mode}/echo?q=1", data=b"hello")
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertEqual(data['body'], "hello")
+            self.assertEqual(data['arg'], "1")
+            if mode == "wsgi":
+                self.assertEqual(data['url'], f"/mode_{mode}/echo")
+    
+    def test_large_upload_streaming(self):
+        """测试大请求体的流式上传，包括长度未知的分块上传"""
+        import hashlib
+        from flask import request
+        
+        for mode in ("wsgi", "test_client"):
+            app = Flask(f"upload_{mode}")
+            
+            @app.route('/upload', methods=['POST'])
+            def upload():
+                digest = hashlib.sha256()
+                size = 0
+                while True:
+                    chunk = request.stream.read(65536)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    size += len(chunk)
+                return jsonify({"size": size, "sha256": digest.hexdigest()})
+            
+            enable_port_sharing(app, prefix=f"/upload_{mode}", dispatch_mode=mode,
+                               master_host='127.0.0.1', master_port=5001)
+            app_thread = threading.Thread(target=app.run, daemon=True)
+            app_thread.start()
+            self.test_threads.append(app_thread)
+            time.sleep(1)
+            
+            payload = b"0123456789abcdef" * (256 * 1024)  # 4MB，超过默认内存阈值
+            expected = {"size": len(payload), "sha256": hashlib.sha256(payload).hexdigest()}
+            
+            response = requests.post(f"{self.base_url}/upload_{mode}/upload", data=payload)
+            self.assertEqual(response.json(), expected)
+            
+            chunks = (payload[i:i + 100000] for i in range(0, len(payload), 100000))
+            response = requests.post(f"{self.base_url}/upload_{mode}/upload", data=chunks)
+            self.assertEqual(response.json(), expected)
+    
+    def test_streaming_response(self):
+        """测试生成器响应和send_file逐块透传给客户端"""
+        import os
+        import tempfile
+        from flask import Response as FlaskResponse, send_file
+        
+        fd, file_path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b"z" * 200000)
+        self.addCleanup(os.remove, file_path)
+        
+        for mode in ("wsgi", "test_client"):
+            app = Flask(f"stream_{mode}")
+            
+            @app.route('/events')
+            def events():
+                def generate():
+                    yield "data: first\n\n"
+                    time.sleep(1)
+                    yield "data: second\n\n"
+                return FlaskResponse(generate(), mimetype='text/event-stream')
+            
+            @app.route('/file')
+            def download():
+                return send_file(file_path, mimetype='application/octet-stream')
+            
+            enable_port_sharing(app, prefix=f"/stream_{mode}", dispatch_mode=mode,
+                               master_host='127.0.0.1', master_port=5001)
+            app_thread = threading.Thread(target=app.run, daemon=True)
+            app_thread.start()
+            self.test_threads.append(app_thread)
+            time.sleep(1)
+            
+            started = time.time()
+            response = requests.get(f"{self.base_url}/stream_{mode}/events", stream=True)
+            chunks = response.iter_lines()
+            self.assertEqual(next(chunks), b"data: first")
+            self.assertLess(time.time() - started, 0.8)
+            self.assertIn(b"data: second", list(chunks))
+            
+            response = requests.get(f"{self.base_url}/stream_{mode}/file")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.content), 200000)
+    
+    def test_expired_requests_are_skipped(self):
+        """测试超过截止时间的排队请求不会被应用处理"""
+        app = Flask("deadline_app")
+        handled = []
+        
+        @app.route('/slow/<name>')
+        def slow(name):
+            handled.append(name)
+            time.sleep(1)
+            return jsonify({"name": name})
+        
+        app_id = enable_port_sharing(app, prefix="/deadline",
+                                     master_host='127.0.0.1', master_port=5001)
+        app_thread = threading.Thread(target=app.run, daemon=True)
+        app_thread.start()
+        self.test_threads.append(app_thread)
+        time.sleep(1)
+        
+        first = threading.Thread(target=requests.get, args=(f"{self.base_url}/deadline/slow/first",))
+        first.start()
+        time.sleep(0.2)
+        
+        # 第二个请求只愿意等待0.3秒，在队列中就会过期
+        response = requests.get(f"{self.base_url}/deadline/slow/second",
+                                headers={"X-Request-Timeout": "0.3"})
+        self.assertEqual(response.status_code, 504)
+        first.join()
+        time.sleep(1.2)
+        
+        self.assertEqual(handled, ["first"])
+        stats = requests.get(f"{self.base_url}/_master/stats/{app_id}").json()
+        self.assertEqual(stats['workers'][0]['expired'], 1)
+    
+    def test_disconnected_client_cancels_request(self):
+        """测试客户端断开后排队中的请求被取消，正在处理的请求可以感知取消"""
+        import socket
+        import struct
+        from . import is_request_cancelled
+        
+        app = Flask("cancel_app")
+        handled = []
+        observed = []
+        
+        @app.route('/slow/<name>')
+        def slow(name):
+            handled.append(name)
+            time.sleep(1)
+            if is_request_cancelled():
+                observed.append(name)
+            return jsonify({"name": name})
+        
+        app_id = enable_port_sharing(app, prefix="/cancel",
+                                     master_host='127.0.0.1', master_port=5001)
+        app_thread = threading.Thread(target=app.run, daemon=True)
+        app_thread.start()
+        self.test_threads.append(app_thread)
+        time.sleep(1)
+        
+        def send_and_disconnect(name, reset=False):
+            sock = socket.create_connection(('127.0.0.1', 5001))
+            sock.sendall(f"GET /cancel/slow/{name} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+            time.sleep(0.2)
+            if reset:
+                # 以RST中止连接
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            sock.close()
+        
+        # 第一个请求正在处理时正常关闭连接，第二个请求在排队时以RST中止
+        send_and_disconnect("first")
+        send_and_disconnect("second", reset=True)
+        time.sleep(3)
+        
+        self.assertEqual(handled, ["first"])
+        self.assertEqual(observed, ["first"])
+        stats = requests.get(f"{self.base_url}/_master/stats/{app_id}").json()
+        self.assertEqual(stats['workers'][0]['cancelled'], 1)
+    
+    def test_half_closed_client_still_gets_response(self):
+        """测试 disconnect_on_eof=False 时客户端发送请求后关闭写方向（半关闭）仍能收到响应"""
+        import socket
+        from .port_sharing import MasterServer, AppWrapper
+        
+        app = Flask("half_close_app")
+        
+        @app.route('/slow')
+        def slow():
+            time.sleep(1)
+            return "done"
+        
+        master = MasterServer(port=0, disconnect_on_eof=False)
+        master.start()
+        self.addCleanup(master.stop)
+        AppWrapper(app, "half_close", "/half_close", master)
+        app_thread = threading.Thread(target=app.run, daemon=True)
+        app_thread.start()
+        self.test_threads.append(app_thread)
+        time.sleep(1)
+        
+        sock = socket.create_connection(('127.0.0.1', master.server.server_port))
+        sock.sendall(b"GET /half_close/slow HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+        sock.shutdown(socket.SHUT_WR)
+        sock.settimeout(5)
+        data = b''
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        sock.close()
+        self.assertTrue(data.startswith(b"HTTP/1.1 200"))
+        self.assertTrue(data.endswith(b"done"))
+    
+    def test_weight_with_priority_weights(self):
+        """测试同时设置应用权重和优先级通道权重时两者各自生效"""
+        from . import port_sharing
+        
+        app = self.create_test_app("weighted_app")
+        app_id = enable_port_sharing(app, prefix="/weighted", master_host='127.0.0.1', master_port=5001,
+                                     weight=3, priority_weights={'high': 6, 'normal': 3, 'low': 1})
+        app_thread = threading.Thread(target=app.run, daemon=True)
+        app_thread.start()
+        self.test_threads.append(app_thread)
+        time.sleep(1)
+        
+        wrapper = port_sharing._master_server.wrappers[app_id]
+        self.assertEqual(wrapper.weight, 3)
+        self.assertEqual(wrapper.priority_weights, {'high': 6, 'normal': 3, 'low': 1})
+        response = requests.get(f"{self.base_url}/weighted/test")
+        self.assertEqual(response.json()["app"], "weighted_app")
+        
+        with self.assertRaises(ValueError):
+            enable_port_sharing(Flask("remote_weighted"), prefix="/remote_weighted",
+                                master_socket="/tmp/unused.sock", weight=2)
+    
     def test_nonexistent_route(self):
         """测试不存在的路由"""
         response = requests.get(f"{self.base_url}/nonexistent/path")
@@ -212,6 +517,1551 @@ class TestPerformanceOptimization(unittest.TestCase):
         self.assertAlmostEqual(stats['avg_duration'], 0.15, places=2)
         self.assertAlmostEqual(stats['error_rate'], 33.33, places=1)
 
+    def test_admission_control(self):
+        """测试准入控制根据队列深度和排空速率拒绝请求"""
+        from .performance import AdmissionController
+        
+        controller = AdmissionController(max_queue_wait=5.0)
+        
+        # 没有排空速率数据时只受队列容量限制
+        self.assertTrue(controller.admit("test_app", 100, 1000)[0])
+        self.assertFalse(controller.admit("test_app", 1000, 1000)[0])
+        
+        # 2个工作线程、每个请求0.5秒 -> 每秒排空4个请求
+        controller.record_completion("test_app", 0.5, workers=2)
+        self.assertAlmostEqual(controller.drain_rate("test_app"), 4.0)
+        
+        admitted, expected_wait = controller.admit("test_app", 10, 1000)
+        self.assertTrue(admitted)
+        self.assertAlmostEqual(expected_wait, 2.75)
+        
+        admitted, expected_wait = controller.admit("test_app", 30, 1000)
+        self.assertFalse(admitted)
+        self.assertEqual(AdmissionController.retry_after(expected_wait), 8)
+        self.assertEqual(controller.get_stats("test_app")['rejected'], 2)
+    
+    def test_admission_rejection_log_is_rate_limited(self):
+        """测试持续过载时每个应用每个间隔只输出一次拒绝警告，其余拒绝记为调试日志"""
+        import logging
+        from .performance import AdmissionController
+        
+        controller = AdmissionController()
+        with self.assertLogs(AdmissionController.__module__, level='DEBUG') as logs:
+            for _ in range(5):
+                self.assertFalse(controller.admit("overloaded", 10, 10)[0])
+            controller.last_warned["overloaded"] -= AdmissionController.REJECTION_LOG_INTERVAL
+            self.assertFalse(controller.admit("overloaded", 10, 10)[0])
+        
+        warnings = [record for record in logs.records if record.levelno == logging.WARNING]
+        self.assertEqual(len(warnings), 2)
+        self.assertIn("另有 4 个请求被拒绝", warnings[1].getMessage())
+        self.assertEqual(controller.get_stats("overloaded")['rejected'], 6)
+    
+    def test_adaptive_concurrency_limit(self):
+        """测试自适应并发限制在延迟平稳时增长、延迟升高时收缩"""
+        from .performance import AdaptiveConcurrencyLimiter
+        
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=4)
+        
+        def run_batch(rtt):
+            # 占满当前限制，再以给定延迟全部释放
+            acquired = 0
+            while limiter.acquire("test_app"):
+                acquired += 1
+            for _ in range(acquired):
+                limiter.release("test_app", rtt)
+            return acquired
+        
+        self.assertEqual(run_batch(0.01), 4)
+        for _ in range(5):
+            run_batch(0.01)
+        grown = limiter.get_stats("test_app")['limit']
+        self.assertGreater(grown, 4)
+        self.assertGreater(limiter.get_stats("test_app")['rejected'], 0)
+        
+        for _ in range(3):
+            run_batch(0.1)
+        self.assertLess(limiter.get_stats("test_app")['limit'], grown)
+        
+        # 超时等过载信号按倍数退让
+        before = limiter.limits["test_app"].limit
+        self.assertTrue(limiter.acquire("test_app"))
+        limiter.release("test_app", dropped=True)
+        self.assertAlmostEqual(limiter.limits["test_app"].limit, before * 0.9)
+
+    def test_adaptive_concurrency_disables_fixed_rate_throttling(self):
+        """测试启用自适应并发限制时不再按固定速率限流，单个应用可以超过50请求/秒"""
+        from werkzeug.test import Client
+        from .performance import PerformanceOptimizer
+        from .port_sharing import MasterServer, AppWrapper
+        
+        self.assertIsNone(PerformanceOptimizer(enable_async_processing=False).throttler)
+        self.assertIsNotNone(PerformanceOptimizer(enable_async_processing=False,
+                                                  enable_adaptive_concurrency=False).throttler)
+        
+        master = MasterServer(port=0)
+        app = Flask("unthrottled")
+        app.add_url_rule('/ping', 'ping', lambda: "pong")
+        wrapper = AppWrapper(app, "unthrottled", "/unthrottled", master, workers=2)
+        runner = threading.Thread(target=app.run, daemon=True)
+        runner.start()
+        for _ in range(50):
+            entry = master.registry.snapshot.entries.get("unthrottled")
+            if entry is not None and entry.active:
+                break
+            time.sleep(0.05)
+        
+        client = Client(master.wsgi_app)
+        started = time.monotonic()
+        statuses = [client.get('/unthrottled/ping', buffered=True).status_code for _ in range(150)]
+        elapsed = time.monotonic() - started
+        wrapper.stop()
+        runner.join(timeout=5)
+        
+        self.assertEqual(set(statuses), {200})
+        self.assertGreater(len(statuses) / elapsed, 50)
+
+class TestResponseCorrelator(unittest.TestCase):
+    """响应关联器测试"""
+    
+    def test_complete_matches_request_id(self):
+        """测试响应只会投递给对应request_id的等待者"""
+        from .port_sharing import ResponseCorrelator, AppResponse
+        
+        correlator = ResponseCorrelator()
+        future_a = correlator.register(1)
+        future_b = correlator.register(2)
+        
+        self.assertTrue(correlator.complete(AppResponse(2, 200, [], b"B")))
+        self.assertTrue(future_b.done())
+        self.assertFalse(future_a.done())
+        self.assertEqual(future_b.result().data, b"B")
+        
+        # 已放弃的等待者不会再收到响应
+        correlator.discard(1)
+        self.assertFalse(correlator.complete(AppResponse(1, 200, [], b"A")))
+        self.assertEqual(correlator.pending_count(), 0)
+    
+    def test_request_ids_are_monotonic(self):
+        """测试请求ID单调递增，请求记录没有实例字典"""
+        from .port_sharing import next_request_id, format_request_id, AppRequest, AppResponse
+        
+        first = next_request_id()
+        second = next_request_id()
+        self.assertIsInstance(first, int)
+        self.assertGreater(second, first)
+        self.assertTrue(format_request_id(second).endswith(f"-{second:x}"))
+        
+        self.assertFalse(hasattr(AppRequest(first, "", "GET", "/", {}, b"", ""), '__dict__'))
+        self.assertFalse(hasattr(AppResponse(first, 200, [], b""), '__dict__'))
+
+class TestPrefixTrie(unittest.TestCase):
+    """前缀基数树测试"""
+    
+    def test_longest_match_on_segment_boundaries(self):
+        """测试按路径段的最长前缀匹配"""
+        from .routing import PrefixTrie
+        
+        trie = PrefixTrie()
+        trie.insert("", "root")
+        trie.insert("/api", "api")
+        trie.insert("/api/v1", "v1")
+        trie.insert("/api/v1/admin/tools", "tools")
+        
+        self.assertEqual(trie.longest_match("/api/v1/users"), ("/api/v1", "v1"))
+        self.assertEqual(trie.longest_match("/api/v1"), ("/api/v1", "v1"))
+        self.assertEqual(trie.longest_match("/api/v1/"), ("/api/v1", "v1"))
+        self.assertEqual(trie.longest_match("/api/v1/admin"), ("/api/v1", "v1"))
+        self.assertEqual(trie.longest_match("/api/v1/admin/tools/x"), ("/api/v1/admin/tools", "tools"))
+        self.assertEqual(trie.longest_match("/api/v2"), ("/api", "api"))
+        self.assertEqual(trie.longest_match("/apis"), ("", "root"))
+        self.assertEqual(len(trie), 4)
+    
+    def test_remove_merges_edges(self):
+        """测试删除前缀后其余前缀仍能正确匹配"""
+        from .routing import PrefixTrie
+        
+        trie = PrefixTrie()
+        trie.insert("/a/b/c", 1)
+        trie.insert("/a/b/d", 2)
+        trie.insert("/a", 3)
+        
+        self.assertTrue(trie.remove("/a/b/c"))
+        self.assertFalse(trie.remove("/a/b"))
+        self.assertEqual(trie.longest_match("/a/b/c"), ("/a", 3))
+        self.assertEqual(trie.longest_match("/a/b/d/e"), ("/a/b/d", 2))
+        
+        self.assertTrue(trie.remove("/a"))
+        self.assertIsNone(trie.longest_match("/a/x"))
+        self.assertEqual(sorted(trie.items()), [("/a/b/d", 2)])
+
+class TestRoutingSnapshot(unittest.TestCase):
+    """写时复制路由快照测试"""
+    
+    def test_trie_copy_is_isolated(self):
+        """测试基数树拷贝与原树互不影响"""
+        from .routing import PrefixTrie
+        
+        trie = PrefixTrie()
+        trie.insert("/a/b", 1)
+        clone = trie.copy()
+        trie.insert("/a/c", 2)
+        trie.remove("/a/b")
+        clone.insert("/a/b", 3)
+        
+        self.assertEqual(sorted(trie.items()), [("/a/c", 2)])
+        self.assertEqual(sorted(clone.items()), [("/a/b", 3)])
+    
+    def test_published_snapshot_is_immutable(self):
+        """测试注册、注销和状态变更只替换快照，不修改已发布的快照"""
+        from .port_sharing import AppRegistry
+        
+        registry = AppRegistry()
+        registry.register_app("app1", "/one", Flask("one"))
+        before = registry.snapshot
+        
+        registry.register_app("app2", "/two", Flask("two"))
+        registry.set_app_active("app1", True)
+        registry.unregister_app("app1")
+        
+        self.assertEqual(before.resolve("/one/x").app_id, "app1")
+        self.assertFalse(before.resolve("/one/x").active)
+        self.assertIsNone(before.resolve("/two/x"))
+        
+        after = registry.snapshot
+        self.assertIsNone(after.resolve("/one/x"))
+        self.assertEqual(after.resolve("/two/x").app_id, "app2")
+        self.assertEqual(list(after.entries), ["app2"])
+    
+    def test_trailing_slash_prefixes_are_normalized(self):
+        """测试 "/api" 和 "/api/" 是同一个前缀，重复注册被拒绝，应用看到的路径去掉了前缀"""
+        from flask import request as flask_request
+        from werkzeug.test import Client
+        from .port_sharing import MasterServer, AppWrapper
+        
+        master = MasterServer(port=0)
+        registry = master.registry
+        self.assertTrue(registry.register_app("first", "/api/", Flask("first")))
+        self.assertFalse(registry.register_app("second", "/api", Flask("second")))
+        self.assertEqual(list(registry.apps), ["/api"])
+        self.assertEqual(registry.snapshot.entries["first"].prefix, "/api")
+        self.assertEqual(sorted(prefix for prefix, _ in registry.routes.items()), ["/api"])
+        registry.unregister_app("first")
+        
+        app = Flask("slash")
+        app.add_url_rule('/<path:name>', 'echo', lambda name: f"{flask_request.script_root}|{flask_request.path}")
+        wrapper = AppWrapper(app, "slash", "/slash/", master, dispatch_mode='wsgi')
+        threading.Thread(target=app.run, daemon=True).start()
+        try:
+            for _ in range(50):
+                entry = registry.snapshot.entries.get("slash")
+                if entry is not None and entry.active:
+                    break
+                time.sleep(0.05)
+            response = Client(master.wsgi_app).get('/slash/a/b')
+            self.assertEqual(response.get_data(as_text=True), "/slash|/a/b")
+        finally:
+            wrapper.stop()
+
+class TestPriorityScheduling(unittest.TestCase):
+    """请求优先级通道测试"""
+    
+    def test_strict_and_weighted_dequeue(self):
+        """测试严格优先级与加权轮询的出队顺序，以及各通道的等待统计"""
+        from .scheduling import PriorityRequestQueue
+        
+        strict = PriorityRequestQueue()
+        strict.put_nowait("low", "low")
+        strict.put_nowait("normal")
+        strict.put_nowait("high", "high")
+        self.assertEqual([strict.get(timeout=1) for _ in range(3)], ["high", "normal", "low"])
+        self.assertEqual(strict.get_stats()["high"]["dequeued"], 1)
+        
+        weighted = PriorityRequestQueue(weights={"high": 3, "normal": 1, "low": 1})
+        for i in range(6):
+            weighted.put_nowait(f"h{i}", "high")
+            weighted.put_nowait(f"l{i}", "low")
+        order = [weighted.get(timeout=1) for _ in range(8)]
+        # 低优先级通道按权重获得出队机会，不会被饿死
+        self.assertEqual(sum(item.startswith("l") for item in order), 2)
+        self.assertEqual(weighted.qsize(), 4)
+    
+    def test_classifier_precedence(self):
+        """测试装饰器 > 路由模式 > 请求头的通道选择顺序"""
+        from .scheduling import PriorityClassifier, request_priority
+        
+        app = Flask("priority_app")
+        
+        @app.route('/health')
+        @request_priority('high')
+        def health():
+            return "ok"
+        
+        @app.route('/batch/<job>')
+        def batch(job):
+            return job
+        
+        classifier = PriorityClassifier(app, "/svc", {"/batch/*": "low", "/health": "low"})
+        environ = {'REQUEST_METHOD': 'GET', 'HTTP_X_REQUEST_PRIORITY': 'high'}
+        self.assertEqual(classifier.classify(environ, "/svc/health"), "high")
+        self.assertEqual(classifier.classify(environ, "/svc/batch/1"), "low")
+        self.assertEqual(classifier.classify(environ, "/svc/other"), "high")
+        self.assertEqual(classifier.classify({'REQUEST_METHOD': 'GET'}, "/svc/other"), "normal")
+        
+        with self.assertRaises(ValueError):
+            request_priority('urgent')
+
+class TestFairScheduler(unittest.TestCase):
+    """共享线程池加权公平调度测试"""
+    
+    def test_weighted_fair_order(self):
+        """测试繁忙应用按权重分享线程，不会饿死其他应用"""
+        from .scheduling import FairScheduler, PriorityRequestQueue
+        
+        scheduler = FairScheduler(max_workers=1)
+        busy, quiet = PriorityRequestQueue(), PriorityRequestQueue()
+        scheduler.add_app("busy", busy, lambda item: None, weight=3)
+        scheduler.add_app("quiet", quiet, lambda item: None, weight=1)
+        for i in range(6):
+            busy.put_nowait(("busy", i))
+            quiet.put_nowait(("quiet", i))
+        
+        order = [scheduler.next_request()[1][0] for _ in range(8)]
+        self.assertEqual(order.count("quiet"), 2)
+        self.assertEqual(scheduler.get_stats()["apps"]["busy"]["served"], 6)
+        scheduler.shutdown()
+    
+    def test_shared_pool_serves_apps(self):
+        """测试共享线程池模式下应用不启动专属轮询线程也能处理请求"""
+        from werkzeug.test import Client
+        from .port_sharing import MasterServer, AppWrapper
+        
+        master = MasterServer(shared_workers=2)
+        wrappers = []
+        for name in ("one", "two"):
+            app = Flask(name)
+            app.add_url_rule('/', name, lambda name=name: name)
+            wrappers.append(AppWrapper(app, name, f"/{name}", master, weight=2 if name == "one" else 1))
+            threading.Thread(target=app.run, daemon=True).start()
+        time.sleep(0.5)
+        
+        try:
+            client = Client(master.wsgi_app)
+            self.assertEqual(client.get('/one/').get_data(as_text=True), "one")
+            self.assertEqual(client.get('/two/').get_data(as_text=True), "two")
+            self.assertTrue(all(not wrapper.polling_threads for wrapper in wrappers))
+            
+            stats = client.get('/_master/stats').get_json()['scheduler']
+            self.assertEqual(stats['apps']['one']['weight'], 2)
+            self.assertEqual(stats['apps']['two']['served'], 1)
+            
+            # 准入控制按权重分到的线程数估算排空速率，而不是整个线程池
+            self.assertAlmostEqual(wrappers[0].capacity(), 4 / 3)
+            self.assertAlmostEqual(wrappers[1].capacity(), 2 / 3)
+        finally:
+            for wrapper in wrappers:
+                wrapper.stop()
+            master.dispatcher.scheduler.shutdown()
+    
+    def test_app_joins_pool_before_activation(self):
+        """测试应用先加入共享线程池再设置为活跃，活跃后到达的请求一定有线程池任务处理"""
+        from werkzeug.test import Client
+        from .port_sharing import MasterServer, AppWrapper
+        
+        master = MasterServer(shared_workers=1)
+        scheduler = master.dispatcher.scheduler
+        joined_when_activated = []
+        set_app_active = master.registry.set_app_active
+        
+        def record_activation(app_id, active):
+            joined_when_activated.append(app_id in scheduler.apps)
+            set_app_active(app_id, active)
+        
+        master.registry.set_app_active = record_activation
+        app = Flask("early")
+        app.add_url_rule('/', 'early', lambda: "early")
+        wrapper = AppWrapper(app, "early", "/early", master)
+        threading.Thread(target=app.run, daemon=True).start()
+        try:
+            for _ in range(50):
+                if joined_when_activated:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(joined_when_activated[:1], [True])
+            self.assertEqual(Client(master.wsgi_app).get('/early/').get_data(as_text=True), "early")
+        finally:
+            wrapper.stop()
+            scheduler.shutdown()
+
+def run_remote_app(socket_path):
+    """在子进程中运行一个经Unix域套接字连接主控进程的应用"""
+    import os
+    from .transport import RemoteAppWrapper
+    
+    app = Flask("forked_remote_app")
+    app.add_url_rule('/pid', 'pid', lambda: str(os.getpid()))
+    RemoteAppWrapper(app, "forked", "/forked", socket_path)
+    app.run()
+
+class TestRemoteTransport(unittest.TestCase):
+    """进程外应用传输测试（在同一进程中通过真实的Unix域套接字连接）"""
+    
+    def test_binary_frame_codec(self):
+        """测试帧头部的二进制编解码：请求、响应和控制消息往返一致，损坏的头部被拒绝"""
+        from .codec import CodecError, encode_header, decode_header
+        
+        request = {'type': 'request', 'id': 2 ** 40, 'method': 'POST', 'path': '/app/文件/a%00b',
+                   'query_string': 'q=中文&x=1', 'timeout': 1.5,
+                   'headers': [('Host', 'localhost'), ('X-Empty', ''), ('Cookie', 'a=1; b=2')]}
+        type_code, block = encode_header(request)
+        self.assertNotIn(b'{', block)
+        self.assertEqual(decode_header(type_code, block), request)
+        
+        no_timeout = dict(request, timeout=None, headers=[])
+        self.assertEqual(decode_header(*encode_header(no_timeout)), no_timeout)
+        
+        response = {'type': 'response', 'id': 7, 'status': 404, 'service_time': 0.25,
+                    'headers': [('Content-Type', 'text/plain')]}
+        self.assertEqual(decode_header(*encode_header(response)), response)
+        
+        register = {'type': 'register', 'app_id': 'abc', 'workers': 4, 'priority_rules': None,
+                    'priority_weights': {'high': 6, 'low': 1}, 'ok': True}
+        self.assertEqual(decode_header(*encode_header(register)), register)
+        
+        with self.assertRaises(CodecError):
+            encode_header(dict(response, headers=[('X-Bad', 'a\0b')]))
+        with self.assertRaises(CodecError):
+            decode_header(type_code, block[:10])
+        with self.assertRaises(CodecError):
+            decode_header(99, block)
+    
+    def test_remote_app_over_unix_socket(self):
+        """测试应用经Unix域套接字注册前缀并处理分发的请求，断开后前缀被注销"""
+        import os
+        import tempfile
+        from werkzeug.test import Client
+        from flask import request as flask_request
+        from .port_sharing import MasterServer
+        from .transport import TransportServer, RemoteAppWrapper
+        
+        socket_path = os.path.join(tempfile.mkdtemp(), "master.sock")
+        master = MasterServer()
+        transport = TransportServer(master, socket_path)
+        transport.start()
+        
+        app = Flask("remote_app")
+        
+        @app.route('/echo', methods=['POST'])
+        def echo():
+            return jsonify({"size": len(flask_request.get_data()), "q": flask_request.args.get("q")})
+        
+        wrapper = RemoteAppWrapper(app, "remote", "/remote", socket_path, workers=2)
+        runner = threading.Thread(target=app.run, daemon=True)
+        runner.start()
+        
+        try:
+            for _ in range(50):
+                if "remote" in master.registry.snapshot.entries:
+                    break
+                time.sleep(0.05)
+            
+            client = Client(master.wsgi_app)
+            response = client.post('/remote/echo?q=1', data=b"x" * 100000)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_json(), {"size": 100000, "q": "1"})
+            
+            # 同一前缀不能被第二个进程外应用重复注册
+            duplicate = RemoteAppWrapper(Flask("duplicate"), "duplicate", "/remote", socket_path)
+            with self.assertRaises(RuntimeError):
+                duplicate.connect()
+        finally:
+            wrapper.stop()
+            runner.join(timeout=5)
+        
+        for _ in range(50):
+            if "remote" not in master.registry.snapshot.entries:
+                break
+            time.sleep(0.05)
+        self.assertEqual(Client(master.wsgi_app).post('/remote/echo').status_code, 404)
+        transport.stop()
+    
+    def test_socket_path_in_use_is_not_removed(self):
+        """测试套接字路径上已有主控在监听时拒绝启动且不删除它，残留的套接字文件被清理"""
+        import os
+        import socket
+        import tempfile
+        from .port_sharing import MasterServer
+        from .transport import TransportServer
+        
+        directory = tempfile.mkdtemp()
+        socket_path = os.path.join(directory, "master.sock")
+        first = TransportServer(MasterServer(), socket_path)
+        first.start()
+        try:
+            with self.assertRaises(RuntimeError):
+                TransportServer(MasterServer(), socket_path).start()
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            probe.connect(socket_path)
+            probe.close()
+        finally:
+            first.stop()
+        
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(socket_path)
+        stale.close()
+        second = TransportServer(MasterServer(), socket_path)
+        second.start()
+        second.stop()
+        
+        regular_file = os.path.join(directory, "not-a-socket")
+        open(regular_file, 'w').close()
+        with self.assertRaises(RuntimeError):
+            TransportServer(MasterServer(), regular_file).start()
+        self.assertTrue(os.path.exists(regular_file))
+    
+    def test_remote_app_in_separate_process(self):
+        """测试套接字文件只允许当前用户访问，另一个进程中的应用能注册并处理请求"""
+        import multiprocessing
+        import os
+        import stat
+        import tempfile
+        from werkzeug.test import Client
+        from .port_sharing import MasterServer
+        from .transport import TransportServer
+        
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            self.skipTest("当前平台不支持fork")
+        
+        socket_path = os.path.join(tempfile.mkdtemp(), "master.sock")
+        master = MasterServer()
+        transport = TransportServer(master, socket_path)
+        transport.start()
+        self.addCleanup(transport.stop)
+        self.assertEqual(stat.S_IMODE(os.stat(socket_path).st_mode), 0o600)
+        
+        process = multiprocessing.get_context('fork').Process(target=run_remote_app, args=(socket_path,),
+                                                               daemon=True)
+        process.start()
+        self.addCleanup(process.join, 5)
+        self.addCleanup(process.terminate)
+        
+        client = Client(master.wsgi_app)
+        for _ in range(100):
+            if "forked" in master.registry.snapshot.entries:
+                break
+            time.sleep(0.05)
+        response = client.get('/forked/pid', buffered=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(int(response.get_data(as_text=True)), process.pid)
+        
+        # 应用进程退出后前缀被注销
+        process.terminate()
+        process.join(timeout=5)
+        for _ in range(100):
+            if "forked" not in master.registry.snapshot.entries:
+                break
+            time.sleep(0.05)
+        self.assertEqual(client.get('/forked/pid', buffered=True).status_code, 404)
+    
+    def test_remote_app_over_shared_memory(self):
+        """测试注册后请求和响应改走共享内存环形缓冲区，超过缓冲区容量的消息体分段传输"""
+        import os
+        import tempfile
+        from werkzeug.test import Client
+        from flask import request as flask_request
+        from .port_sharing import MasterServer
+        from .shm_transport import ShmChannel, shm_supported
+        from .transport import TransportServer, RemoteAppWrapper
+        
+        if not shm_supported():
+            self.skipTest("当前平台不支持共享内存传输")
+        
+        socket_path = os.path.join(tempfile.mkdtemp(), "master.sock")
+        master = MasterServer()
+        transport = TransportServer(master, socket_path)
+        transport.start()
+        
+        app = Flask("shm_app")
+        
+        @app.route('/reverse', methods=['POST'])
+        def reverse():
+            return flask_request.get_data()[::-1]
+        
+        wrapper = RemoteAppWrapper(app, "shm", "/shm", socket_path, transport="shm")
+        runner = threading.Thread(target=app.run, daemon=True)
+        runner.start()
+        
+        try:
+            for _ in range(50):
+                # 主控登记前缀时应用进程一侧可能还没有接上共享内存通道
+                if "shm" in master.registry.snapshot.entries and wrapper.running:
+                    break
+                time.sleep(0.05)
+            self.assertIsInstance(wrapper.channel, ShmChannel)
+            
+            payload = os.urandom(6 * 1024 * 1024)
+            response = Client(master.wsgi_app).post('/shm/reverse', data=payload)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_data(), payload[::-1])
+        finally:
+            wrapper.stop()
+            runner.join(timeout=5)
+            transport.stop()
+
+class TestReverseProxy(unittest.TestCase):
+    """反向代理模式测试（应用在临时端口上运行自己的服务器）"""
+    
+    def test_connection_pool_reuse_cap_and_eviction(self):
+        """测试连接池复用空闲连接、遵守连接数上限并回收空闲过久的连接"""
+        from .proxy import UpstreamConnectionPool, PoolTimeout, start_upstream_server
+        
+        app = Flask("pool_upstream")
+        app.add_url_rule('/ping', 'ping', lambda: "pong")
+        server, _ = start_upstream_server(app, "")
+        pool = UpstreamConnectionPool('127.0.0.1', server.server_port, max_connections=2, idle_timeout=0.2)
+        try:
+            for _ in range(3):
+                pooled = pool.acquire(timeout=1)
+                pooled.connection.request('GET', '/ping')
+                response = pooled.connection.getresponse()
+                self.assertEqual(response.read(), b"pong")
+                pool.release(pooled, not response.will_close)
+            self.assertEqual(pool.get_stats()['created'], 1)
+            self.assertEqual(pool.get_stats()['reused'], 2)
+            
+            first, second = pool.acquire(timeout=1), pool.acquire(timeout=1)
+            with self.assertRaises(PoolTimeout):
+                pool.acquire(timeout=0.1)
+            pool.release(first)
+            pool.release(second)
+            
+            time.sleep(0.3)
+            self.assertEqual(pool.evict_idle(), 2)
+            self.assertEqual(pool.get_stats()['open'], 0)
+        finally:
+            pool.close()
+            server.shutdown()
+            server.server_close()
+    
+    def test_proxy_mode_forwards_over_keepalive_connections(self):
+        """测试请求经持久连接转发给应用自己的服务器，上游停止后健康检查使转发直接返回502"""
+        from werkzeug.test import Client
+        from flask import request as flask_request, url_for
+        from .port_sharing import MasterServer
+        from .proxy import ProxyAppWrapper
+        
+        master = MasterServer()
+        app = Flask("proxy_app")
+        
+        @app.route('/echo', methods=['GET', 'POST'])
+        def echo():
+            return jsonify({"body": flask_request.get_data(as_text=True), "q": flask_request.args.get("q"),
+                            "self": url_for('echo')})
+        
+        wrapper = ProxyAppWrapper(app, "proxy", "/proxy", master, workers=2, health_check_interval=0.1)
+        runner = threading.Thread(target=app.run, daemon=True)
+        runner.start()
+        try:
+            for _ in range(50):
+                if wrapper.running:
+                    break
+                time.sleep(0.05)
+            
+            client = Client(master.wsgi_app)
+            for index in range(5):
+                response = client.post(f'/proxy/echo?q=中{index}', data=f"payload-{index}")
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.get_json(), {"body": f"payload-{index}", "q": f"中{index}",
+                                                       "self": "/proxy/echo"})
+            
+            stats = master.upstreams["proxy"].get_stats()
+            self.assertLessEqual(stats['created'], 2)
+            self.assertGreaterEqual(stats['reused'], 3)
+            
+            wrapper.server.shutdown()
+            wrapper.server.server_close()
+            for _ in range(50):
+                if not wrapper.upstream.healthy:
+                    break
+                time.sleep(0.05)
+            self.assertFalse(master.registry.snapshot.entries["proxy"].active)
+            self.assertEqual(client.get('/proxy/echo').status_code, 502)
+        finally:
+            wrapper.stop()
+            runner.join(timeout=5)
+    
+    def test_stale_connection_retry_only_for_idempotent_methods(self):
+        """测试复用的连接已被上游关闭时只重试幂等请求，POST直接返回502"""
+        import http.client
+        from .port_sharing import AppRequest
+        from .proxy import UpstreamProxy, start_upstream_server
+        
+        app = Flask("retry_upstream")
+        app.add_url_rule('/ping', 'ping', lambda: "pong", methods=['GET', 'POST'])
+        server, _ = start_upstream_server(app, "")
+        proxy = UpstreamProxy("retry", "", '127.0.0.1', server.server_port)
+        send = proxy.send
+        
+        def send_on_stale(pooled, *args):
+            if pooled.requests:
+                raise http.client.RemoteDisconnected("上游已关闭连接")
+            return send(pooled, *args)
+        
+        def forward(method):
+            app_request = AppRequest(1, "", method, "/ping", {}, b'', '')
+            response = proxy.forward(app_request)
+            if response.body is not None:
+                return response.status_code, b"".join(response.body)
+            return response.status_code, response.data
+        
+        try:
+            self.assertEqual(forward('GET'), (200, b"pong"))
+            proxy.send = send_on_stale
+            self.assertEqual(forward('POST')[0], 502)
+            self.assertEqual(proxy.retries, 0)
+            
+            proxy.send = send
+            self.assertEqual(forward('GET'), (200, b"pong"))
+            proxy.send = send_on_stale
+            self.assertEqual(forward('GET'), (200, b"pong"))
+            self.assertEqual(proxy.retries, 1)
+        finally:
+            proxy.pool.close()
+            server.shutdown()
+            server.server_close()
+    
+    def test_proxy_transport_from_separate_process(self):
+        """测试应用经Unix域套接字登记自己服务器的端口，主控断开后注销前缀"""
+        import os
+        import tempfile
+        from werkzeug.test import Client
+        from .port_sharing import MasterServer
+        from .transport import TransportServer, RemoteAppWrapper
+        
+        socket_path = os.path.join(tempfile.mkdtemp(), "master.sock")
+        master = MasterServer()
+        transport = TransportServer(master, socket_path)
+        transport.start()
+        
+        app = Flask("remote_proxy_app")
+        app.add_url_rule('/hello', 'hello', lambda: "hello")
+        wrapper = RemoteAppWrapper(app, "remote_proxy", "/rp", socket_path, workers=2, transport="proxy")
+        runner = threading.Thread(target=app.run, daemon=True)
+        runner.start()
+        try:
+            for _ in range(50):
+                if "remote_proxy" in master.upstreams and wrapper.running:
+                    break
+                time.sleep(0.05)
+            client = Client(master.wsgi_app)
+            for _ in range(3):
+                response = client.get('/rp/hello')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.data, b"hello")
+            self.assertEqual(master.upstreams["remote_proxy"].get_stats()['created'], 1)
+        finally:
+            wrapper.stop()
+            runner.join(timeout=5)
+        
+        for _ in range(50):
+            if "remote_proxy" not in master.registry.snapshot.entries:
+                break
+            time.sleep(0.05)
+        self.assertNotIn("remote_proxy", master.upstreams)
+        self.assertEqual(Client(master.wsgi_app).get('/rp/hello').status_code, 404)
+        transport.stop()
+
+class MasterEngineProtocolTests:
+    """内置主控服务器引擎共用的HTTP/1.1协议测试，子类通过 engine 指定引擎"""
+    
+    engine = None
+    
+    def start_master(self, app, prefix, disconnect_on_eof=True, **engine_options):
+        from .port_sharing import MasterServer, AppWrapper
+        
+        master = MasterServer(port=0, engine=self.engine, engine_options=engine_options,
+                              disconnect_on_eof=disconnect_on_eof)
+        master.start()
+        self.addCleanup(master.stop)
+        AppWrapper(app, prefix.strip('/'), prefix, master)
+        threading.Thread(target=app.run, daemon=True).start()
+        for _ in range(50):
+            entry = master.registry.snapshot.entries.get(prefix.strip('/'))
+            if entry is not None and entry.active:
+                break
+            time.sleep(0.05)
+        return master, master.server.server_port
+    
+    @staticmethod
+    def read_until_closed(sock) -> bytes:
+        data = b''
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return data
+            data += chunk
+    
+    def test_half_closed_client_gets_response(self):
+        """测试 disconnect_on_eof=False 时客户端关闭写方向后等待响应期间不被当作断开"""
+        import socket
+        
+        app = Flask("engine_half_close_app")
+        
+        @app.route('/slow')
+        def slow():
+            time.sleep(0.8)
+            return "done"
+        
+        master, port = self.start_master(app, "/half", disconnect_on_eof=False)
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.sendall(b"GET /half/slow HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+        sock.shutdown(socket.SHUT_WR)
+        sock.settimeout(5)
+        data = self.read_until_closed(sock)
+        sock.close()
+        self.assertTrue(data.startswith(b"HTTP/1.1 200 OK"))
+        self.assertTrue(data.endswith(b"done"))
+    
+    def test_closed_client_cancels_request(self):
+        """测试客户端正常关闭连接（FIN）后处理中的请求可以感知取消"""
+        import socket
+        from . import is_request_cancelled
+        
+        app = Flask("engine_close_app")
+        observed = threading.Event()
+        
+        @app.route('/slow')
+        def slow():
+            for _ in range(60):
+                if is_request_cancelled():
+                    observed.set()
+                    break
+                time.sleep(0.05)
+            return "done"
+        
+        master, port = self.start_master(app, "/close")
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.sendall(b"GET /close/slow HTTP/1.1\r\nHost: x\r\n\r\n")
+        time.sleep(0.2)
+        sock.close()
+        self.assertTrue(observed.wait(3))
+    
+    def test_non_ascii_content_length_rejected(self):
+        """测试Content-Length中的非ASCII数字返回400，只关闭这个连接，服务器继续处理其他连接"""
+        import socket
+        
+        app = Flask("engine_length_app")
+        app.add_url_rule('/ping', 'ping', lambda: "pong")
+        
+        master, port = self.start_master(app, "/length")
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.sendall(b"POST /length/ping HTTP/1.1\r\nHost: x\r\nContent-Length: \xb2\r\n\r\n")
+        sock.settimeout(5)
+        data = self.read_until_closed(sock)
+        sock.close()
+        self.assertTrue(data.startswith(b"HTTP/1.1 400"))
+        
+        response = requests.get(f"http://127.0.0.1:{port}/length/ping", timeout=5)
+        self.assertEqual(response.text, "pong")
+    
+    def test_invalid_chunk_size_rejected(self):
+        """测试负数、带下划线或过长的分块长度返回400，较大的分块被完整接收"""
+        import socket
+        from flask import request as flask_request
+        
+        app = Flask("engine_chunk_app")
+        app.add_url_rule('/size', 'size', lambda: str(len(flask_request.get_data())), methods=['POST'])
+        
+        master, port = self.start_master(app, "/chunk")
+        for size_line in (b"-1", b"1_0", b"1" * 17):
+            sock = socket.create_connection(('127.0.0.1', port))
+            sock.sendall(b"POST /chunk/size HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n"
+                         + size_line + b"\r\nx\r\n0\r\n\r\n")
+            sock.settimeout(5)
+            data = self.read_until_closed(sock)
+            sock.close()
+            self.assertTrue(data.startswith(b"HTTP/1.1 400"), size_line)
+        
+        response = requests.post(f"http://127.0.0.1:{port}/chunk/size",
+                                 data=iter([b"x" * (1024 * 1024), b"y" * 10]), timeout=10)
+        self.assertEqual(response.text, str(1024 * 1024 + 10))
+    
+    def test_keepalive_pipelining_chunked_and_header_timeout(self):
+        """测试持久连接上的流水线请求按顺序响应，分块请求体被解码，请求头超时后关闭连接"""
+        import socket
+        from flask import request as flask_request
+        
+        app = Flask("async_protocol_app")
+        
+        @app.route('/echo', methods=['GET', 'POST'])
+        def echo():
+            return flask_request.args.get('q', '') + flask_request.get_data(as_text=True)
+        
+        master, port = self.start_master(app, "/proto", header_timeout=0.3)
+        
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.sendall(b"GET /proto/echo?q=a HTTP/1.1\r\nHost: x\r\n\r\n"
+                     b"POST /proto/echo?q=b HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n"
+                     b"3\r\n-xy\r\n2\r\nz!\r\n0\r\n\r\n"
+                     b"GET /proto/echo?q=c HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+        data = self.read_until_closed(sock)
+        sock.close()
+        self.assertEqual(data.count(b"HTTP/1.1 200 OK"), 3)
+        bodies = [part.split(b"\r\n\r\n", 1)[1] for part in data.split(b"HTTP/1.1 ")[1:]]
+        self.assertEqual(bodies, [b"a", b"b-xyz!", b"c"])
+        
+        session = requests.Session()
+        for q in ("1", "2"):
+            self.assertEqual(session.get(f"http://127.0.0.1:{port}/proto/echo", params={"q": q}).text, q)
+        self.assertEqual(master.server.connection_count, 1)
+        
+        slow = socket.create_connection(('127.0.0.1', port))
+        slow.sendall(b"GET /proto/echo HTTP/1.1\r\n")
+        slow.settimeout(3)
+        started = time.monotonic()
+        self.assertEqual(self.read_until_closed(slow), b"")
+        self.assertLess(time.monotonic() - started, 2)
+        slow.close()
+
+class TestAsyncMasterEngine(MasterEngineProtocolTests, unittest.TestCase):
+    """asyncio主控服务器引擎测试"""
+    
+    engine = 'asyncio'
+    
+    def test_slow_clients_do_not_consume_threads(self):
+        """测试大量慢客户端和等待中的请求不会各占一个线程"""
+        import socket
+        
+        app = Flask("async_slow_app")
+        gate = threading.Event()
+        
+        @app.route('/wait/<int:n>')
+        def wait(n):
+            gate.wait(10)
+            return str(n)
+        
+        master, port = self.start_master(app, "/slow")
+        baseline = threading.active_count()
+        
+        # 只发送一半请求头的慢客户端，以及在应用处理完之前一直等待响应的请求
+        idle = [socket.create_connection(('127.0.0.1', port)) for _ in range(200)]
+        waiting = [socket.create_connection(('127.0.0.1', port)) for _ in range(10)]
+        try:
+            for sock in idle:
+                sock.sendall(b"GET /slow/wait/0 HTTP/1.1\r\nHost: ")
+            for n, sock in enumerate(waiting):
+                sock.sendall(f"GET /slow/wait/{n} HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n".encode())
+            for _ in range(50):
+                if master.server.connection_count == 210:
+                    break
+                time.sleep(0.05)
+            self.assertEqual(master.server.connection_count, 210)
+            self.assertLess(threading.active_count() - baseline, 5)
+            
+            response = requests.get(f"http://127.0.0.1:{port}/_master/health", timeout=5)
+            self.assertEqual(response.status_code, 200)
+            
+            gate.set()
+            for n, sock in enumerate(waiting):
+                response = self.read_until_closed(sock)
+                self.assertTrue(response.startswith(b"HTTP/1.1 200 OK"))
+                self.assertTrue(response.endswith(str(n).encode()))
+        finally:
+            gate.set()
+            for sock in idle + waiting:
+                sock.close()
+
+class TestSelectorMasterEngine(MasterEngineProtocolTests, unittest.TestCase):
+    """selectors主控服务器引擎测试"""
+    
+    engine = 'selectors'
+    
+    def test_bounded_handler_pool(self):
+        """测试慢客户端不占用处理线程，处理中的请求数超过上限时直接返回503"""
+        import socket
+        
+        app = Flask("selector_pool_app")
+        gate = threading.Event()
+        
+        @app.route('/wait/<int:n>')
+        def wait(n):
+            gate.wait(10)
+            return str(n)
+        
+        master, port = self.start_master(app, "/pool", handler_threads=2, max_pending=2)
+        baseline = threading.active_count()
+        
+        idle = [socket.create_connection(('127.0.0.1', port)) for _ in range(200)]
+        waiting = [socket.create_connection(('127.0.0.1', port)) for _ in range(2)]
+        try:
+            for sock in idle:
+                sock.sendall(b"GET /pool/wait/0 HTTP/1.1\r\nHost: ")
+            for n, sock in enumerate(waiting):
+                sock.sendall(f"GET /pool/wait/{n} HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n".encode())
+            for _ in range(50):
+                if master.server.connection_count == 202 and master.server.pending == 2:
+                    break
+                time.sleep(0.05)
+            self.assertEqual(master.server.connection_count, 202)
+            self.assertLessEqual(threading.active_count() - baseline, 2)
+            
+            rejected = socket.create_connection(('127.0.0.1', port))
+            rejected.sendall(b"GET /pool/wait/9 HTTP/1.1\r\nHost: x\r\n\r\n")
+            self.assertTrue(self.read_until_closed(rejected).startswith(b"HTTP/1.1 503"))
+            rejected.close()
+            
+            gate.set()
+            for n, sock in enumerate(waiting):
+                response = self.read_until_closed(sock)
+                self.assertTrue(response.startswith(b"HTTP/1.1 200 OK"))
+                self.assertTrue(response.endswith(str(n).encode()))
+        finally:
+            gate.set()
+            for sock in idle + waiting:
+                sock.close()
+    
+    def test_pipelined_responses_stay_in_order(self):
+        """测试流水线请求中较慢的请求不会让后面请求的响应提前写出"""
+        import socket
+        
+        app = Flask("selector_order_app")
+        
+        @app.route('/sleep/<float:seconds>')
+        def sleep(seconds):
+            time.sleep(seconds)
+            return str(seconds)
+        
+        master, port = self.start_master(app, "/order")
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.sendall(b"".join(
+            f"GET /order/sleep/{seconds} HTTP/1.1\r\nHost: x\r\n\r\n".encode()
+            for seconds in ("0.3", "0.0", "0.1")
+        ) + b"GET /order/sleep/0.0 HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+        data = self.read_until_closed(sock)
+        sock.close()
+        bodies = [part.split(b"\r\n\r\n", 1)[1] for part in data.split(b"HTTP/1.1 ")[1:]]
+        self.assertEqual(bodies, [b"0.3", b"0.0", b"0.1", b"0.0"])
+    
+    def test_error_response_queued_after_inflight_response(self):
+        """测试流水线中的无效请求在前面的请求处理中时到达，错误响应排在它的响应之后写出"""
+        import socket
+        
+        app = Flask("selector_reject_app")
+        
+        @app.route('/sleep/<float:seconds>')
+        def sleep(seconds):
+            time.sleep(seconds)
+            return str(seconds)
+        
+        master, port = self.start_master(app, "/reject")
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.sendall(b"GET /reject/sleep/0.3 HTTP/1.1\r\nHost: x\r\n\r\nBAD\r\n\r\n")
+        sock.settimeout(5)
+        data = self.read_until_closed(sock)
+        sock.close()
+        responses = data.split(b"HTTP/1.1 ")[1:]
+        self.assertEqual(len(responses), 2)
+        self.assertTrue(responses[0].startswith(b"200 OK"))
+        self.assertTrue(responses[0].endswith(b"0.3"))
+        self.assertTrue(responses[1].startswith(b"400"))
+    
+    def test_non_reading_client_releases_handler_thread(self):
+        """测试不读取响应的客户端在写出超时后被关闭，不会一直占用处理线程"""
+        import socket
+        from flask import Response as FlaskResponse
+        
+        app = Flask("selector_slow_reader_app")
+        
+        @app.route('/stream')
+        def stream():
+            return FlaskResponse(b"x" * 65536 for _ in range(400))
+        
+        @app.route('/ping')
+        def ping():
+            return "pong"
+        
+        master, port = self.start_master(app, "/slow", handler_threads=1, idle_timeout=0.5)
+        stalled = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        stalled.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        stalled.connect(('127.0.0.1', port))
+        try:
+            stalled.sendall(b"GET /slow/stream HTTP/1.1\r\nHost: x\r\n\r\n")
+            time.sleep(0.2)
+            
+            started = time.monotonic()
+            client = socket.create_connection(('127.0.0.1', port))
+            client.settimeout(10)
+            client.sendall(b"GET /slow/ping HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+            response = self.read_until_closed(client)
+            client.close()
+            self.assertTrue(response.startswith(b"HTTP/1.1 200 OK"))
+            self.assertTrue(response.endswith(b"pong"))
+            self.assertLess(time.monotonic() - started, 5)
+        finally:
+            stalled.close()
+
+def create_prefork_apps():
+    """预派生子进程中创建的应用（子进程以spawn方式启动，工厂函数必须在模块级定义）"""
+    import os
+    
+    app = Flask("prefork_app")
+    app.add_url_rule('/pid', 'pid', lambda: str(os.getpid()))
+    enable_port_sharing(app, prefix="/prefork")
+    return [app]
+
+class TestPreforkMaster(unittest.TestCase):
+    """预派生多进程主控服务器测试"""
+    
+    def test_children_share_port_and_restart(self):
+        """测试多个子进程绑定同一端口，崩溃的子进程被监督者重启"""
+        import os
+        import signal
+        import socket
+        from .prefork import PreforkMaster
+        
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            self.skipTest("当前平台不支持SO_REUSEPORT")
+        
+        port = 5093
+        master = PreforkMaster(create_prefork_apps, port=port, processes=2, restart_delay=0.2)
+        master.start()
+        
+        def serving_pids(attempts=40):
+            pids = set()
+            for _ in range(attempts):
+                try:
+                    # 每次新建连接，内核按连接把请求分给不同的子进程
+                    response = requests.get(f"http://127.0.0.1:{port}/prefork/pid",
+                                            headers={'Connection': 'close'}, timeout=5)
+                    if response.status_code == 200:
+                        pids.add(int(response.text))
+                except requests.ConnectionError:
+                    time.sleep(0.1)
+            return pids
+        
+        def wait_until_serving(expected):
+            # spawn启动的子进程需要重新导入模块，启动时间比fork长
+            pids = set()
+            for _ in range(10):
+                pids = serving_pids()
+                if expected <= pids:
+                    break
+                time.sleep(0.5)
+            return pids
+        
+        try:
+            children = {child.pid for child in master.children}
+            self.assertEqual(wait_until_serving(children), children)
+            
+            crashed = master.children[0].pid
+            os.kill(crashed, signal.SIGKILL)
+            for _ in range(50):
+                if master.children[0].pid not in (None, crashed):
+                    break
+                time.sleep(0.1)
+            self.assertNotEqual(master.children[0].pid, crashed)
+            self.assertEqual(master.children[0].restarts, 1)
+            
+            pids = wait_until_serving({master.children[0].pid})
+            self.assertNotIn(crashed, pids)
+            self.assertIn(master.children[0].pid, pids)
+        finally:
+            master.stop()
+
+CLUSTER_TEST_SECRET = 'cluster-test-secret'
+
+def run_cluster_node(seed, prefixes, ports):
+    """在子进程中运行一个集群节点，提供 prefixes 中的应用，通过 ports 报告 (进程ID, 监听端口)"""
+    import os
+    from .port_sharing import MasterServer, AppWrapper
+    
+    master = MasterServer(port=0, cluster_peers=[seed],
+                          cluster_options={'heartbeat_interval': 0.2, 'peer_timeout': 1.0,
+                                           'secret': CLUSTER_TEST_SECRET})
+    master.start()
+    for prefix in prefixes:
+        app = Flask(f"cluster{prefix.replace('/', '_')}")
+        app.add_url_rule('/pid', 'pid', lambda: str(os.getpid()))
+        AppWrapper(app, prefix.strip('/'), prefix, master)
+        threading.Thread(target=app.run, daemon=True).start()
+    ports.put((os.getpid(), master.server.server_port))
+    while True:
+        time.sleep(1)
+
+class TestMasterCluster(unittest.TestCase):
+    """多节点主控集群测试：节点运行在本机的不同进程中"""
+    
+    def test_shared_routing_table_survives_node_loss(self):
+        """测试节点互相转发对方的应用，节点离线后路由切换到其他节点"""
+        import multiprocessing
+        from .port_sharing import MasterServer, FORWARDED_NODE_HEADER
+        
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            self.skipTest("当前平台不支持fork")
+        context = multiprocessing.get_context('fork')
+        
+        master = MasterServer(port=0, cluster_peers=[],
+                              cluster_options={'heartbeat_interval': 0.2, 'peer_timeout': 1.0,
+                                               'secret': CLUSTER_TEST_SECRET})
+        master.start()
+        self.addCleanup(master.stop)
+        seed = f"127.0.0.1:{master.server.server_port}"
+        base_url = f"http://{seed}"
+        
+        ports = context.Queue()
+        nodes = [
+            context.Process(target=run_cluster_node, args=(seed, ['/shared', f'/node{index}'], ports),
+                            daemon=True)
+            for index in range(2)
+        ]
+        for node in nodes:
+            node.start()
+            self.addCleanup(node.join, 5)
+            self.addCleanup(node.terminate)
+        reported = dict(ports.get(timeout=10) for _ in nodes)
+        node_ports = [reported[node.pid] for node in nodes]
+        
+        def wait_for(path, accept, attempts=100):
+            response = None
+            for _ in range(attempts):
+                response = requests.get(f"{base_url}{path}", timeout=5)
+                if accept(response):
+                    break
+                time.sleep(0.1)
+            return response
+        
+        # 没有本地应用的种子节点转发到各个节点的应用
+        for index, node in enumerate(nodes):
+            response = wait_for(f'/node{index}/pid', lambda response: response.status_code == 200)
+            self.assertEqual(int(response.text), node.pid)
+        owner = int(wait_for('/shared/pid', lambda response: response.status_code == 200).text)
+        self.assertIn(owner, [node.pid for node in nodes])
+        
+        # 节点之间通过种子节点互相发现，子节点也能转发另一个子节点的应用
+        response = requests.get(f"http://127.0.0.1:{node_ports[0]}/node1/pid", timeout=5)
+        for _ in range(50):
+            if response.status_code == 200:
+                break
+            time.sleep(0.1)
+            response = requests.get(f"http://127.0.0.1:{node_ports[0]}/node1/pid", timeout=5)
+        self.assertEqual(int(response.text), nodes[1].pid)
+        
+        # 已经被转发过的请求不会再次转发
+        response = requests.get(f"{base_url}/node0/pid", headers={FORWARDED_NODE_HEADER: 'other'})
+        self.assertEqual(response.status_code, 508)
+        
+        # 提供 /shared 的节点离线后，请求切换到另一个节点，离线节点独有的前缀被移除
+        lost = next(index for index, node in enumerate(nodes) if node.pid == owner)
+        survivor = nodes[1 - lost]
+        nodes[lost].terminate()
+        nodes[lost].join(timeout=5)
+        response = wait_for('/shared/pid', lambda response: response.text == str(survivor.pid))
+        self.assertEqual(int(response.text), survivor.pid)
+        self.assertEqual(wait_for(f'/node{lost}/pid', lambda response: response.status_code == 404).status_code, 404)
+        
+        stats = requests.get(f"{base_url}/_master/cluster").json()
+        alive = {peer['address']: peer['alive'] for peer in stats['peers']}
+        self.assertFalse(alive[f"127.0.0.1:{node_ports[lost]}"])
+        self.assertTrue(alive[f"127.0.0.1:{node_ports[1 - lost]}"])
+    
+    def test_sync_requires_shared_secret(self):
+        """测试没有签名或签名密钥不同的同步消息被拒绝，不会注入节点和路由"""
+        import json
+        from .cluster import CLUSTER_SIGNATURE_HEADER, sign_message, verify_message
+        from .port_sharing import MasterServer
+        
+        with self.assertRaises(ValueError):
+            MasterServer(port=0, cluster_peers=[])
+        
+        master = MasterServer(port=0, cluster_peers=[], cluster_options={'secret': CLUSTER_TEST_SECRET})
+        master.start()
+        self.addCleanup(master.stop)
+        url = f"http://127.0.0.1:{master.server.server_port}/_master/cluster"
+        
+        def sync(address, secret=None, timestamp=None):
+            body = json.dumps({'node_id': address, 'address': address, 'peers': [],
+                               'routes': [{'prefix': '/stolen', 'app_id': 'stolen'}]}).encode()
+            headers = {'Content-Type': 'application/json'}
+            if secret is not None:
+                headers[CLUSTER_SIGNATURE_HEADER] = sign_message(secret, body, timestamp)
+            return requests.post(url, data=body, headers=headers, timeout=5)
+        
+        self.assertEqual(sync('10.0.0.1:5000').status_code, 403)
+        self.assertEqual(sync('10.0.0.2:5000', 'wrong-secret').status_code, 403)
+        self.assertEqual(sync('10.0.0.3:5000', CLUSTER_TEST_SECRET, time.time() - 3600).status_code, 403)
+        self.assertEqual(master.cluster.get_stats()['peers'], [])
+        
+        response = sync('10.0.0.4:5000', CLUSTER_TEST_SECRET)
+        self.assertEqual(response.status_code, 200)
+        verify_message(CLUSTER_TEST_SECRET, response.content, response.headers[CLUSTER_SIGNATURE_HEADER])
+        self.assertEqual([peer['address'] for peer in master.cluster.get_stats()['peers']], ['10.0.0.4:5000'])
+
+class TestHotReload(unittest.TestCase):
+    """应用热替换测试"""
+    
+    def start_app(self, app, **options):
+        from .port_sharing import MasterServer, AppWrapper
+        
+        master = MasterServer(port=0)
+        master.start()
+        self.addCleanup(master.stop)
+        wrapper = AppWrapper(app, "reload", "/reload", master, **options)
+        runner = threading.Thread(target=app.run, daemon=True)
+        runner.start()
+        for _ in range(50):
+            if "reload" in master.wrappers:
+                break
+            time.sleep(0.05)
+        return master, wrapper, runner
+    
+    @staticmethod
+    def versioned_app(version, slow_started=None):
+        app = Flask(f"reload_{version}")
+        app.add_url_rule('/version', 'version', lambda: version)
+        
+        def slow():
+            if slow_started is not None:
+                slow_started.set()
+            time.sleep(0.5)
+            return f"{version}-slow"
+        app.add_url_rule('/slow', 'slow', slow)
+        return app
+    
+    def test_swap_without_errors_and_drain(self):
+        """测试替换期间请求不出错，旧实例处理完在途请求，排队的请求由新实例处理"""
+        slow_started = threading.Event()
+        old_app = self.versioned_app("v1", slow_started)
+        master, wrapper, runner = self.start_app(old_app, workers=2)
+        base_url = f"http://127.0.0.1:{master.server.server_port}/reload"
+        
+        warmed = []
+        new_app = self.versioned_app("v2")
+        
+        @new_app.before_request
+        def record_request():
+            warmed.append(time.monotonic())
+        
+        slow_result = []
+        slow_client = threading.Thread(
+            target=lambda: slow_result.append(requests.get(f"{base_url}/slow", timeout=5).text))
+        slow_client.start()
+        self.assertTrue(slow_started.wait(5))
+        
+        results = []
+        stop = threading.Event()
+        
+        def client():
+            with requests.Session() as session:
+                while not stop.is_set():
+                    response = session.get(f"{base_url}/version", timeout=5)
+                    results.append((response.status_code, response.text))
+                    time.sleep(0.05)
+        
+        poller = threading.Thread(target=client)
+        poller.start()
+        time.sleep(0.3)
+        successor = wrapper.hot_swap(new_app, warmup_paths=['/version'])
+        swapped_at = time.monotonic()
+        time.sleep(0.3)
+        stop.set()
+        poller.join(timeout=5)
+        slow_client.join(timeout=5)
+        
+        # 在途的慢请求由旧实例处理完，替换期间没有失败的请求
+        self.assertEqual(slow_result, ["v1-slow"])
+        self.assertTrue(results)
+        self.assertEqual({status for status, _ in results}, {200})
+        versions = [text for _, text in results]
+        self.assertEqual(versions[0], "v1")
+        self.assertEqual(versions[-1], "v2")
+        first_new = versions.index("v2")
+        self.assertEqual(set(versions[first_new:]), {"v2"})
+        self.assertTrue(warmed and warmed[0] < swapped_at)
+        
+        # 旧实例已释放，前缀由新实例接管；新实例停止时才注销
+        self.assertIs(master.wrappers["reload"], successor)
+        self.assertFalse(any(thread.is_alive() for thread in wrapper.polling_threads))
+        self.assertEqual(master.registry.snapshot.entries["reload"].request_queue, successor.request_queue)
+        self.assertTrue(runner.is_alive())
+        successor.stop()
+        runner.join(timeout=5)
+        self.assertFalse(runner.is_alive())
+        self.assertNotIn("reload", master.registry.snapshot.entries)
+    
+    def test_failed_warm_up_keeps_old_instance(self):
+        """测试新实例预热失败时不替换，旧实例继续服务"""
+        master, wrapper, runner = self.start_app(self.versioned_app("v1"))
+        self.addCleanup(wrapper.stop)
+        broken = Flask("reload_broken")
+        
+        @broken.route('/version')
+        def version():
+            raise RuntimeError("broken")
+        
+        with self.assertRaises(RuntimeError):
+            wrapper.hot_swap(broken, warmup_paths=['/version'])
+        with self.assertRaises(ValueError):
+            reload_app("missing", broken)
+        self.assertIs(master.wrappers["reload"], wrapper)
+        response = requests.get(f"http://127.0.0.1:{master.server.server_port}/reload/version", timeout=5)
+        self.assertEqual(response.text, "v1")
+
+class TestMasterWsgiEntry(unittest.TestCase):
+    """主控服务器WSGI入口测试"""
+    
+    def test_admin_and_app_routing(self):
+        """测试管理路由交给Flask，其余请求直接交给分发器"""
+        from werkzeug.test import Client
+        from .port_sharing import MasterServer
+        
+        master = MasterServer()
+        client = Client(master.wsgi_app)
+        
+        response = client.get('/_master/health')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['registered_apps'], 0)
+        
+        response = client.get('/unknown/path')
+        self.assertEqual(response.status_code, 404)
+    
+    def test_defaults_come_from_config(self):
+        """测试主控服务器、应用包装器和准入控制的默认值取自配置（可由环境变量覆盖）"""
+        from .config import Config
+        from .performance import PerformanceOptimizer
+        from .port_sharing import MasterServer, AppWrapper
+        
+        master = MasterServer(port=0)
+        self.assertEqual(master.dispatcher.request_timeout, Config.REQUEST_TIMEOUT)
+        self.assertEqual(master.dispatcher.body_spool_threshold, Config.BODY_SPOOL_THRESHOLD)
+        self.assertEqual(master.dispatcher.enable_tracing, Config.ENABLE_REQUEST_TRACING)
+        self.assertEqual(AppWrapper(Flask("defaults"), "defaults", "/defaults", master).workers,
+                         max(1, Config.APP_WORKERS))
+        self.assertEqual(PerformanceOptimizer().admission.max_queue_wait, Config.MAX_QUEUE_WAIT)
+    
+    def test_wsgi_input_detached_after_timeout(self):
+        """测试直通模式下主控服务器超时返回504后，应用不能再读取已被收回的请求体"""
+        from flask import request as flask_request
+        from werkzeug.test import Client
+        from .port_sharing import MasterServer, AppWrapper
+        
+        master = MasterServer(port=0)
+        app = Flask("detach")
+        results = []
+        finished = threading.Event()
+        
+        @app.route('/upload', methods=['POST'])
+        def upload():
+            stream = flask_request.environ['wsgi.input']
+            results.append(stream.read(1))
+            time.sleep(0.6)
+            try:
+                results.append(stream.read())
+            except ValueError:
+                results.append(None)
+            finished.set()
+            return "ok"
+        
+        wrapper = AppWrapper(app, "detach", "/detach", master, dispatch_mode='wsgi')
+        threading.Thread(target=app.run, daemon=True).start()
+        try:
+            for _ in range(50):
+                entry = master.registry.snapshot.entries.get("detach")
+                if entry is not None and entry.active:
+                    break
+                time.sleep(0.05)
+            response = Client(master.wsgi_app).post('/detach/upload', data=b"abc",
+                                                    headers={'X-Request-Timeout': '0.2'})
+            self.assertEqual(response.status_code, 504)
+            self.assertTrue(finished.wait(3))
+            self.assertEqual(results, [b"a", None])
+        finally:
+            wrapper.stop()
+    
+    def test_streamed_response_released_when_body_closes(self):
+        """测试流式响应体关闭后才释放并发配额、记录指标和结束应用的在途请求"""
+        from flask import Response as FlaskResponse
+        from werkzeug.test import Client
+        from .performance import get_performance_optimizer
+        from .port_sharing import MasterServer, AppWrapper
+        
+        master = MasterServer(port=0)
+        app = Flask("streamed")
+        app.add_url_rule('/chunks', 'chunks', lambda: FlaskResponse(iter([b"a", b"b", b"c"])))
+        wrapper = AppWrapper(app, "streamed", "/streamed", master)
+        threading.Thread(target=app.run, daemon=True).start()
+        for _ in range(50):
+            entry = master.registry.snapshot.entries.get("streamed")
+            if entry is not None and entry.active:
+                break
+            time.sleep(0.05)
+        
+        optimizer = get_performance_optimizer()
+        requests_before = optimizer.monitor.request_counts["streamed"]
+        try:
+            response = Client(master.wsgi_app).get('/streamed/chunks', buffered=False)
+            self.assertEqual(optimizer.concurrency.get_stats("streamed")["inflight"], 1)
+            self.assertEqual(wrapper.in_flight, 1)
+            self.assertEqual(optimizer.monitor.request_counts["streamed"], requests_before)
+            
+            self.assertEqual(b"".join(response.iter_encoded()), b"abc")
+            response.close()
+            self.assertEqual(optimizer.concurrency.get_stats("streamed")["inflight"], 0)
+            self.assertEqual(wrapper.in_flight, 0)
+            self.assertEqual(optimizer.monitor.request_counts["streamed"], requests_before + 1)
+        finally:
+            wrapper.stop()
+    
+    def test_request_body_without_readinto(self):
+        """测试输入流没有readinto（Werkzeug 2.3之前的LimitedStream）时也能读出完整请求体"""
+        import io
+        from unittest import mock
+        from . import port_sharing
+        
+        class ReadOnlyStream:
+            def __init__(self, data):
+                self.data = io.BytesIO(data)
+            
+            def read(self, size=-1):
+                # 每次最多返回3个字节，模拟分多次到达的请求体
+                return self.data.read(min(size, 3) if size >= 0 else 3)
+        
+        environ = {'CONTENT_LENGTH': '10'}
+        with mock.patch.object(port_sharing, 'get_input_stream',
+                               return_value=ReadOnlyStream(b"0123456789")):
+            body = port_sharing.read_request_body(environ)
+        self.assertEqual(bytes(body), b"0123456789")
+    
+    def test_non_ascii_prefix(self):
+        """测试非ASCII前缀按UTF-8解码后匹配，两种分发模式下应用都能看到去掉前缀后的路径"""
+        from flask import request as flask_request
+        from werkzeug.test import Client
+        from .port_sharing import MasterServer, AppWrapper
+        
+        master = MasterServer(port=0)
+        wrappers = []
+        for mode in ("wsgi", "test_client"):
+            app = Flask(f"unicode_{mode}")
+            app.add_url_rule('/<name>', 'echo', lambda name: f"{flask_request.script_root}|{name}")
+            wrappers.append(AppWrapper(app, f"unicode_{mode}", f"/中文_{mode}", master, dispatch_mode=mode))
+            threading.Thread(target=app.run, daemon=True).start()
+        for _ in range(50):
+            if all(entry.active for entry in master.registry.snapshot.entries.values()):
+                break
+            time.sleep(0.05)
+        
+        client = Client(master.wsgi_app)
+        try:
+            response = client.get('/中文_wsgi/名字')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_data(as_text=True), "/中文_wsgi|名字")
+            
+            response = client.get('/中文_test_client/名字')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_data(as_text=True).split('|')[1], "名字")
+        finally:
+            for wrapper in wrappers:
+                wrapper.stop()
+
 class TestUtilityFunctions(unittest.TestCase):
     """工具函数测试"""
     
@@ -255,6 +2105,19 @@ def run_tests():
     # 添加测试类
     suite.addTests(loader.loadTestsFromTestCase(TestFlaskPortSharing))
     suite.addTests(loader.loadTestsFromTestCase(TestPerformanceOptimization))
+    suite.addTests(loader.loadTestsFromTestCase(TestResponseCorrelator))
+    suite.addTests(loader.loadTestsFromTestCase(TestPrefixTrie))
+    suite.addTests(loader.loadTestsFromTestCase(TestRoutingSnapshot))
+    suite.addTests(loader.loadTestsFromTestCase(TestPriorityScheduling))
+    suite.addTests(loader.loadTestsFromTestCase(TestFairScheduler))
+    suite.addTests(loader.loadTestsFromTestCase(TestRemoteTransport))
+    suite.addTests(loader.loadTestsFromTestCase(TestReverseProxy))
+    suite.addTests(loader.loadTestsFromTestCase(TestAsyncMasterEngine))
+    suite.addTests(loader.loadTestsFromTestCase(TestSelectorMasterEngine))
+    suite.addTests(loader.loadTestsFromTestCase(TestPreforkMaster))
+    suite.addTests(loader.loadTestsFromTestCase(TestMasterCluster))
+    suite.addTests(loader.loadTestsFromTestCase(TestHotReload))
+    suite.addTests(loader.loadTestsFromTestCase(TestMasterWsgiEntry))
     suite.addTests(loader.loadTestsFromTestCase(TestUtilityFunctions))
     
     # 运行测试
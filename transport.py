@@ -0,0 +1,581 @@
+"""
+进程间传输模块
+让运行在其他进程中的Flask应用通过Unix域套接字连接到已有的主控服务器
+
+帧格式见 codec 模块：13字节帧头（消息类型、头部长度、消息体长度）+ 二进制头部 + 原始消息体
+帧既可以直接在Unix域套接字上传输（'socket'），也可以在注册后改走共享内存环形缓冲区（'shm'），
+此时套接字只用于注册和检测对端进程是否退出。
+"""
+
+import logging
+import os
+import queue
+import socket
+import stat
+import threading
+import time
+from typing import Any, BinaryIO, Dict, Optional, Set, Tuple, Union
+
+from flask import Flask
+
+from .codec import FRAME, CodecError, encode_header, decode_header
+from .performance import get_performance_optimizer
+from .proxy import RemoteUpstream, start_upstream_server
+from .port_sharing import (
+    AppRequest, AppResponse, AppWrapper, MasterServer, DISPATCH_MODE_TEST_CLIENT
+)
+from .routing import normalize_prefix
+from .scheduling import PriorityClassifier
+from .shm_transport import (
+    ShmChannel, create_channel_pair, send_channel, receive_channel, shm_supported
+)
+
+logger = logging.getLogger(__name__)
+
+BODY_CHUNK_SIZE = 64 * 1024
+# Unix域套接字文件的默认权限：只有运行主控服务器的用户能连接并注册应用
+DEFAULT_SOCKET_MODE = 0o600
+# 不超过该大小的消息体与帧头合并为一次写入，对端不会先被帧头唤醒再等消息体
+COALESCE_LIMIT = 16 * 1024
+
+# 消息类型
+MSG_REGISTER = 'register'
+MSG_REGISTERED = 'registered'
+MSG_REQUEST = 'request'
+MSG_RESPONSE = 'response'
+
+# 注册后传输请求和响应的通道
+TRANSPORT_SOCKET = 'socket'
+TRANSPORT_SHM = 'shm'
+TRANSPORT_PROXY = 'proxy'  # 应用在自己的进程中运行HTTP服务器，主控经持久连接池转发
+TRANSPORTS = (TRANSPORT_SOCKET, TRANSPORT_SHM, TRANSPORT_PROXY)
+
+# 应用进程断开时，已发出和仍在排队的请求返回的状态码
+APP_GONE_STATUS = 502
+
+def recv_exactly(sock: Union[socket.socket, ShmChannel], size: int) -> bytearray:
+    """读取固定长度的数据，对端关闭时抛出ConnectionError"""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if count == 0:
+            raise ConnectionError("连接已关闭")
+        received += count
+    return buffer
+
+def send_frame(sock: Union[socket.socket, ShmChannel], header: Dict[str, Any],
+               body: Union[bytes, bytearray, memoryview, BinaryIO] = b''):
+    """发送一帧，消息体可以是字节数据或已落盘的文件"""
+    type_code, header_bytes = encode_header(header)
+    if hasattr(body, 'read'):
+        body.seek(0, 2)
+        body_length = body.tell()
+        body.seek(0)
+        sock.sendall(FRAME.pack(type_code, len(header_bytes), body_length) + header_bytes)
+        # 落盘的请求体分块发送，不整体读入内存
+        for chunk in iter(lambda: body.read(BODY_CHUNK_SIZE), b''):
+            sock.sendall(chunk)
+        return
+
+    prefix = FRAME.pack(type_code, len(header_bytes), len(body)) + header_bytes
+    if len(body) <= COALESCE_LIMIT:
+        sock.sendall(b''.join((prefix, body)))
+    else:
+        sock.sendall(prefix)
+        sock.sendall(body)
+
+def recv_frame(sock: Union[socket.socket, ShmChannel]) -> Tuple[Dict[str, Any], bytearray]:
+    """接收一帧，返回 (头部, 消息体)"""
+    type_code, header_length, body_length = FRAME.unpack(recv_exactly(sock, FRAME.size))
+    try:
+        header = decode_header(type_code, recv_exactly(sock, header_length))
+    except CodecError as e:
+        # 字节流已经错位，无法再找到下一帧的边界，只能按连接断开处理
+        raise ConnectionError(f"帧格式错误: {e}") from e
+    body = recv_exactly(sock, body_length) if body_length else bytearray()
+    return header, body
+
+def encode_request(app_request: AppRequest) -> Dict[str, Any]:
+    """把请求转换为帧头部，截止时间以剩余秒数传递（两个进程的单调时钟不可比较）"""
+    return {
+        'type': MSG_REQUEST,
+        'id': app_request.request_id,
+        'method': app_request.method,
+        'path': app_request.path,
+        'headers': list(app_request.headers.items()),
+        'query_string': app_request.query_string,
+        'timeout': app_request.deadline - time.monotonic() if app_request.deadline is not None else None
+    }
+
+def decode_request(header: Dict[str, Any], body: bytearray) -> AppRequest:
+    """从帧还原请求，消息体以memoryview按引用交给应用"""
+    timeout = header.get('timeout')
+    return AppRequest(
+        request_id=header['id'],
+        app_prefix=header['path'],
+        method=header['method'],
+        path=header['path'],
+        headers=dict(header['headers']),
+        data=memoryview(body),
+        query_string=header['query_string'],
+        deadline=time.monotonic() + timeout if timeout is not None else None
+    )
+
+class RemoteAppConnection:
+    """主控进程一侧的进程外应用连接
+
+    应用的请求仍然进入主控服务器的请求队列，优先级、准入控制和并发限制照常生效；
+    发送线程最多让 workers 个请求在应用进程中同时处理，其余请求留在主控的队列里。
+    """
+
+    def __init__(self, master_server: MasterServer, sock: socket.socket):
+        self.master_server = master_server
+        self.sock = sock
+        self.channel: Union[socket.socket, ShmChannel] = sock  # 请求和响应帧走的通道
+        self.app_id: Optional[str] = None
+        self.workers = 1
+        self.credits: Optional[threading.Semaphore] = None
+        self.inflight: Set[int] = set()
+        self.lock = threading.Lock()
+        self.running = False
+        self.upstream: Optional[RemoteUpstream] = None  # 反向代理传输时转发请求的工作线程
+        self.sender_thread: Optional[threading.Thread] = None
+
+    def handshake(self) -> bool:
+        """接收应用的注册消息并在注册器中登记前缀"""
+        header, _ = recv_frame(self.sock)
+        if header.get('type') != MSG_REGISTER:
+            send_frame(self.sock, {'type': MSG_REGISTERED, 'ok': False, 'error': '需要先注册应用'})
+            return False
+
+        registry = self.master_server.registry
+        self.app_id = header['app_id']
+        self.workers = max(1, int(header.get('workers', 1)))
+        prefix = normalize_prefix(header.get('prefix', ''))
+        try:
+            classifier = PriorityClassifier(None, prefix, header.get('priority_rules'))
+            registered = registry.register_app(self.app_id, prefix, None, DISPATCH_MODE_TEST_CLIENT,
+                                               classifier, header.get('priority_weights'))
+        except ValueError as e:
+            send_frame(self.sock, {'type': MSG_REGISTERED, 'ok': False, 'error': str(e)})
+            return False
+        if not registered:
+            send_frame(self.sock, {'type': MSG_REGISTERED, 'ok': False, 'error': f"应用前缀 '{prefix}' 已存在"})
+            return False
+
+        self.credits = threading.Semaphore(self.workers)
+        reply = {'type': MSG_REGISTERED, 'ok': True, 'app_id': self.app_id}
+        transport = header.get('transport', TRANSPORT_SOCKET)
+        if transport == TRANSPORT_PROXY:
+            # 请求不经过套接字，由主控的工作线程经连接池直接发给应用的HTTP服务器
+            self.upstream = RemoteUpstream(self.master_server, self.app_id, prefix,
+                                           int(header['upstream_port']), self.workers,
+                                           health_check_path=header.get('health_check_path'))
+            self.upstream.start()
+            send_frame(self.sock, reply)
+        elif transport == TRANSPORT_SHM and shm_supported():
+            requests, responses = create_channel_pair()
+            reply['shm'] = {'requests': requests.name, 'responses': responses.name}
+            send_frame(self.sock, reply)
+            send_channel(self.sock, requests, responses)
+            self.channel = ShmChannel(tx=requests, rx=responses)
+            # 套接字上不再有数据，读到EOF说明应用进程已退出
+            threading.Thread(target=self.watch_socket, daemon=True,
+                             name=f"port-sharing-watch-{self.app_id[:8]}").start()
+        else:
+            if transport == TRANSPORT_SHM:
+                logger.warning(f"当前平台不支持共享内存传输，应用 {self.app_id} 改用套接字传输")
+            send_frame(self.sock, reply)
+
+        registry.set_app_active(self.app_id, True)
+        logger.info(f"进程外应用已连接: {self.app_id} -> {prefix} ({transport})")
+        return True
+
+    def watch_socket(self):
+        """共享内存模式下检测应用进程退出，关闭通道唤醒接收线程"""
+        try:
+            self.sock.recv(1)
+        except OSError:
+            pass
+        self.channel.close()
+
+    def serve(self):
+        """处理一个连接直到应用进程断开"""
+        try:
+            if not self.handshake():
+                self.sock.close()
+                return
+        except (ConnectionError, OSError, ValueError) as e:
+            logger.warning(f"进程外应用注册失败: {e}")
+            self.sock.close()
+            return
+
+        self.running = True
+        if self.upstream is not None:
+            # 套接字上不再有数据，读到EOF说明应用进程已退出
+            try:
+                self.sock.recv(1)
+            except OSError:
+                pass
+            self.close()
+            return
+
+        self.sender_thread = threading.Thread(target=self.send_loop, daemon=True,
+                                              name=f"port-sharing-send-{self.app_id[:8]}")
+        self.sender_thread.start()
+        try:
+            self.receive_loop()
+        finally:
+            self.close()
+
+    def send_loop(self):
+        """从主控的请求队列取出请求发给应用进程"""
+        registry = self.master_server.registry
+        request_queue = registry.request_queues[self.app_id]
+
+        while self.running:
+            if not self.credits.acquire(timeout=1):
+                continue
+            try:
+                app_request = request_queue.get(timeout=1)
+            except queue.Empty:
+                self.credits.release()
+                continue
+
+            if app_request.cancelled or app_request.expired():
+                registry.responses.discard(app_request.request_id)
+                if hasattr(app_request.data, 'close'):
+                    app_request.data.close()
+                self.credits.release()
+                continue
+
+            with self.lock:
+                self.inflight.add(app_request.request_id)
+            try:
+                send_frame(self.channel, encode_request(app_request), app_request.data)
+            except CodecError as e:
+                # 编码在写入任何字节之前完成，通道仍然可用，只让这一个请求失败
+                logger.warning(f"应用 {self.app_id} 的请求 {app_request.request_id} 无法编码: {e}")
+                self.fail_request(app_request.request_id)
+                self.credits.release()
+            except OSError as e:
+                logger.warning(f"向进程外应用 {self.app_id} 发送请求失败: {e}")
+                self.fail_request(app_request.request_id)
+                self.running = False
+                break
+            finally:
+                if hasattr(app_request.data, 'close'):
+                    app_request.data.close()
+
+    def receive_loop(self):
+        """接收应用进程的响应并交给等待的主控线程"""
+        registry = self.master_server.registry
+        optimizer = get_performance_optimizer()
+
+        while self.running:
+            try:
+                header, body = recv_frame(self.channel)
+            except (ConnectionError, OSError):
+                logger.info(f"进程外应用 {self.app_id} 已断开")
+                return
+
+            if header.get('type') != MSG_RESPONSE:
+                logger.warning(f"进程外应用 {self.app_id} 发送了未知消息: {header.get('type')}")
+                continue
+
+            request_id = header['id']
+            with self.lock:
+                self.inflight.discard(request_id)
+            self.credits.release()
+
+            optimizer.record_app_completion(self.app_id, header.get('service_time', 0.0), self.workers)
+            # WSGI服务器只接受bytes
+            response = AppResponse(request_id, header['status'],
+                                   [tuple(item) for item in header['headers']], bytes(body))
+            if not registry.responses.complete(response):
+                logger.warning(f"应用 {self.app_id} 的请求 {request_id} 已无人等待，响应被丢弃")
+
+    def fail_request(self, request_id: int):
+        """应用进程无法处理的请求立即返回502，不让客户端等到超时"""
+        with self.lock:
+            self.inflight.discard(request_id)
+        self.master_server.registry.responses.complete(AppResponse(
+            request_id, APP_GONE_STATUS, [('Content-Type', 'text/plain; charset=utf-8')],
+            "应用进程已断开".encode('utf-8')))
+
+    def close(self):
+        """应用进程断开：注销前缀，已发出和仍在排队的请求都返回502"""
+        self.running = False
+        registry = self.master_server.registry
+        request_queue = registry.request_queues.get(self.app_id)
+        registry.set_app_active(self.app_id, False)
+        registry.unregister_app(self.app_id)
+        if self.upstream is not None:
+            self.upstream.stop()
+
+        with self.lock:
+            pending = list(self.inflight)
+        if request_queue is not None:
+            while True:
+                try:
+                    pending.append(request_queue.get_nowait().request_id)
+                except queue.Empty:
+                    break
+        for request_id in pending:
+            self.fail_request(request_id)
+
+        if isinstance(self.channel, ShmChannel):
+            self.channel.close()
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        if self.sender_thread and self.sender_thread is not threading.current_thread():
+            self.sender_thread.join(timeout=5)
+        if isinstance(self.channel, ShmChannel):
+            self.channel.release()
+
+class TransportServer:
+    """主控进程中的Unix域套接字监听器，每个连接对应一个进程外应用"""
+
+    def __init__(self, master_server: MasterServer, path: str, mode: int = DEFAULT_SOCKET_MODE):
+        self.master_server = master_server
+        self.path = path
+        self.mode = mode
+        self.sock: Optional[socket.socket] = None
+        self.running = False
+        self.accept_thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.remove_stale_socket()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        # listen之前设置权限，其他用户在权限生效前也无法连接
+        os.chmod(self.path, self.mode)
+        self.sock.listen(64)
+        self.running = True
+        self.accept_thread = threading.Thread(target=self.accept_loop, daemon=True,
+                                              name="port-sharing-transport")
+        self.accept_thread.start()
+        logger.info(f"进程外应用传输监听在 {self.path}")
+
+    def remove_stale_socket(self):
+        """清理上次异常退出留下的套接字文件；路径上有其他进程在监听或不是套接字时拒绝启动"""
+        try:
+            mode = os.stat(self.path).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise RuntimeError(f"{self.path} 已存在且不是套接字")
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except ConnectionRefusedError:
+            # 没有进程在监听，是残留的套接字文件
+            os.unlink(self.path)
+            return
+        except FileNotFoundError:
+            return
+        finally:
+            probe.close()
+        raise RuntimeError(f"已有进程在 {self.path} 上监听")
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                break
+            connection = RemoteAppConnection(self.master_server, conn)
+            threading.Thread(target=connection.serve, daemon=True,
+                             name="port-sharing-remote").start()
+
+    def stop(self):
+        self.running = False
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+        if self.accept_thread:
+            self.accept_thread.join(timeout=5)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+class RemoteAppWrapper(AppWrapper):
+    """应用进程一侧的包装器 - run() 连接主控进程的Unix域套接字并处理分发过来的请求"""
+
+    def __init__(self, app: Flask, app_id: str, prefix: str, socket_path: str,
+                 workers: int = 1, priority_rules: Optional[Dict[str, str]] = None,
+                 priority_weights: Optional[Dict[str, int]] = None,
+                 transport: str = TRANSPORT_SOCKET,
+                 health_check_path: Optional[str] = None):
+        super().__init__(app, app_id, prefix, None, workers=workers,
+                         dispatch_mode=DISPATCH_MODE_TEST_CLIENT, priority_rules=priority_rules,
+                         priority_weights=priority_weights)
+        self.socket_path = socket_path
+        self.transport = transport
+        self.health_check_path = health_check_path
+        self.server = None  # 反向代理传输时应用自己的HTTP服务器
+        self.sock: Optional[socket.socket] = None
+        self.channel: Union[socket.socket, ShmChannel, None] = None
+        self.send_lock = threading.Lock()
+        self.local_queue: queue.Queue = queue.Queue()
+
+    def connect(self):
+        """连接主控进程并注册前缀，失败时抛出RuntimeError"""
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+        register = {
+            'type': MSG_REGISTER,
+            'app_id': self.app_id,
+            'prefix': self.prefix,
+            'workers': self.workers,
+            'priority_rules': self.priority_rules,
+            'priority_weights': self.priority_weights,
+            'transport': self.transport
+        }
+        if self.transport == TRANSPORT_PROXY:
+            self.server, _ = start_upstream_server(self.app, self.prefix)
+            register['upstream_port'] = self.server.server_port
+            register['health_check_path'] = self.health_check_path
+        send_frame(self.sock, register)
+        header, _ = recv_frame(self.sock)
+        if not header.get('ok'):
+            self.sock.close()
+            self.stop_server()
+            raise RuntimeError(header.get('error', '注册失败'))
+
+        if self.transport == TRANSPORT_PROXY:
+            self.channel = self.sock
+        elif 'shm' in header:
+            self.channel = receive_channel(self.sock, header['shm']['requests'], header['shm']['responses'])
+            threading.Thread(target=self.watch_socket, daemon=True,
+                             name=f"port-sharing-watch-{self.app_id[:8]}").start()
+        else:
+            self.channel = self.sock
+
+    def watch_socket(self):
+        """共享内存模式下检测主控进程退出，关闭通道唤醒接收线程"""
+        try:
+            self.sock.recv(1)
+        except OSError:
+            pass
+        self.channel.close()
+
+    def wrapped_run(self, host=None, port=None, debug=None, load_dotenv=True, **options):
+        """重写的run方法 - 连接主控进程而不是启动服务器"""
+        try:
+            self.connect()
+        except (OSError, RuntimeError) as e:
+            logger.error(f"应用 {self.app_id} 连接主控进程失败: {e}")
+            return
+
+        logger.info(f"应用 {self.app_id} 已通过 {self.socket_path} 连接主控进程")
+        self.running = True
+        if self.server is not None:
+            # 请求由主控直接发给应用的HTTP服务器，这里只等待主控断开
+            try:
+                self.sock.recv(1)
+            except (OSError, KeyboardInterrupt):
+                pass
+            finally:
+                self.stop()
+            return
+
+        self.polling_threads = [
+            threading.Thread(target=self.worker_loop, daemon=True,
+                             name=f"port-sharing-{self.app_id[:8]}-{index}")
+            for index in range(self.workers)
+        ]
+        for thread in self.polling_threads:
+            thread.start()
+
+        try:
+            self.receive_loop()
+        except KeyboardInterrupt:
+            logger.info(f"应用 {self.app_id} 收到中断信号")
+        finally:
+            self.stop()
+
+    def receive_loop(self):
+        while self.running:
+            try:
+                header, body = recv_frame(self.channel)
+            except (ConnectionError, OSError):
+                if self.running:
+                    logger.warning(f"应用 {self.app_id} 与主控进程的连接已断开")
+                return
+            if header.get('type') == MSG_REQUEST:
+                self.local_queue.put(decode_request(header, body))
+
+    def worker_loop(self):
+        while self.running:
+            try:
+                app_request = self.local_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            started = time.time()
+            if app_request.expired():
+                # 仍然要回复，主控进程据此收回发送名额
+                logger.warning(f"应用 {self.app_id} 的请求 {app_request.request_id} 已超过截止时间，跳过处理")
+                status_code, headers, body = 504, [], b''
+            else:
+                response = self.process_request(app_request)
+                status_code, headers = response.status_code, response.headers
+                if response.body is not None:
+                    try:
+                        body = b''.join(response.body)
+                    finally:
+                        response.body.close()
+                else:
+                    body = response.data
+
+            header = {
+                'type': MSG_RESPONSE,
+                'id': app_request.request_id,
+                'status': status_code,
+                'headers': list(headers),
+                'service_time': time.time() - started
+            }
+            try:
+                with self.send_lock:
+                    try:
+                        send_frame(self.channel, header, body)
+                    except CodecError as e:
+                        # 仍然要回复，主控进程据此收回发送名额
+                        logger.error(f"应用 {self.app_id} 的请求 {app_request.request_id} 的响应无法编码: {e}")
+                        send_frame(self.channel, dict(header, status=500, headers=[]))
+            except OSError as e:
+                logger.warning(f"应用 {self.app_id} 发送响应失败: {e}")
+
+    def stop(self):
+        """断开与主控进程的连接，主控会注销该应用的前缀"""
+        self.running = False
+        shm_channel = self.channel if isinstance(self.channel, ShmChannel) else None
+        if shm_channel is not None:
+            shm_channel.close()
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+
+        for thread in self.polling_threads:
+            if thread.is_alive() and thread is not threading.current_thread():
+                thread.join(timeout=5)
+        if shm_channel is not None:
+            shm_channel.release()
+        self.stop_server()
+        logger.info(f"应用 {self.app_id} 已停止")
+
+    def stop_server(self):
+        server, self.server = self.server, None
+        if server is not None:
+            server.shutdown()
+            server.server_close()